@@ -0,0 +1,37 @@
+import os
+from typing import Optional, Tuple
+
+# A value at least this many reference-range widths beyond a bound is critical
+ABNORMAL_CRITICAL_DEVIATION = float(os.getenv("ABNORMAL_CRITICAL_DEVIATION", "0.5"))
+
+RESULT_FLAGS = ("low", "normal", "high", "critical")
+
+def classify_result(
+    value: float, min_range: Optional[float], max_range: Optional[float]
+) -> Tuple[Optional[str], Optional[float]]:
+    """Flag a value against its reference range.
+
+    Returns the flag and a signed deviation in reference-range widths (negative
+    below the range, positive above it); both are None when there is no range.
+    Raises ValueError for a two-sided range whose maximum is not above its minimum.
+    """
+    if min_range is None and max_range is None:
+        return None, None
+    if min_range is not None and max_range is not None:
+        if max_range <= min_range:
+            raise ValueError(f"Reference range {min_range}-{max_range} has no width")
+        scale = max_range - min_range
+    else:
+        # One-sided range: measure relative to the bound itself
+        scale = abs(min_range if min_range is not None else max_range) or 1.0
+
+    if min_range is not None and value < min_range:
+        flag, deviation = "low", (value - min_range) / scale
+    elif max_range is not None and value > max_range:
+        flag, deviation = "high", (value - max_range) / scale
+    else:
+        return "normal", 0.0
+
+    if abs(deviation) >= ABNORMAL_CRITICAL_DEVIATION:
+        flag = "critical"
+    return flag, deviation
@@ -0,0 +1,180 @@
+import os
+from typing import Optional
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import TTLCache
+
+# Trend analytics configuration
+ANALYTICS_ROLLING_WINDOW = int(os.getenv("ANALYTICS_ROLLING_WINDOW", "5"))  # draws per rolling window
+ANALYTICS_SHIFT_THRESHOLD = float(os.getenv("ANALYTICS_SHIFT_THRESHOLD", "3.0"))  # t-statistic for a shift
+ANALYTICS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYTICS_CACHE_MAX_ENTRIES", "10000"))
+ANALYTICS_CACHE_TTL_SECONDS = float(os.getenv("ANALYTICS_CACHE_TTL_SECONDS", "3600"))
+
+# Computed trends keyed by series and series version
+trend_cache = TTLCache(maxsize=ANALYTICS_CACHE_MAX_ENTRIES, ttl=ANALYTICS_CACHE_TTL_SECONDS)
+
+# Rollups change whenever a record is added, so their count and last update version a series
+SERIES_VERSIONS_SQL = """
+    SELECT test_category, test_type, sum(value_count) AS value_count, max(updated_at) AS updated_at
+    FROM test_record_rollups
+    WHERE {conditions}
+    GROUP BY test_category, test_type
+    ORDER BY test_category, test_type
+"""
+
+# One row per series with its dates and values as arrays, oldest first
+SERIES_ARRAYS_SQL = text("""
+    SELECT test_category, test_type,
+           array_agg(test_date ORDER BY test_date, id) AS test_dates,
+           array_agg(test_value ORDER BY test_date, id) AS test_values
+    FROM test_records
+    WHERE user_id = :user_id
+      AND (test_category, test_type) IN (
+          SELECT * FROM unnest(CAST(:categories AS text[]), CAST(:test_types AS text[]))
+      )
+    GROUP BY test_category, test_type
+""")
+
+_SECONDS_PER_DAY = 86400.0
+
+def iso_dates(test_dates: np.ndarray) -> list:
+    """Format naive UTC datetime64 values the way the record endpoints do"""
+    micros = test_dates.astype("datetime64[us]")
+    unit = "us" if (micros.astype(np.int64) % 1_000_000).any() else "s"
+    return [value + "Z" for value in np.datetime_as_string(micros, unit=unit)]
+
+def compute_trend(test_dates: np.ndarray, values: np.ndarray, window: int) -> dict:
+    """Compute slope, rolling statistics, rate of change, z-scores and the largest shift of one series.
+
+    test_dates must be sorted ascending; non-finite results serialize as null.
+    Standard deviations, overall and rolling, are sample ones (ddof=1).
+    """
+    n = len(values)
+    elapsed = (test_dates - test_dates[0]).astype("timedelta64[us]").astype(np.int64)
+    days = elapsed / (1e6 * _SECONDS_PER_DAY)
+    mean = values.mean()
+    centered = values - mean
+    std = values.std(ddof=1) if n > 1 else 0.0
+
+    # Least-squares slope in value units per day
+    day_offsets = days - days.mean()
+    denominator = (day_offsets * day_offsets).sum()
+    slope = (day_offsets * centered).sum() / denominator if denominator > 0 else None
+
+    # Trailing rolling mean and sample standard deviation from prefix sums (partial windows at the
+    # start; a window of one draw has no standard deviation)
+    prefix = np.concatenate(([0.0], np.cumsum(centered)))
+    prefix_squares = np.concatenate(([0.0], np.cumsum(centered * centered)))
+    index = np.arange(n)
+    start = np.maximum(index - window + 1, 0)
+    counts = index - start + 1
+    window_sum = prefix[index + 1] - prefix[start]
+    window_mean = window_sum / counts
+    window_squares = np.maximum(prefix_squares[index + 1] - prefix_squares[start] - counts * window_mean ** 2, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        window_var = np.where(counts > 1, window_squares / (counts - 1), np.nan)
+
+    # Change between consecutive draws per day; undefined for the first draw and same-time draws
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.concatenate(([np.nan], np.diff(values) / np.diff(days)))
+        rate[~np.isfinite(rate)] = np.nan
+        z_scores = centered / std if std > 0 else np.zeros(n)
+
+    return {
+        "count": n,
+        "mean": float(mean),
+        "std": float(std),
+        "slopePerDay": None if slope is None else float(slope),
+        "changePoint": _change_point(test_dates, centered, prefix, prefix_squares, mean),
+        "testDates": iso_dates(test_dates),
+        "values": values.tolist(),
+        "rollingMean": (window_mean + mean).tolist(),
+        "rollingStd": np.sqrt(window_var).tolist(),
+        "rateOfChangePerDay": rate.tolist(),
+        "zScore": z_scores.tolist(),
+    }
+
+def _change_point(test_dates, centered, prefix, prefix_squares, mean) -> Optional[dict]:
+    """Find the split with the largest two-sample t-statistic between the means before and after it"""
+    n = len(centered)
+    if n < 4:
+        return None
+    # Split k puts draws [0, k) before the shift and [k, n) after it; at least two draws each side
+    k = np.arange(2, n - 1)
+    before_mean = prefix[k] / k
+    after_mean = (prefix[n] - prefix[k]) / (n - k)
+    residual = (prefix_squares[k] - k * before_mean ** 2) + (prefix_squares[n] - prefix_squares[k] - (n - k) * after_mean ** 2)
+    pooled_std = np.sqrt(np.maximum(residual, 0.0) / (n - 2))
+    difference = np.abs(after_mean - before_mean)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = difference / (pooled_std * np.sqrt(1.0 / k + 1.0 / (n - k)))
+    # A noiseless step is an infinitely strong shift; a flat series has none
+    scores = np.where(pooled_std > 0, scores, np.where(difference > 0, np.inf, 0.0))
+    best = int(np.argmax(scores))
+    if scores[best] < ANALYTICS_SHIFT_THRESHOLD:
+        return None
+    split = int(k[best])
+    # JSON has no infinity, so an unbounded score is reported as None
+    return {
+        "index": split,
+        "testDate": iso_dates(test_dates[split:split + 1])[0],
+        "meanBefore": float(before_mean[best] + mean),
+        "meanAfter": float(after_mean[best] + mean),
+        "score": float(scores[best]) if np.isfinite(scores[best]) else None,
+    }
+
+async def series_trends(
+    db: AsyncSession,
+    user_id: UUID,
+    window: int,
+    category: Optional[str] = None,
+    test_type: Optional[str] = None,
+) -> list:
+    """Trends for one or all of a user's series, recomputing only series that changed"""
+    conditions = ["user_id = :user_id", "bucket = 'month'"]
+    params = {"user_id": user_id}
+    if category is not None:
+        conditions.append("test_category = :category")
+        params["category"] = category
+    if test_type is not None:
+        conditions.append("test_type = :test_type")
+        params["test_type"] = test_type
+    result = await db.execute(text(SERIES_VERSIONS_SQL.format(conditions=" AND ".join(conditions))), params)
+    versions = result.fetchall()
+
+    trends, stale = {}, {}
+    for row in versions:
+        series = (row.test_category, row.test_type)
+        key = (user_id, *series, window, row.value_count, row.updated_at)
+        cached = trend_cache.get(key)
+        if cached is None:
+            stale[series] = key
+        else:
+            trends[series] = cached
+
+    if stale:
+        result = await db.execute(SERIES_ARRAYS_SQL, {
+            "user_id": user_id,
+            "categories": [series[0] for series in stale],
+            "test_types": [series[1] for series in stale],
+        })
+        for row in result.fetchall():
+            series = (row.test_category, row.test_type)
+            trend = {
+                "testCategory": row.test_category,
+                "testType": row.test_type,
+                "window": window,
+                **compute_trend(
+                    np.array(row.test_dates, dtype="datetime64[us]"),
+                    np.array(row.test_values, dtype=np.float64),
+                    window,
+                ),
+            }
+            trends[series] = trend
+            trend_cache.set(stale[series], trend)
+
+    return [trends[series] for series in ((row.test_category, row.test_type) for row in versions) if series in trends]
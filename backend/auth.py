@@ -1,13 +1,22 @@
 from datetime import datetime, timedelta
 from typing import Optional
+from uuid import UUID
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import hashlib
+import hmac
+import math
+import os
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import engine, read_session, mark_write, REPLICA_STICKY_SECONDS
 from models import User
+from cache import TTLCache
 
 # Security configuration
 SECRET_KEY = "your-secret-key-here"  # Change this in production
@@ -17,8 +26,26 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 30  # 30 days for remember me
 REFRESH_TOKEN_EXPIRE_HOURS = 24  # 24 hours for normal refresh
 
+# Roles allowed to read other patients' records
+CLINICIAN_ROLES = ("doctor", "admin")
+
+# Authenticated user cache configuration
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+# When enabled, the signed identity claims in access tokens are trusted without a database lookup
+AUTH_TRUST_TOKEN_CLAIMS = os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "false").lower() == "true"
+
+# Password hashing pool configuration
+HASH_POOL_KIND = os.getenv("HASH_POOL_KIND", "thread")  # thread or process
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(os.cpu_count() or 2)))
+HASH_POOL_MAX_QUEUE = int(os.getenv("HASH_POOL_MAX_QUEUE", "32"))  # waiting jobs before rejecting
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+user_cache = TTLCache(maxsize=USER_CACHE_MAX_ENTRIES, ttl=USER_CACHE_TTL_SECONDS)
+# Postgres NOTIFY channel on which workers announce changed users, by email
+USER_CACHE_CHANNEL = "user_cache_invalidation"
+_user_cache_listener = None
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify password against hash"""
@@ -28,6 +55,130 @@ def hash_password(password: str) -> str:
     """Hash password"""
     return pwd_context.hash(password)
 
+_hash_executor: Optional[Executor] = None
+_hash_stats = {
+    "completed": 0,
+    "total_seconds": 0.0,
+    "max_seconds": 0.0,
+    "in_flight": 0,
+    "peak_in_flight": 0,
+    "rejected": 0,
+    "failed": 0,
+}
+
+def _get_hash_executor() -> Executor:
+    """Create the hashing pool on first use so forked workers get their own"""
+    global _hash_executor
+    if _hash_executor is None:
+        if HASH_POOL_KIND == "process":
+            _hash_executor = ProcessPoolExecutor(max_workers=HASH_POOL_WORKERS)
+        else:
+            _hash_executor = ThreadPoolExecutor(max_workers=HASH_POOL_WORKERS, thread_name_prefix="bcrypt")
+    return _hash_executor
+
+async def _run_in_hash_pool(func, *args):
+    """Run a bcrypt operation off the event loop, rejecting work when the pool is saturated"""
+    if _hash_stats["in_flight"] >= HASH_POOL_WORKERS + HASH_POOL_MAX_QUEUE:
+        _hash_stats["rejected"] += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": "1"}
+        )
+    
+    _hash_stats["in_flight"] += 1
+    _hash_stats["peak_in_flight"] = max(_hash_stats["peak_in_flight"], _hash_stats["in_flight"])
+    started = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(_get_hash_executor(), func, *args)
+    except BaseException:
+        _hash_stats["failed"] += 1
+        raise
+    else:
+        elapsed = time.perf_counter() - started
+        _hash_stats["completed"] += 1
+        _hash_stats["total_seconds"] += elapsed
+        _hash_stats["max_seconds"] = max(_hash_stats["max_seconds"], elapsed)
+        return result
+    finally:
+        _hash_stats["in_flight"] -= 1
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify password against hash in the hashing pool"""
+    return await _run_in_hash_pool(verify_password, plain_password, hashed_password)
+
+async def hash_password_async(password: str) -> str:
+    """Hash password in the hashing pool"""
+    return await _run_in_hash_pool(hash_password, password)
+
+def hash_pool_stats() -> dict:
+    """Latency and saturation counters for the hashing pool"""
+    completed = _hash_stats["completed"]
+    return {
+        "kind": HASH_POOL_KIND,
+        "workers": HASH_POOL_WORKERS,
+        "maxQueue": HASH_POOL_MAX_QUEUE,
+        "inFlight": _hash_stats["in_flight"],
+        "queued": max(0, _hash_stats["in_flight"] - HASH_POOL_WORKERS),
+        "peakInFlight": _hash_stats["peak_in_flight"],
+        "completed": completed,
+        "rejected": _hash_stats["rejected"],
+        "failed": _hash_stats["failed"],
+        "totalSeconds": _hash_stats["total_seconds"],
+        "avgSeconds": _hash_stats["total_seconds"] / completed if completed else 0.0,
+        "maxSeconds": _hash_stats["max_seconds"],
+    }
+
+def shutdown_hash_pool():
+    """Stop the hashing pool workers"""
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False)
+        _hash_executor = None
+
+def user_claims(user) -> dict:
+    """Identity claims embedded in access tokens for the trusted-claims fast path"""
+    return {
+        "uid": str(user.id),
+        "role": user.role,
+        "verified": bool(user.email_verified),
+        "fn": user.first_name,
+        "ln": user.last_name,
+    }
+
+async def invalidate_cached_user(db: AsyncSession, email: str):
+    """Drop a user from every worker's authenticated user cache when the caller's transaction commits.
+
+    This worker drops it right away; the others hear of it through NOTIFY, which Postgres
+    delivers on commit. A worker whose listener connection is lost falls back to the cache TTL.
+    """
+    user_cache.pop(email)
+    await db.execute(text("SELECT pg_notify(:channel, :email)"), {"channel": USER_CACHE_CHANNEL, "email": email})
+
+def _on_user_changed(connection, pid, channel, email):
+    user_cache.pop(email)
+
+def _on_listener_lost(connection):
+    print("User cache listener connection lost; cached users now expire by TTL only")
+
+async def start_user_cache_listener():
+    """LISTEN for changed users on a dedicated connection held for the worker's lifetime"""
+    global _user_cache_listener
+    if USER_CACHE_TTL_SECONDS <= 0 or _user_cache_listener is not None:
+        return
+    connection = await engine.connect()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.add_listener(USER_CACHE_CHANNEL, _on_user_changed)
+    raw_connection.driver_connection.add_termination_listener(_on_listener_lost)
+    _user_cache_listener = connection
+
+async def stop_user_cache_listener():
+    global _user_cache_listener
+    if _user_cache_listener is not None:
+        await _user_cache_listener.close()
+        _user_cache_listener = None
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -39,14 +190,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def create_refresh_token(data: dict, remember_me: bool = False):
+def refresh_token_expiry(remember_me: bool = False) -> datetime:
+    """Expiry time for a refresh token issued now"""
+    if remember_me:
+        return datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    return datetime.utcnow() + timedelta(hours=REFRESH_TOKEN_EXPIRE_HOURS)
+
+def create_refresh_token(data: dict, remember_me: bool = False, expire: Optional[datetime] = None):
     """Create JWT refresh token"""
     to_encode = data.copy()
-    if remember_me:
-        expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    else:
-        expire = datetime.utcnow() + timedelta(hours=REFRESH_TOKEN_EXPIRE_HOURS)
-    to_encode.update({"exp": expire, "type": "refresh"})
+    to_encode.update({"exp": expire or refresh_token_expiry(remember_me), "type": "refresh"})
     encoded_jwt = jwt.encode(to_encode, REFRESH_SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -66,9 +219,41 @@ def verify_refresh_token(token: str):
             detail="Invalid refresh token"
         )
 
+# Cookie carrying the signed time of the user's last write, so any worker keeps their reads on the primary
+WRITE_HINT_COOKIE = "last_write"
+
+def _sign_write_hint(email: str, written_at: str) -> str:
+    return hmac.new(SECRET_KEY.encode(), f"{email}|{written_at}".encode(), hashlib.sha256).hexdigest()
+
+def remember_write(response: Response, email: str):
+    """Keep the user's reads on the primary after a write, in this worker and through the hint cookie"""
+    mark_write(email)
+    written_at = f"{time.time():.3f}"
+    response.set_cookie(
+        WRITE_HINT_COOKIE,
+        f"{written_at}.{_sign_write_hint(email, written_at)}",
+        max_age=math.ceil(REPLICA_STICKY_SECONDS),
+        path="/api",
+        httponly=True,
+        samesite="lax",
+    )
+
+def read_write_hint(request: Request, email: str) -> Optional[float]:
+    """Time of the user's last write from the hint cookie, None when absent or not signed for them"""
+    hint = request.cookies.get(WRITE_HINT_COOKIE)
+    if not hint:
+        return None
+    written_at, _, signature = hint.rpartition(".")
+    if not hmac.compare_digest(signature, _sign_write_hint(email, written_at)):
+        return None
+    try:
+        return float(written_at)
+    except ValueError:
+        return None
+
 async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
     """Get current user from JWT token"""
     credentials_exception = HTTPException(
@@ -85,17 +270,35 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
+    # Trust the signed claims instead of loading the user; changes to role or
+    # verification status then take effect when the access token is renewed
+    if AUTH_TRUST_TOKEN_CLAIMS and "uid" in payload:
+        return User(
+            id=UUID(payload["uid"]),
+            email=email,
+            first_name=payload.get("fn"),
+            last_name=payload.get("ln"),
+            role=payload.get("role"),
+            is_active=True,
+            email_verified=bool(payload.get("verified"))
+        )
+    
+    cached_user = user_cache.get(email)
+    if cached_user is not None:
+        return cached_user
+    
     # Get user from database
-    result = await db.execute(
-        text("SELECT * FROM users WHERE email = :email"),
-        {"email": email}
-    )
-    user = result.fetchone()
+    async with read_session(email, read_write_hint(request, email)) as db:
+        result = await db.execute(
+            text("SELECT * FROM users WHERE email = :email"),
+            {"email": email}
+        )
+        user = result.fetchone()
     
     if user is None:
         raise credentials_exception
     
-    return User(
+    current_user = User(
         id=user.id,
         email=user.email,
         hashed_password=user.hashed_password,
@@ -106,4 +309,19 @@ async def get_current_user(
         email_verified=user.email_verified,
         created_at=user.created_at,
         updated_at=user.updated_at
-    )
\ No newline at end of file
+    )
+    user_cache.set(email, current_user)
+    return current_user
+
+async def get_read_db(request: Request, current_user: User = Depends(get_current_user)):
+    """Get a read-only session, kept on the primary briefly after the user writes"""
+    async with read_session(current_user.email, read_write_hint(request, current_user.email)) as session:
+        yield session
+
+def require_roles(*roles: str):
+    """Dependency that only admits users with one of the given roles"""
+    async def check_role(current_user: User = Depends(get_current_user)) -> User:
+        if current_user.role not in roles:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed for this role")
+        return current_user
+    return check_role
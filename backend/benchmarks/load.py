@@ -0,0 +1,260 @@
+"""Drive the API with seeded bench patients and report latency per endpoint.
+
+Seed first with benchmarks.seed, start the API with RATE_LIMIT_BACKEND=none (every
+virtual user logs in from this one IP, so the auth rate limiter would otherwise answer
+429 and the run would measure it instead of the API), then from the backend directory:
+
+    python -m benchmarks.load --concurrency 20 --duration 60 --output results.json
+    python -m benchmarks.load --baseline baseline.json   # exit 1 on regression
+
+Each virtual user logs in as a bench patient and then loops over a weighted
+mix of requests until the duration ends.
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from benchmarks.panels import BENCH_EMAIL, DEFAULT_PASSWORD, PANELS
+
+DEFAULT_MIX = "login=1,refresh=1,bulk=2,list=4,category=8"
+PERCENTILES = (50, 95, 99)
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q / 100.0 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+class Stats:
+    """Latencies and status codes recorded per endpoint"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.recording = False
+        # Counted during warmup too: any 429 means the run measured the rate limiter
+        self.rate_limited = 0
+
+    def record(self, endpoint: str, seconds: float, status_code: int):
+        if status_code == 429:
+            self.rate_limited += 1
+        if not self.recording:
+            return
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        codes = self.statuses.setdefault(endpoint, {})
+        codes[status_code] = codes.get(status_code, 0) + 1
+
+    def report(self, duration: float) -> dict:
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values.sort()
+            codes = self.statuses[endpoint]
+            errors = sum(count for code, count in codes.items() if code == 0 or code >= 400)
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "errors": errors,
+                "errorRate": errors / len(values),
+                "throughput": len(values) / duration,
+                "meanMs": 1000 * sum(values) / len(values),
+                **{f"p{q}Ms": 1000 * percentile(values, q) for q in PERCENTILES},
+                "maxMs": 1000 * values[-1],
+                "statuses": {str(code): count for code, count in sorted(codes.items())},
+            }
+        return endpoints
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, stats: Stats, email: str, password: str, rng: random.Random):
+        self.client = client
+        self.stats = stats
+        self.email = email
+        self.password = password
+        self.rng = rng
+        self.access_token = None
+        self.refresh_token = None
+
+    async def call(self, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        if self.access_token and "headers" not in kwargs:
+            kwargs["headers"] = {"Authorization": f"Bearer {self.access_token}"}
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.stats.record(endpoint, time.perf_counter() - started, 0)
+            return None
+        self.stats.record(endpoint, time.perf_counter() - started, response.status_code)
+        return response
+
+    async def login(self):
+        response = await self.call("login", "POST", "/api/auth/login", json={
+            "email": self.email, "password": self.password, "rememberMe": False,
+        }, headers={})
+        if response is not None and response.status_code == 200:
+            tokens = response.json()
+            self.access_token = tokens["access_token"]
+            self.refresh_token = tokens["refresh_token"]
+
+    async def refresh(self):
+        response = await self.call("refresh", "POST", "/api/auth/refresh", json={"refresh_token": self.refresh_token})
+        if response is not None and response.status_code == 200:
+            tokens = response.json()
+            self.access_token = tokens["access_token"]
+            self.refresh_token = tokens.get("refresh_token", self.refresh_token)
+
+    async def bulk(self):
+        category = self.rng.choice(sorted(PANELS))
+        # Distinct draw times keep the bulk endpoint's duplicate check from rejecting the panel
+        test_date = datetime.now(timezone.utc) - timedelta(days=self.rng.randint(1, 3650), seconds=self.rng.randint(0, 86399))
+        records = [
+            {
+                "testCategory": category,
+                "testType": test_type,
+                "testValue": round(self.rng.uniform(low * 0.8, high * 1.2), 2),
+                "unit": unit,
+                "minRange": low,
+                "maxRange": high,
+                "testDate": test_date.isoformat(),
+            }
+            for test_type, unit, low, high in PANELS[category][1]
+        ]
+        await self.call("bulk", "POST", "/api/test-records/bulk", json={"records": records}, headers={
+            "Authorization": f"Bearer {self.access_token}", "Idempotency-Key": str(uuid.uuid4()),
+        })
+
+    async def list(self):
+        await self.call("list", "GET", "/api/test-records")
+
+    async def category(self):
+        category = self.rng.choice(sorted(PANELS))
+        test_type = self.rng.choice(PANELS[category][1])[0]
+        start = (datetime.now(timezone.utc) - timedelta(days=180)).replace(hour=0, minute=0, second=0, microsecond=0)
+        await self.call("category", "GET", f"/api/test-records/category/{category}", params={
+            "testType": test_type,
+            "from": start.isoformat(),
+            "fields": "id,testValue,minRange,maxRange,testDate",
+        })
+
+    async def run(self, operations: list, weights: list, deadline: float):
+        await self.login()
+        while time.monotonic() < deadline:
+            operation = self.rng.choices(operations, weights)[0]
+            if operation != "login" and self.access_token is None:
+                operation = "login"
+            await getattr(self, operation)()
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ("login", "refresh", "bulk", "list", "category"):
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of p95 latency, throughput or error rate against a baseline run"""
+    regressions = []
+    for endpoint, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if previous is None:
+            continue
+        if current["p95Ms"] > previous["p95Ms"] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {previous['p95Ms']:.1f} -> {current['p95Ms']:.1f} ms")
+        if current["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(f"{endpoint}: throughput {previous['throughput']:.1f} -> {current['throughput']:.1f} req/s")
+        if current["errorRate"] > previous["errorRate"] + 0.01:
+            regressions.append(f"{endpoint}: error rate {previous['errorRate']:.2%} -> {current['errorRate']:.2%}")
+    return regressions
+
+def print_report(results: dict, baseline: dict = None):
+    print(f"{'endpoint':<10}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for endpoint, row in results["endpoints"].items():
+        line = (f"{endpoint:<10}{row['requests']:>10}{row['throughput']:>10.1f}"
+                f"{row['p50Ms']:>10.1f}{row['p95Ms']:>10.1f}{row['p99Ms']:>10.1f}{row['errors']:>8}")
+        previous = (baseline or {}).get("endpoints", {}).get(endpoint)
+        if previous:
+            change = (row["p95Ms"] - previous["p95Ms"]) / previous["p95Ms"] * 100 if previous["p95Ms"] else 0.0
+            line += f"   p95 {change:+.0f}% vs baseline"
+        print(line)
+
+async def run(args) -> dict:
+    weights = parse_mix(args.mix)
+    stats = Stats()
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout, verify=False) as client:
+        started = time.monotonic()
+        deadline = started + args.warmup + args.duration
+        users = [
+            VirtualUser(client, stats, BENCH_EMAIL.format(index % args.patients), args.password, random.Random(rng.random()))
+            for index in range(args.concurrency)
+        ]
+        tasks = [asyncio.create_task(user.run(list(weights), list(weights.values()), deadline)) for user in users]
+        await asyncio.sleep(args.warmup)
+        stats.recording = True
+        await asyncio.gather(*tasks)
+        measured = time.monotonic() - started - args.warmup
+
+    return {
+        "startedAt": datetime.now(timezone.utc).isoformat(),
+        "baseUrl": args.base_url,
+        "concurrency": args.concurrency,
+        "durationSeconds": measured,
+        "mix": weights,
+        "host": platform.node(),
+        "rateLimited": stats.rate_limited,
+        "endpoints": stats.report(measured),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--patients", type=int, default=1000, help="number of seeded bench patients to log in as")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users running at once")
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds before measuring starts")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted operations, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a saved results file")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(results, baseline)
+
+    if results["rateLimited"]:
+        print(f"\n{results['rateLimited']} request(s) were rate limited (429); results are not valid.")
+        print("Restart the API with RATE_LIMIT_BACKEND=none and run again.")
+        sys.exit(2)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+if __name__ == "__main__":
+    main()
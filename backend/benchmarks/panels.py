@@ -0,0 +1,31 @@
+"""Synthetic patient identities and lab panels shared by the benchmarks"""
+
+BENCH_EMAIL = "bench-{:06d}@example.com"
+BENCH_EMAIL_PATTERN = "bench-%@example.com"
+DEFAULT_PASSWORD = "benchmark-password"
+
+# Panels matching the default test_panels rows, with adult reference ranges
+PANELS = {
+    "CBC": ("Complete Blood Count", [
+        ("RBC", "10^6/uL", 4.2, 5.9),
+        ("HB", "g/dL", 12.0, 17.5),
+        ("PLATELETS", "10^3/uL", 150.0, 450.0),
+        ("WBC", "10^3/uL", 4.0, 11.0),
+    ]),
+    "KFT": ("Kidney Function Test", [
+        ("POTASSIUM", "mmol/L", 3.5, 5.1),
+        ("UREA", "mg/dL", 15.0, 45.0),
+        ("CREATININE", "mg/dL", 0.6, 1.3),
+        ("eGFR", "mL/min/1.73m2", 90.0, 120.0),
+    ]),
+    "LFT": ("Liver Function Test", [
+        ("ALT", "U/L", 7.0, 56.0),
+        ("AST", "U/L", 10.0, 40.0),
+        ("ALP", "U/L", 44.0, 147.0),
+        ("GGT", "U/L", 9.0, 48.0),
+        ("T-BIL", "mg/dL", 0.1, 1.2),
+        ("D-BIL", "mg/dL", 0.0, 0.3),
+        ("TOTAL PROTEIN", "g/dL", 6.0, 8.3),
+        ("ALBUMIN", "g/dL", 3.5, 5.0),
+    ]),
+}
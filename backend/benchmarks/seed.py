@@ -0,0 +1,137 @@
+"""Seed the database with synthetic patients and lab histories for benchmarking.
+
+Run from the backend directory against a local database:
+
+    python -m benchmarks.seed --patients 1000 --draws 24
+
+Patients are bench-NNNNNN@example.com with a shared password, verified, so
+benchmarks.load can log in as them. --reset removes earlier bench patients.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from abnormal import classify_result
+from auth import pwd_context
+from database import async_session, engine, wait_for_db
+from rollups import apply_rollups
+from catalogue import apply_catalogue
+from benchmarks.panels import BENCH_EMAIL, BENCH_EMAIL_PATTERN, DEFAULT_PASSWORD, PANELS
+
+USER_COLUMNS = (
+    "id", "email", "hashed_password", "first_name", "last_name", "role",
+    "is_active", "email_verified", "created_at", "updated_at",
+)
+RECORD_COLUMNS = (
+    "id", "user_id", "test_category", "test_type", "test_value", "unit", "min_range", "max_range",
+    "test_date", "notes", "result_flag", "range_deviation", "created_at", "updated_at",
+)
+
+Record = namedtuple("Record", RECORD_COLUMNS)
+
+# Smallest value at the seeded two-decimal precision; the API only accepts positive values
+MIN_TEST_VALUE = 0.01
+
+def patient_history(rng: random.Random, user_id: uuid.UUID, draws: int, now: datetime) -> list:
+    """Lab draws every one to three months, with a per-patient baseline and slow drift per test"""
+    panels = rng.sample(sorted(PANELS), k=rng.randint(1, len(PANELS)))
+    profile = {}
+    for category in panels:
+        for test_type, _, low, high in PANELS[category][1]:
+            width = high - low
+            # Most patients sit inside the range; some run high or low
+            center = rng.gauss((low + high) / 2, width * 0.35)
+            profile[(category, test_type)] = (center, rng.gauss(0, width * 0.02), width * 0.08)
+
+    records = []
+    draw_date = now - timedelta(days=rng.randint(0, 14))
+    dates = []
+    for _ in range(draws):
+        dates.append(draw_date.replace(hour=rng.randint(7, 11), minute=rng.choice((0, 15, 30, 45)), second=0, microsecond=0))
+        draw_date -= timedelta(days=rng.randint(30, 90))
+    for index, test_date in enumerate(reversed(dates)):
+        for category in panels:
+            for test_type, unit, low, high in PANELS[category][1]:
+                center, drift, noise = profile[(category, test_type)]
+                value = max(round(rng.gauss(center + drift * index, noise), 2), MIN_TEST_VALUE)
+                flag, deviation = classify_result(value, low, high)
+                records.append(Record(
+                    uuid.uuid4(), user_id, category, test_type, value, unit, low, high,
+                    test_date, "fasting" if rng.random() < 0.05 else None, flag, deviation, test_date, test_date,
+                ))
+    return records
+
+async def copy_rows(db, table: str, columns: tuple, rows: list):
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(table, records=rows, columns=list(columns))
+
+async def seed(patients: int, draws: int, password: str, reset: bool, seed_value: int, batch: int):
+    rng = random.Random(seed_value)
+    hashed_password = pwd_context.hash(password)
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    total_records = 0
+
+    async with async_session() as db:
+        if reset:
+            await db.execute(text("DELETE FROM users WHERE email LIKE :pattern"), {"pattern": BENCH_EMAIL_PATTERN})
+        for name, (display_name, tests) in PANELS.items():
+            await db.execute(
+                text("""
+                    INSERT INTO test_panels (id, name, display_name, description, tests, is_active, created_at, updated_at)
+                    VALUES (:id, :name, :display_name, :display_name, :tests, true, :now, :now)
+                    ON CONFLICT (name) DO NOTHING
+                """),
+                {"id": uuid.uuid4(), "name": name, "display_name": display_name,
+                 "tests": json.dumps([test[0] for test in tests]), "now": now}
+            )
+        await db.commit()
+
+        for first in range(0, patients, batch):
+            users, records = [], []
+            histories = []
+            for number in range(first, min(first + batch, patients)):
+                user_id = uuid.uuid4()
+                users.append((user_id, BENCH_EMAIL.format(number), hashed_password, "Bench", f"Patient {number}",
+                              "patient", True, True, now, now))
+                history = patient_history(rng, user_id, draws, now)
+                histories.append((user_id, history))
+                records.extend(history)
+            await copy_rows(db, "users", USER_COLUMNS, users)
+            await copy_rows(db, "test_records", RECORD_COLUMNS, records)
+            for user_id, history in histories:
+                await apply_rollups(db, user_id, history)
+                await apply_catalogue(db, user_id, history)
+            await db.commit()
+            total_records += len(records)
+            print(f"seeded {first + len(users)}/{patients} patients, {total_records} records")
+
+    elapsed = time.perf_counter() - started
+    print(f"done in {elapsed:.1f}s ({total_records / elapsed:.0f} records/s)")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--draws", type=int, default=24, help="lab draws per patient")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--seed", type=int, default=42, help="random seed, for reproducible data")
+    parser.add_argument("--batch", type=int, default=200, help="patients per transaction")
+    parser.add_argument("--reset", action="store_true", help="delete existing bench patients first")
+    args = parser.parse_args()
+
+    await wait_for_db()
+    try:
+        await seed(args.patients, args.draws, args.password, args.reset, args.seed, args.batch)
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""Compare the Pydantic response path with the direct row-to-JSON path.
+
+Run from the backend directory:
+
+    python -m benchmarks.serialization_bench --rows 5000 --repeat 5
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+
+from abnormal import classify_result
+from schemas import TestRecordResponse
+from serialization import records_to_json
+
+Row = namedtuple("Row", [
+    "id", "user_id", "test_category", "test_type", "test_value", "unit", "min_range",
+    "max_range", "test_date", "notes", "result_flag", "range_deviation", "created_at", "updated_at",
+])
+
+def make_rows(count: int) -> list:
+    user_id = uuid.uuid4()
+    start = datetime(2020, 1, 1, 8, 30)
+    rows = []
+    for index in range(count):
+        test_date = start + timedelta(days=index // 4, minutes=index % 4)
+        test_value = round(random.uniform(1, 400), 2)
+        min_range = 12.0 if index % 3 else None
+        rows.append(Row(
+            uuid.uuid4(), user_id, "CBC", random.choice(["HB", "RBC", "WBC", "PLATELETS"]),
+            test_value, "g/dL", min_range, 16.0,
+            test_date, "fasting" if index % 10 == 0 else None,
+            *classify_result(test_value, min_range, 16.0),
+            test_date + timedelta(hours=1, microseconds=index), test_date + timedelta(hours=1),
+        ))
+    return rows
+
+def pydantic_path(rows: list) -> bytes:
+    """What the read endpoints did before: one validated model per row, then FastAPI's encoder"""
+    payload = [
+        TestRecordResponse(
+            id=record.id,
+            userId=record.user_id,
+            testCategory=record.test_category,
+            testType=record.test_type,
+            testValue=record.test_value,
+            unit=record.unit,
+            minRange=record.min_range,
+            maxRange=record.max_range,
+            testDate=record.test_date,
+            notes=record.notes,
+            createdAt=record.created_at,
+            updatedAt=record.updated_at,
+            resultFlag=record.result_flag,
+            rangeDeviation=record.range_deviation
+        )
+        for record in rows
+    ]
+    return json.dumps(
+        jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+def best_of(func, rows: list, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(rows)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    if json.loads(pydantic_path(rows)) != json.loads(records_to_json(rows)):
+        raise SystemExit("Serialized output differs between the two paths")
+
+    slow = best_of(pydantic_path, rows, args.repeat)
+    fast = best_of(records_to_json, rows, args.repeat)
+    print(f"rows:            {args.rows}")
+    print(f"pydantic path:   {slow * 1000:9.2f} ms")
+    print(f"direct path:     {fast * 1000:9.2f} ms")
+    print(f"speedup:         {slow / fast:9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+from datetime import datetime, timezone
+from typing import Iterable
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+UPSERT_CATALOGUE_SQL = text("""
+    INSERT INTO user_test_catalogue AS c (
+        user_id, test_category, test_type, unit, record_count,
+        first_test_date, last_test_date, last_value, last_result_flag, updated_at
+    ) VALUES (
+        :user_id, :test_category, :test_type, :unit, :record_count,
+        :first_test_date, :last_test_date, :last_value, :last_result_flag, :updated_at
+    )
+    ON CONFLICT (user_id, test_category, test_type) DO UPDATE SET
+        record_count = c.record_count + EXCLUDED.record_count,
+        first_test_date = LEAST(c.first_test_date, EXCLUDED.first_test_date),
+        last_value = CASE
+            WHEN EXCLUDED.last_test_date >= c.last_test_date THEN EXCLUDED.last_value
+            ELSE c.last_value
+        END,
+        last_result_flag = CASE
+            WHEN EXCLUDED.last_test_date >= c.last_test_date THEN EXCLUDED.last_result_flag
+            ELSE c.last_result_flag
+        END,
+        unit = CASE
+            WHEN EXCLUDED.last_test_date >= c.last_test_date THEN EXCLUDED.unit
+            ELSE c.unit
+        END,
+        last_test_date = GREATEST(c.last_test_date, EXCLUDED.last_test_date),
+        updated_at = EXCLUDED.updated_at
+""")
+
+CATALOGUE_SQL = text("""
+    SELECT test_category, test_type, unit, record_count,
+           first_test_date, last_test_date, last_value, last_result_flag
+    FROM user_test_catalogue
+    WHERE user_id = :user_id
+    ORDER BY test_category, test_type
+""")
+
+async def apply_catalogue(db: AsyncSession, user_id: UUID, records: Iterable):
+    """Fold newly inserted records into the user's test catalogue.
+
+    Runs in the caller's transaction so the catalogue commits together with the records.
+    """
+    now = datetime.utcnow()
+    entries = {}
+    for record in records:
+        key = (record.test_category, record.test_type)
+        entry = entries.get(key)
+        if entry is None:
+            entries[key] = {
+                "user_id": user_id,
+                "test_category": key[0],
+                "test_type": key[1],
+                "unit": record.unit,
+                "record_count": 1,
+                "first_test_date": record.test_date,
+                "last_test_date": record.test_date,
+                "last_value": record.test_value,
+                "last_result_flag": record.result_flag,
+                "updated_at": now,
+            }
+            continue
+        entry["record_count"] += 1
+        entry["first_test_date"] = min(entry["first_test_date"], record.test_date)
+        if record.test_date >= entry["last_test_date"]:
+            entry["last_test_date"] = record.test_date
+            entry["last_value"] = record.test_value
+            entry["last_result_flag"] = record.result_flag
+            entry["unit"] = record.unit
+
+    if entries:
+        # Sorted so concurrent writers lock catalogue rows in the same order
+        await db.execute(UPSERT_CATALOGUE_SQL, [entries[key] for key in sorted(entries)])
+
+async def rebuild_catalogue(conn: AsyncConnection, series_table: str):
+    """Recompute catalogue entries for the (user_id, test_category, test_type) rows in series_table.
+
+    Entries whose records are all gone, e.g. archived with their partition, are removed.
+    """
+    await conn.execute(text(f"""
+        DELETE FROM user_test_catalogue c
+        USING {series_table} s
+        WHERE c.user_id = s.user_id AND c.test_category = s.test_category AND c.test_type = s.test_type
+    """))
+    await conn.execute(text(f"""
+        INSERT INTO user_test_catalogue (
+            user_id, test_category, test_type, unit, record_count,
+            first_test_date, last_test_date, last_value, last_result_flag, updated_at
+        )
+        SELECT
+            t.user_id, t.test_category, t.test_type,
+            (array_agg(t.unit ORDER BY t.test_date DESC))[1], count(*),
+            min(t.test_date), max(t.test_date),
+            (array_agg(t.test_value ORDER BY t.test_date DESC))[1],
+            (array_agg(t.result_flag ORDER BY t.test_date DESC))[1],
+            now() AT TIME ZONE 'utc'
+        FROM test_records t
+        JOIN {series_table} s
+          ON s.user_id = t.user_id AND s.test_category = t.test_category AND s.test_type = t.test_type
+        GROUP BY t.user_id, t.test_category, t.test_type
+    """))
+
+async def user_catalogue(db: AsyncSession, user_id: UUID) -> list:
+    """A user's categories with the test types recorded in each"""
+    result = await db.execute(CATALOGUE_SQL, {"user_id": user_id})
+    categories = {}
+    for row in result:
+        first_test_date = row.first_test_date.replace(tzinfo=timezone.utc)
+        last_test_date = row.last_test_date.replace(tzinfo=timezone.utc)
+        category = categories.get(row.test_category)
+        if category is None:
+            category = categories[row.test_category] = {
+                "category": row.test_category,
+                "recordCount": 0,
+                "firstTestDate": first_test_date,
+                "lastTestDate": last_test_date,
+                "tests": [],
+            }
+        category["recordCount"] += row.record_count
+        category["firstTestDate"] = min(category["firstTestDate"], first_test_date)
+        category["lastTestDate"] = max(category["lastTestDate"], last_test_date)
+        category["tests"].append({
+            "testType": row.test_type,
+            "unit": row.unit,
+            "recordCount": row.record_count,
+            "firstTestDate": first_test_date,
+            "lastTestDate": last_test_date,
+            "lastValue": row.last_value,
+            "lastResultFlag": row.last_result_flag,
+        })
+    return list(categories.values())
@@ -0,0 +1,232 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from cache import TTLCache
+from database import read_session
+from rollups import bucket_start
+
+# Cohort analytics configuration
+COHORT_CHUNK_DAYS = int(os.getenv("COHORT_CHUNK_DAYS", "30"))  # width of each aggregation query
+COHORT_MAX_CHUNKS = int(os.getenv("COHORT_MAX_CHUNKS", "120"))  # longest window accepted, in chunks
+COHORT_MAX_PARALLEL = int(os.getenv("COHORT_MAX_PARALLEL", "4"))  # chunk queries in flight, across all requests
+COHORT_STATEMENT_TIMEOUT_MS = int(os.getenv("COHORT_STATEMENT_TIMEOUT_MS", "30000"))
+COHORT_CACHE_MAX_ENTRIES = int(os.getenv("COHORT_CACHE_MAX_ENTRIES", "10000"))
+COHORT_CACHE_TTL_SECONDS = float(os.getenv("COHORT_CACHE_TTL_SECONDS", "600"))
+
+COHORT_PERCENTILES = (5, 25, 50, 75, 95)
+
+# Memoized chunk results and value ranges
+cohort_cache = TTLCache(maxsize=COHORT_CACHE_MAX_ENTRIES, ttl=COHORT_CACHE_TTL_SECONDS)
+
+_chunk_slots = asyncio.Semaphore(COHORT_MAX_PARALLEL)
+
+# Chunks are aligned to a fixed grid so overlapping windows share cached chunks
+_CHUNK_ORIGIN = datetime(2000, 1, 1)
+
+VALUE_RANGE_SQL = text("""
+    SELECT min(min_value) AS min_value, max(max_value) AS max_value
+    FROM test_record_rollups
+    WHERE test_category = :category AND test_type = :test_type AND bucket = 'month'
+      AND bucket_start >= date_trunc('month', CAST(:date_from AS timestamp)) AND bucket_start < :date_to
+""")
+
+HISTOGRAM_CHUNK_SQL = text("""
+    SELECT width_bucket(test_value, :low, :high, :bins) AS bin,
+           count(*) AS value_count,
+           sum(test_value) AS value_sum,
+           sum(test_value * test_value) AS value_squares,
+           min(test_value) AS min_value,
+           max(test_value) AS max_value
+    FROM test_records
+    WHERE test_category = :category AND test_type = :test_type
+      AND test_date >= :chunk_start AND test_date < :chunk_end
+    GROUP BY bin
+""")
+
+ABNORMAL_RATE_CHUNK_SQL = """
+    SELECT bucket_start, sum(value_count) AS value_count, sum(out_of_range_count) AS out_of_range_count
+    FROM test_record_rollups
+    WHERE {conditions}
+      AND bucket_start >= :chunk_start AND bucket_start < :chunk_end
+    GROUP BY bucket_start
+"""
+
+def chunk_window(date_from: datetime, date_to: datetime) -> list:
+    """Split [date_from, date_to) into grid-aligned chunks"""
+    width = timedelta(days=COHORT_CHUNK_DAYS)
+    start = _CHUNK_ORIGIN + ((date_from - _CHUNK_ORIGIN) // width) * width
+    chunks = []
+    while start < date_to:
+        chunks.append((max(start, date_from), min(start + width, date_to)))
+        start += width
+    if len(chunks) > COHORT_MAX_CHUNKS:
+        raise ValueError(f"Date window spans more than {COHORT_MAX_CHUNKS * COHORT_CHUNK_DAYS} days")
+    return chunks
+
+async def _query_chunk(statement, params: dict) -> list:
+    """Run one chunk query under the global concurrency limit and a statement timeout"""
+    async with _chunk_slots:
+        async with read_session() as db:
+            await db.execute(
+                text("SELECT set_config('statement_timeout', :timeout, true)"),
+                {"timeout": str(COHORT_STATEMENT_TIMEOUT_MS)}
+            )
+            result = await db.execute(statement, params)
+            return result.fetchall()
+
+async def _run_chunks(chunks: list, key: tuple, fetch: Callable[[datetime, datetime], Awaitable[list]], merge):
+    """Fetch every chunk in parallel, reusing memoized chunks, and merge results as they arrive"""
+
+    async def load(chunk_start, chunk_end):
+        chunk_key = key + (chunk_start, chunk_end)
+        rows = cohort_cache.get(chunk_key)
+        if rows is None:
+            rows = await fetch(chunk_start, chunk_end)
+            cohort_cache.set(chunk_key, rows)
+        return rows
+
+    for completed in asyncio.as_completed([load(*chunk) for chunk in chunks]):
+        merge(await completed)
+
+async def _value_range(category: str, test_type: str, date_from: datetime, date_to: datetime):
+    """Bounds of a series across all patients, read from the monthly rollups"""
+    key = ("range", category, test_type, date_from, date_to)
+    bounds = cohort_cache.get(key)
+    if bounds is None:
+        rows = await _query_chunk(VALUE_RANGE_SQL, {
+            "category": category, "test_type": test_type, "date_from": date_from, "date_to": date_to,
+        })
+        bounds = (rows[0].min_value, rows[0].max_value)
+        cohort_cache.set(key, bounds)
+    return bounds
+
+def _percentile(counts: np.ndarray, edges: np.ndarray, total: int, q: float) -> float:
+    """Interpolate a percentile from histogram bin counts"""
+    target = q / 100.0 * total
+    cumulative = np.cumsum(counts)
+    index = min(int(np.searchsorted(cumulative, target)), len(counts) - 1)
+    before = cumulative[index] - counts[index]
+    fraction = (target - before) / counts[index] if counts[index] else 0.0
+    return float(edges[index] + fraction * (edges[index + 1] - edges[index]))
+
+async def value_distribution(
+    category: str,
+    test_type: str,
+    date_from: datetime,
+    date_to: datetime,
+    bins: int,
+    low: Optional[float] = None,
+    high: Optional[float] = None,
+) -> dict:
+    """Histogram, moments and approximate percentiles of one test type across all patients"""
+    chunks = chunk_window(date_from, date_to)
+    if low is None or high is None:
+        min_only = low is not None
+        range_low, range_high = await _value_range(category, test_type, date_from, date_to)
+        if range_low is None:
+            range_low = range_high = 0.0
+        low = range_low if low is None else low
+        # width_bucket treats the upper bound as exclusive
+        high = float(np.nextafter(range_high, np.inf)) if high is None else high
+        # A one-sided bound beyond all the data would invert the range: keep the given
+        # bound and let underflow/overflow count the values
+        if high <= low:
+            if min_only:
+                high = float(np.nextafter(low, np.inf))
+            else:
+                low = float(np.nextafter(high, -np.inf))
+
+    # Bin 0 and bins + 1 collect values below and above the histogram range
+    counts = np.zeros(bins + 2, dtype=np.int64)
+    totals = {"sum": 0.0, "squares": 0.0, "min": None, "max": None}
+
+    def merge(rows):
+        for row in rows:
+            counts[row.bin] += row.value_count
+            totals["sum"] += row.value_sum
+            totals["squares"] += row.value_squares
+            totals["min"] = row.min_value if totals["min"] is None else min(totals["min"], row.min_value)
+            totals["max"] = row.max_value if totals["max"] is None else max(totals["max"], row.max_value)
+
+    async def fetch(chunk_start, chunk_end):
+        return await _query_chunk(HISTOGRAM_CHUNK_SQL, {
+            "category": category, "test_type": test_type, "low": low, "high": high, "bins": bins,
+            "chunk_start": chunk_start, "chunk_end": chunk_end,
+        })
+
+    await _run_chunks(chunks, ("histogram", category, test_type, low, high, bins), fetch, merge)
+
+    total = int(counts.sum())
+    edges = np.linspace(low, high, bins + 1)
+    result = {
+        "testCategory": category,
+        "testType": test_type,
+        "dateFrom": date_from,
+        "dateTo": date_to,
+        "count": total,
+        "mean": None,
+        "std": None,
+        "min": totals["min"],
+        "max": totals["max"],
+        "percentiles": {},
+        "bins": [
+            {"lower": float(edges[i]), "upper": float(edges[i + 1]), "count": int(counts[i + 1])}
+            for i in range(bins)
+        ],
+        "underflow": int(counts[0]),
+        "overflow": int(counts[-1]),
+    }
+    if total:
+        mean = totals["sum"] / total
+        result["mean"] = mean
+        result["std"] = max(totals["squares"] / total - mean * mean, 0.0) ** 0.5
+        # Out-of-range values are placed at the histogram bounds
+        bounded_edges = np.concatenate(([low], edges, [high]))
+        result["percentiles"] = {
+            f"p{q}": _percentile(counts, bounded_edges, total, q) for q in COHORT_PERCENTILES
+        }
+    return result
+
+async def abnormal_rate(
+    category: str,
+    test_type: Optional[str],
+    bucket: str,
+    date_from: datetime,
+    date_to: datetime,
+) -> list:
+    """Share of out-of-range results per time bucket across all patients, from the rollups"""
+    # Start on a bucket boundary so the first bucket is counted whole
+    chunks = chunk_window(bucket_start(bucket, date_from), date_to)
+    conditions = ["test_category = :category", "bucket = :bucket"]
+    if test_type is not None:
+        conditions.append("test_type = :test_type")
+    statement = text(ABNORMAL_RATE_CHUNK_SQL.format(conditions=" AND ".join(conditions)))
+    buckets = {}
+
+    def merge(rows):
+        for row in rows:
+            total, abnormal = buckets.get(row.bucket_start, (0, 0))
+            buckets[row.bucket_start] = (total + row.value_count, abnormal + row.out_of_range_count)
+
+    async def fetch(chunk_start, chunk_end):
+        return await _query_chunk(statement, {
+            "category": category, "test_type": test_type, "bucket": bucket,
+            "chunk_start": chunk_start, "chunk_end": chunk_end,
+        })
+
+    await _run_chunks(chunks, ("abnormal", category, test_type, bucket), fetch, merge)
+
+    return [
+        {
+            "bucketStart": start,
+            "total": int(total),
+            "abnormal": int(abnormal),
+            "abnormalPercent": 100.0 * abnormal / total if total else None,
+        }
+        for start, (total, abnormal) in sorted(buckets.items())
+    ]
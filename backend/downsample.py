@@ -0,0 +1,125 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+# Downsampling configuration
+DOWNSAMPLE_METHOD = os.getenv("DOWNSAMPLE_METHOD", "lttb")  # lttb or minmax
+
+def _bucket_edges(count: int, buckets: int) -> np.ndarray:
+    """Start offsets of buckets splitting count points as evenly as possible"""
+    return np.linspace(0, count, buckets + 1).astype(np.int64)
+
+def _first_per_bucket(matches: np.ndarray, bucket_ids: np.ndarray, offset: int = 0) -> np.ndarray:
+    """Index of the first matching point in each bucket"""
+    positions = np.flatnonzero(matches)
+    _, first = np.unique(bucket_ids[positions], return_index=True)
+    return positions[first] + offset
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets selection of at most max_points indices.
+
+    The first and last points are kept. Each bucket in between keeps the point forming the
+    largest triangle with the previous and next buckets' means; anchoring on the previous
+    bucket's mean instead of its selected point lets all buckets be scored at once.
+    """
+    count = len(x)
+    if count <= max_points or max_points < 3:
+        return np.arange(count) if count <= max_points else np.array([0, count - 1])
+
+    inner_x, inner_y = x[1:-1], y[1:-1]
+    buckets = max_points - 2
+    edges = _bucket_edges(len(inner_x), buckets)
+    starts, sizes = edges[:-1], np.diff(edges)
+    mean_x = np.add.reduceat(inner_x, starts) / sizes
+    mean_y = np.add.reduceat(inner_y, starts) / sizes
+
+    # Anchors: the previous bucket's mean (the first point for bucket 0) and the next bucket's mean
+    prev_x = np.concatenate(([x[0]], mean_x[:-1]))
+    prev_y = np.concatenate(([y[0]], mean_y[:-1]))
+    next_x = np.concatenate((mean_x[1:], [x[-1]]))
+    next_y = np.concatenate((mean_y[1:], [y[-1]]))
+
+    bucket_ids = np.repeat(np.arange(buckets), sizes)
+    ax, ay = prev_x[bucket_ids], prev_y[bucket_ids]
+    cx, cy = next_x[bucket_ids], next_y[bucket_ids]
+    areas = np.abs((ax - cx) * (inner_y - ay) - (ax - inner_x) * (cy - ay))
+    largest = np.maximum.reduceat(areas, starts)
+    chosen = _first_per_bucket(areas == largest[bucket_ids], bucket_ids, offset=1)
+    return np.concatenate(([0], chosen, [count - 1]))
+
+def minmax_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """Per-bucket minimum and maximum, at most max_points indices including the first and last"""
+    count = len(y)
+    if count <= max_points or max_points < 4:
+        return np.arange(count) if count <= max_points else np.array([0, count - 1])
+
+    buckets = (max_points - 2) // 2
+    inner = y[1:-1]
+    edges = _bucket_edges(len(inner), buckets)
+    starts, sizes = edges[:-1], np.diff(edges)
+    bucket_ids = np.repeat(np.arange(buckets), sizes)
+    lows = _first_per_bucket(inner == np.minimum.reduceat(inner, starts)[bucket_ids], bucket_ids, offset=1)
+    highs = _first_per_bucket(inner == np.maximum.reduceat(inner, starts)[bucket_ids], bucket_ids, offset=1)
+    return np.unique(np.concatenate(([0], lows, highs, [count - 1])))
+
+def _select(x: np.ndarray, y: np.ndarray, max_points: int, method: str) -> np.ndarray:
+    if method == "minmax":
+        return minmax_indices(y, max_points)
+    return lttb_indices(x, y, max_points)
+
+def downsample_indices(
+    x: np.ndarray,
+    y: np.ndarray,
+    max_points: int,
+    keep: Optional[np.ndarray] = None,
+    method: Optional[str] = None,
+) -> np.ndarray:
+    """Sorted indices of a shape-preserving subset of at most max_points points.
+
+    x must be ascending. Points where keep is true (out-of-range results) are always
+    included and the rest of the budget goes to the chosen method; if the kept points
+    alone leave no room for it they are downsampled among themselves.
+    """
+    method = method or DOWNSAMPLE_METHOD
+    count = len(y)
+    if count <= max_points:
+        return np.arange(count)
+    if keep is None or not keep.any():
+        return _select(x, y, max_points, method)
+
+    kept = np.flatnonzero(keep)
+    if len(kept) > max_points - 2:
+        return kept[_select(x[kept], y[kept], max_points, method)]
+    shape = _select(x, y, max_points - len(kept), method)
+    return np.union1d(shape, kept)
+
+def out_of_range_mask(result_flags) -> np.ndarray:
+    """True for low, high and critical results"""
+    return np.array([flag is not None and flag != "normal" for flag in result_flags], dtype=bool)
+
+def epoch_seconds(test_dates: np.ndarray) -> np.ndarray:
+    """datetime64 values as float seconds, the x axis for downsampling"""
+    return test_dates.astype("datetime64[us]").astype(np.int64) / 1e6
+
+def downsample_records(records: list, max_points: int, method: Optional[str] = None) -> list:
+    """Downsample each test type's records to max_points, keeping the input order.
+
+    Records need test_type, test_date, test_value and result_flag and may be in either date order.
+    """
+    by_type = {}
+    for position, record in enumerate(records):
+        by_type.setdefault(record.test_type, []).append(position)
+
+    selected = []
+    for positions in by_type.values():
+        if len(positions) <= max_points:
+            selected.extend(positions)
+            continue
+        positions = sorted(positions, key=lambda position: records[position].test_date)
+        test_dates = np.array([records[position].test_date for position in positions], dtype="datetime64[us]")
+        values = np.array([records[position].test_value for position in positions], dtype=np.float64)
+        flags = out_of_range_mask(records[position].result_flag for position in positions)
+        keep = downsample_indices(epoch_seconds(test_dates), values, max_points, flags, method)
+        selected.extend(positions[index] for index in keep)
+    return [records[position] for position in sorted(selected)]
@@ -2,10 +2,40 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from pydantic import EmailStr
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import Optional
+import asyncio
 import os
+import time
+import uuid
 
-async def send_verification_email(email: EmailStr, verification_code: str, first_name: str):
-    """Send email verification code to user using SMTP"""
+# SMTP configuration
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_FROM_EMAIL = os.getenv("SMTP_FROM_EMAIL", "noreply@labsmonitor.com")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_IDLE_TIMEOUT_SECONDS = float(os.getenv("SMTP_IDLE_TIMEOUT_SECONDS", "60"))
+
+# Mail queue configuration
+MAIL_DISPATCHER_ENABLED = os.getenv("MAIL_DISPATCHER_ENABLED", "true").lower() == "true"
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_POLL_SECONDS = float(os.getenv("MAIL_POLL_SECONDS", "5"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "8"))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", "30"))
+# How long a claimed batch stays leased to its dispatcher before others may retry it;
+# must comfortably exceed the time to send MAIL_BATCH_SIZE messages
+MAIL_LEASE_SECONDS = float(os.getenv("MAIL_LEASE_SECONDS", "300"))
+# Sent messages are deleted after this many days, checked every MAIL_PURGE_INTERVAL_SECONDS
+MAIL_SENT_RETENTION_DAYS = float(os.getenv("MAIL_SENT_RETENTION_DAYS", "30"))
+MAIL_PURGE_INTERVAL_SECONDS = float(os.getenv("MAIL_PURGE_INTERVAL_SECONDS", "3600"))
+MAIL_PURGE_BATCH_SIZE = 1000
+
+def render_verification_email(verification_code: str, first_name: str):
+    """Build the subject and HTML body of the email verification message"""
     
     html_content = f"""
     <!DOCTYPE html>
@@ -77,39 +107,10 @@ async def send_verification_email(email: EmailStr, verification_code: str, first
     </html>
     """
     
-    try:
-        # Create message
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = "Verify Your Email - Labs Monitor"
-        msg['From'] = os.getenv("SMTP_FROM_EMAIL", "noreply@labsmonitor.com")
-        msg['To'] = email
-        
-        # Attach HTML content
-        html_part = MIMEText(html_content, 'html')
-        msg.attach(html_part)
-        
-        # SMTP configuration
-        smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-        smtp_port = int(os.getenv("SMTP_PORT", "587"))
-        smtp_username = os.getenv("SMTP_USERNAME")
-        smtp_password = os.getenv("SMTP_PASSWORD")
-        
-        # Send email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            if smtp_username and smtp_password:
-                server.login(smtp_username, smtp_password)
-            server.send_message(msg)
-        
-        print(f"Email sent successfully to {email}")
-        return {"success": True, "message": "Email sent successfully"}
-        
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-        raise e
-
-async def send_password_reset_email(email: EmailStr, reset_code: str, first_name: str):
-    """Send password reset code to user using SMTP"""
+    return "Verify Your Email - Labs Monitor", html_content
+
+def render_password_reset_email(reset_code: str, first_name: str):
+    """Build the subject and HTML body of the password reset message"""
     
     html_content = f"""
     <!DOCTYPE html>
@@ -195,33 +196,265 @@ async def send_password_reset_email(email: EmailStr, reset_code: str, first_name
     </html>
     """
     
-    try:
-        # Create message
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = "Password Reset - Labs Monitor"
-        msg['From'] = os.getenv("SMTP_FROM_EMAIL", "noreply@labsmonitor.com")
-        msg['To'] = email
-        
-        # Attach HTML content
-        html_part = MIMEText(html_content, 'html')
-        msg.attach(html_part)
-        
-        # SMTP configuration
-        smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-        smtp_port = int(os.getenv("SMTP_PORT", "587"))
-        smtp_username = os.getenv("SMTP_USERNAME")
-        smtp_password = os.getenv("SMTP_PASSWORD")
-        
-        # Send email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
+    return "Password Reset - Labs Monitor", html_content
+
+async def queue_email(db: AsyncSession, recipient: str, subject: str, html_body: str):
+    """Add a message to the outbound mail queue.
+
+    The row is written in the caller's transaction, so the message is only
+    sent if the surrounding change commits.
+    """
+    now = datetime.utcnow()
+    await db.execute(
+        text("""
+            INSERT INTO outbound_emails (id, recipient, subject, html_body, status, attempts, next_attempt_at, created_at)
+            VALUES (:id, :recipient, :subject, :html_body, 'pending', 0, :now, :now)
+        """),
+        {"id": uuid.uuid4(), "recipient": recipient, "subject": subject, "html_body": html_body, "now": now}
+    )
+
+async def queue_verification_email(db: AsyncSession, email: EmailStr, verification_code: str, first_name: str):
+    """Queue the email verification code for a user"""
+    subject, html_body = render_verification_email(verification_code, first_name)
+    await queue_email(db, email, subject, html_body)
+
+async def queue_password_reset_email(db: AsyncSession, email: EmailStr, reset_code: str, first_name: str):
+    """Queue the password reset code for a user"""
+    subject, html_body = render_password_reset_email(reset_code, first_name)
+    await queue_email(db, email, subject, html_body)
+
+class SMTPTransport:
+    """Blocking SMTP client that keeps one connection open across messages"""
+
+    def __init__(self, host: str = SMTP_SERVER, port: int = SMTP_PORT, starttls: bool = SMTP_STARTTLS,
+                 username: Optional[str] = SMTP_USERNAME, password: Optional[str] = SMTP_PASSWORD,
+                 from_email: str = SMTP_FROM_EMAIL, idle_timeout: float = SMTP_IDLE_TIMEOUT_SECONDS):
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.username = username
+        self.password = password
+        self.from_email = from_email
+        self.idle_timeout = idle_timeout
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.starttls:
             server.starttls()
-            if smtp_username and smtp_password:
-                server.login(smtp_username, smtp_password)
-            server.send_message(msg)
-        
-        print(f"Password reset email sent successfully to {email}")
-        return {"success": True, "message": "Password reset email sent successfully"}
-        
-    except Exception as e:
-        print(f"Failed to send password reset email: {e}")
-        raise e 
\ No newline at end of file
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+        if self._server is None:
+            self._server = self._connect()
+        return self._server
+
+    def _build_message(self, recipient: str, subject: str, html_body: str) -> MIMEMultipart:
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = self.from_email
+        msg['To'] = recipient
+        msg.attach(MIMEText(html_body, 'html'))
+        return msg
+
+    def send_batch(self, messages: list) -> list:
+        """Send (recipient, subject, html_body) messages; returns an error string or None per message"""
+        errors = []
+        for recipient, subject, html_body in messages:
+            msg = self._build_message(recipient, subject, html_body)
+            try:
+                try:
+                    self._connection().send_message(msg)
+                except smtplib.SMTPServerDisconnected:
+                    # The pooled connection was dropped by the server; reconnect once
+                    self.close()
+                    self._connection().send_message(msg)
+                errors.append(None)
+            except Exception as e:
+                if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    self.close()
+                errors.append(str(e) or e.__class__.__name__)
+            self._last_used = time.monotonic()
+        return errors
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+class MailDispatcher:
+    """Background task that drains the outbound_emails queue over pooled SMTP connections.
+
+    Several workers can run a dispatcher at once. Each batch is claimed in a short
+    transaction that marks its rows 'sending' with a lease, and the send results are
+    recorded in another, so no transaction stays open during SMTP. A worker that dies
+    mid-batch leaves its lease to expire, after which the rows are claimed again;
+    delivery is therefore at least once.
+    """
+
+    def __init__(self, session_factory, transport: Optional[SMTPTransport] = None,
+                 batch_size: int = MAIL_BATCH_SIZE, poll_seconds: float = MAIL_POLL_SECONDS,
+                 max_attempts: int = MAIL_MAX_ATTEMPTS, retry_base_seconds: float = MAIL_RETRY_BASE_SECONDS,
+                 lease_seconds: float = MAIL_LEASE_SECONDS, sent_retention_days: float = MAIL_SENT_RETENTION_DAYS):
+        self.session_factory = session_factory
+        self.transport = transport or SMTPTransport()
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.lease_seconds = lease_seconds
+        self.sent_retention_days = sent_retention_days
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._next_purge = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.transport.close)
+
+    def wake(self):
+        """Signal that new messages were committed to the queue"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                sent = await self.dispatch_once()
+                if time.monotonic() >= self._next_purge:
+                    await self.purge_sent()
+                    self._next_purge = time.monotonic() + MAIL_PURGE_INTERVAL_SECONDS
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Mail dispatcher error: {e}")
+                sent = 0
+            if sent >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def dispatch_once(self) -> int:
+        """Claim and send one batch of due messages; returns the number processed"""
+        rows, lease_expires_at = await self._claim()
+        if not rows:
+            return 0
+
+        errors = await asyncio.to_thread(
+            self.transport.send_batch,
+            [(row.recipient, row.subject, row.html_body) for row in rows]
+        )
+
+        await self._record(rows, errors, lease_expires_at)
+        return len(rows)
+
+    async def _claim(self):
+        """Lease a batch of due messages, including ones whose previous lease expired"""
+        now = datetime.utcnow()
+        lease_expires_at = now + timedelta(seconds=self.lease_seconds)
+        async with self.session_factory() as db:
+            # Leases that expired on their last allowed attempt are given up on, not retried
+            await db.execute(
+                text("""
+                    UPDATE outbound_emails
+                    SET status = 'failed', lease_expires_at = NULL,
+                        last_error = 'Lease expired before the send result was recorded'
+                    WHERE status = 'sending' AND lease_expires_at <= :now AND attempts >= :max_attempts
+                """),
+                {"now": now, "max_attempts": self.max_attempts}
+            )
+            result = await db.execute(
+                text("""
+                    UPDATE outbound_emails
+                    SET status = 'sending', attempts = attempts + 1, lease_expires_at = :lease_expires_at
+                    WHERE id IN (
+                        SELECT id
+                        FROM outbound_emails
+                        WHERE (status = 'pending' AND next_attempt_at <= :now)
+                           OR (status = 'sending' AND lease_expires_at <= :now)
+                        ORDER BY next_attempt_at
+                        LIMIT :limit
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, recipient, subject, html_body, attempts
+                """),
+                {"now": now, "lease_expires_at": lease_expires_at, "limit": self.batch_size}
+            )
+            rows = result.fetchall()
+            await db.commit()
+        return rows, lease_expires_at
+
+    async def _record(self, rows, errors, lease_expires_at: datetime):
+        """Store send results for rows whose lease this dispatcher still holds"""
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            for row, error in zip(rows, errors):
+                if error is None:
+                    await db.execute(
+                        text("""
+                            UPDATE outbound_emails
+                            SET status = 'sent', sent_at = :now, last_error = NULL, lease_expires_at = NULL
+                            WHERE id = :id AND status = 'sending' AND lease_expires_at = :lease_expires_at
+                        """),
+                        {"id": row.id, "now": now, "lease_expires_at": lease_expires_at}
+                    )
+                    continue
+                delay = self.retry_base_seconds * (2 ** (row.attempts - 1))
+                await db.execute(
+                    text("""
+                        UPDATE outbound_emails
+                        SET status = :status, next_attempt_at = :next_attempt_at, last_error = :error, lease_expires_at = NULL
+                        WHERE id = :id AND status = 'sending' AND lease_expires_at = :lease_expires_at
+                    """),
+                    {
+                        "id": row.id,
+                        "status": "failed" if row.attempts >= self.max_attempts else "pending",
+                        "next_attempt_at": now + timedelta(seconds=delay),
+                        "error": error[:1000],
+                        "lease_expires_at": lease_expires_at
+                    }
+                )
+                print(f"Failed to send email to {row.recipient} (attempt {row.attempts}): {error}")
+            await db.commit()
+
+    async def purge_sent(self) -> int:
+        """Delete sent messages older than the retention period, a batch at a time; returns the number deleted"""
+        cutoff = datetime.utcnow() - timedelta(days=self.sent_retention_days)
+        deleted = 0
+        while True:
+            async with self.session_factory() as db:
+                result = await db.execute(
+                    text("""
+                        DELETE FROM outbound_emails
+                        WHERE id IN (
+                            SELECT id FROM outbound_emails
+                            WHERE status = 'sent' AND sent_at < :cutoff
+                            LIMIT :limit
+                        )
+                    """),
+                    {"cutoff": cutoff, "limit": MAIL_PURGE_BATCH_SIZE}
+                )
+                await db.commit()
+            deleted += result.rowcount
+            if result.rowcount < MAIL_PURGE_BATCH_SIZE:
+                return deleted
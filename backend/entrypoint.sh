@@ -13,5 +13,13 @@ else
   echo "SSL certificates already exist."
 fi
 
-# Start the FastAPI server with HTTPS
+# Apply pending database migrations once before the server starts
+python migrate.py
+
+if [ "$ENVIRONMENT" = "production" ]; then
+  # Multi-worker production server; TLS only when SSL_KEYFILE and SSL_CERTFILE are set
+  exec gunicorn -c gunicorn.conf.py main:app
+fi
+
+# Start the FastAPI development server with HTTPS and auto-reload
 exec uvicorn main:app --host 0.0.0.0 --port 8443 --ssl-keyfile /app/ssl/key.pem --ssl-certfile /app/ssl/cert.pem --reload 
\ No newline at end of file
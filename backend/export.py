@@ -0,0 +1,257 @@
+import csv
+import io
+import json
+import os
+import struct
+import zlib
+from array import array
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from uuid import UUID
+
+from sqlalchemy import text
+
+# Export configuration
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "columnar": "application/vnd.labsmonitor.columnar",
+}
+
+EXPORT_SQL = text("""
+    SELECT id, test_category, test_type, test_value, unit, min_range, max_range,
+           test_date, notes, created_at, updated_at, result_flag, range_deviation
+    FROM test_records
+    WHERE user_id = :user_id
+    ORDER BY test_date, id
+""")
+
+# Field names match TestRecordResponse; new fields are appended so column positions stay stable
+CSV_HEADER = ["id", "testCategory", "testType", "testValue", "unit", "minRange", "maxRange",
+              "testDate", "notes", "createdAt", "updatedAt", "resultFlag", "rangeDeviation"]
+
+# Columnar layout: magic, u32 schema length, JSON schema, then chunks of
+# u32 row count + encoded columns; a zero row count ends the stream.
+COLUMNAR_MAGIC = b"LMC1"
+COLUMNAR_SCHEMA = [
+    ("id", "uuid"),
+    ("testCategory", "dict"),
+    ("testType", "dict"),
+    ("testValue", "float64"),
+    ("unit", "dict"),
+    ("minRange", "float64?"),
+    ("maxRange", "float64?"),
+    ("testDate", "timestamp"),
+    ("notes", "utf8?"),
+    ("createdAt", "timestamp?"),
+    ("updatedAt", "timestamp?"),
+    ("resultFlag", "dict?"),
+    ("rangeDeviation", "float64?"),
+]
+
+_EPOCH = datetime(1970, 1, 1)
+
+async def stream_record_chunks(session_factory, user_id: UUID) -> AsyncIterator[list]:
+    """Yield a user's records in chunks from a server-side cursor"""
+    async with session_factory() as db:
+        result = await db.stream(EXPORT_SQL.execution_options(yield_per=EXPORT_CHUNK_ROWS), {"user_id": user_id})
+        async for chunk in result.partitions(EXPORT_CHUNK_ROWS):
+            yield chunk
+
+def _iso(value: Optional[datetime], utc: bool = False) -> Optional[str]:
+    # None stays None: an empty CSV field and null in NDJSON
+    if value is None:
+        return None
+    text_value = value.isoformat()
+    return text_value + "Z" if utc else text_value
+
+def _record_values(row) -> list:
+    return [
+        str(row.id), row.test_category, row.test_type, row.test_value, row.unit,
+        row.min_range, row.max_range, _iso(row.test_date, utc=True), row.notes,
+        _iso(row.created_at), _iso(row.updated_at), row.result_flag, row.range_deviation,
+    ]
+
+def encode_ndjson(chunk: list) -> bytes:
+    return "".join(
+        json.dumps(dict(zip(CSV_HEADER, _record_values(row)))) + "\n" for row in chunk
+    ).encode()
+
+def encode_csv(chunk: list, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CSV_HEADER)
+    writer.writerows(_record_values(row) for row in chunk)
+    return buffer.getvalue().encode()
+
+def _validity(values: list) -> bytes:
+    bitmap = bytearray((len(values) + 7) // 8)
+    for index, value in enumerate(values):
+        if value is not None:
+            bitmap[index >> 3] |= 1 << (index & 7)
+    return bytes(bitmap)
+
+def _utf8_block(strings: list) -> bytes:
+    offsets = array("i", [0])
+    data = bytearray()
+    for value in strings:
+        data += (value or "").encode()
+        offsets.append(len(data))
+    return struct.pack("<I", len(data)) + _little_endian(offsets) + bytes(data)
+
+def _little_endian(values: array) -> bytes:
+    if struct.pack("=H", 1) != struct.pack("<H", 1):
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _encode_column(kind: str, values: list) -> bytes:
+    if kind == "uuid":
+        return b"".join(value.bytes for value in values)
+    if kind == "timestamp":
+        return _little_endian(array("q", [
+            (value - _EPOCH) // (datetime.resolution) for value in values
+        ]))
+    if kind == "timestamp?":
+        return _validity(values) + _encode_column("timestamp", [_EPOCH if value is None else value for value in values])
+    if kind.startswith("float64"):
+        encoded = _little_endian(array("d", [0.0 if value is None else value for value in values]))
+        return _validity(values) + encoded if kind.endswith("?") else encoded
+    if kind == "dict?":
+        return _validity(values) + _encode_column("dict", ["" if value is None else value for value in values])
+    if kind == "dict":
+        dictionary = list(dict.fromkeys(values))
+        positions = {value: index for index, value in enumerate(dictionary)}
+        indices = _little_endian(array("I", [positions[value] for value in values]))
+        return struct.pack("<I", len(dictionary)) + _utf8_block(dictionary) + indices
+    if kind == "utf8?":
+        return _validity(values) + _utf8_block(values)
+    raise ValueError(f"Unknown column type: {kind}")
+
+def columnar_header() -> bytes:
+    schema = json.dumps({"columns": [{"name": name, "type": kind} for name, kind in COLUMNAR_SCHEMA]}).encode()
+    return COLUMNAR_MAGIC + struct.pack("<I", len(schema)) + schema
+
+def encode_columnar(chunk: list) -> bytes:
+    columns = [
+        [row.id for row in chunk],
+        [row.test_category for row in chunk],
+        [row.test_type for row in chunk],
+        [row.test_value for row in chunk],
+        [row.unit for row in chunk],
+        [row.min_range for row in chunk],
+        [row.max_range for row in chunk],
+        [row.test_date for row in chunk],
+        [row.notes for row in chunk],
+        [row.created_at for row in chunk],
+        [row.updated_at for row in chunk],
+        [row.result_flag for row in chunk],
+        [row.range_deviation for row in chunk],
+    ]
+    parts = [struct.pack("<I", len(chunk))]
+    parts.extend(_encode_column(kind, values) for (_, kind), values in zip(COLUMNAR_SCHEMA, columns))
+    return b"".join(parts)
+
+def read_columnar(data: bytes) -> list:
+    """Decode a columnar export back into a list of dicts (reference reader)"""
+    if data[:4] != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar export")
+    (schema_length,) = struct.unpack_from("<I", data, 4)
+    schema = json.loads(data[8:8 + schema_length])["columns"]
+    position = 8 + schema_length
+    records = []
+
+    def take(size):
+        nonlocal position
+        block = data[position:position + size]
+        position += size
+        return block
+
+    def numbers(typecode, count):
+        values = array(typecode)
+        values.frombytes(take(values.itemsize * count))
+        if struct.pack("=H", 1) != struct.pack("<H", 1):
+            values.byteswap()
+        return list(values)
+
+    def strings(count):
+        (size,) = struct.unpack("<I", take(4))
+        offsets = numbers("i", count + 1)
+        blob = take(size)
+        return [blob[offsets[i]:offsets[i + 1]].decode() for i in range(count)]
+
+    while True:
+        (count,) = struct.unpack("<I", take(4))
+        if count == 0:
+            return records
+        columns = {}
+        for column in schema:
+            kind = column["type"]
+            valid = None
+            if kind.endswith("?"):
+                bitmap = take((count + 7) // 8)
+                valid = [bool(bitmap[i >> 3] & (1 << (i & 7))) for i in range(count)]
+            if kind == "uuid":
+                values = [UUID(bytes=take(16)) for _ in range(count)]
+            elif kind.startswith("timestamp"):
+                values = [_EPOCH + micros * datetime.resolution for micros in numbers("q", count)]
+            elif kind.startswith("float64"):
+                values = numbers("d", count)
+            elif kind.startswith("dict"):
+                (size,) = struct.unpack("<I", take(4))
+                dictionary = strings(size)
+                values = [dictionary[index] for index in numbers("I", count)]
+            else:
+                values = strings(count)
+            if valid is not None:
+                values = [value if ok else None for value, ok in zip(values, valid)]
+            columns[column["name"]] = values
+        records.extend(dict(zip(columns, row)) for row in zip(*columns.values()))
+
+async def encode_export(chunks: AsyncIterator[list], fmt: str, gzip: bool = False) -> AsyncIterator[bytes]:
+    """Encode record chunks in the requested format, optionally gzip-compressed"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+
+    def emit(payload: bytes) -> Optional[bytes]:
+        if compressor is None:
+            return payload
+        # Sync flush so every chunk reaches the client instead of sitting in the compressor
+        return compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    if fmt == "csv":
+        first = emit(encode_csv([], header=True))
+    elif fmt == "columnar":
+        first = emit(columnar_header())
+    else:
+        first = None
+    # Send the prelude right away so the first byte does not wait for the query
+    if first:
+        yield first
+
+    async for chunk in chunks:
+        if fmt == "csv":
+            payload = encode_csv(chunk)
+        elif fmt == "columnar":
+            payload = encode_columnar(chunk)
+        else:
+            payload = encode_ndjson(chunk)
+        encoded = emit(payload)
+        if encoded:
+            yield encoded
+
+    tail = struct.pack("<I", 0) if fmt == "columnar" else b""
+    if compressor is not None:
+        tail = compressor.compress(tail) + compressor.flush()
+    if tail:
+        yield tail
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Check whether the client accepts a gzip-encoded response"""
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
@@ -0,0 +1,78 @@
+# Gunicorn settings for the production server: gunicorn -c gunicorn.conf.py main:app
+import math
+import os
+
+# Listener configuration
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+# Pending connections the kernel queues before refusing new ones
+backlog = int(os.getenv("BACKLOG", "2048"))
+
+# Worker configuration; the app is async, so one worker per usable core keeps every core busy.
+# Each worker has its own connection pools, so workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW),
+# summed over all instances, must stay below Postgres max_connections.
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "4"))
+# Connection limit the pools are checked against at startup
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+
+def usable_cpus() -> int:
+    """CPUs this process may run on, honouring affinity and a cgroup v2 CPU quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+# WEB_CONCURRENCY wins when set; otherwise one worker per usable CPU, capped at MAX_WORKERS
+workers = int(os.getenv("WEB_CONCURRENCY") or min(usable_cpus(), MAX_WORKERS))
+worker_class = "workers.ProductionWorker"
+# Import the app once in the master so forked workers share its memory pages
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+
+# Seconds an idle keep-alive connection stays open; above the proxy's upstream keep-alive timeout
+keepalive = int(os.getenv("KEEPALIVE_SECONDS", "75"))
+# Seconds a worker may stay silent before the master restarts it
+timeout = int(os.getenv("WORKER_TIMEOUT_SECONDS", "60"))
+# Seconds in-flight requests get to finish on restart or shutdown
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "30"))
+
+# Recycle each worker after this many requests (0 disables); jitter staggers the restarts
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+
+# TLS is normally terminated by the reverse proxy; set both paths to serve HTTPS directly
+keyfile = os.getenv("SSL_KEYFILE") or None
+certfile = os.getenv("SSL_CERTFILE") or None
+
+# Trust X-Forwarded-* headers from these proxy addresses (exact IPs, comma-separated; uvicorn
+# 0.24 does not match CIDRs). Rate limiting also honours TRUSTED_PROXY_CIDRS, see ratelimit.py
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+accesslog = os.getenv("ACCESS_LOG", "-") or None
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+def on_starting(server):
+    """Warn when the workers' pools together could open more connections than Postgres allows"""
+    per_worker = int(os.getenv("DB_POOL_SIZE", "5")) + int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    if os.getenv("DATABASE_REPLICA_URL"):
+        per_worker *= 2
+    if workers * per_worker > DB_MAX_CONNECTIONS:
+        server.log.warning(
+            f"{workers} workers x {per_worker} pooled connections exceeds DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS}; "
+            "lower WEB_CONCURRENCY, DB_POOL_SIZE or DB_MAX_OVERFLOW"
+        )
+
+def post_fork(server, worker):
+    """Drop pooled connections inherited from the master so workers never share sockets"""
+    from database import engine, replica_engine
+
+    engine.sync_engine.dispose(close=False)
+    if replica_engine is not None:
+        replica_engine.sync_engine.dispose(close=False)
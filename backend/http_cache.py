@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional, Tuple
+from uuid import UUID
+
+from fastapi import Request, Response
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import TTLCache
+from serialization import dumps
+
+# Response cache configuration
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory, database, none
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+
+async def get_data_version(db: AsyncSession, user_id: UUID) -> int:
+    """Current data version of a user; bumped on every write to their records"""
+    result = await db.execute(
+        text("SELECT version FROM user_data_versions WHERE user_id = :user_id"),
+        {"user_id": user_id}
+    )
+    version = result.scalar()
+    return version or 0
+
+async def bump_data_version(db: AsyncSession, user_id: UUID):
+    """Increment a user's data version in the caller's transaction"""
+    await db.execute(
+        text("""
+            INSERT INTO user_data_versions (user_id, version, updated_at)
+            VALUES (:user_id, 1, :now)
+            ON CONFLICT (user_id) DO UPDATE SET
+                version = user_data_versions.version + 1,
+                updated_at = EXCLUDED.updated_at
+        """),
+        {"user_id": user_id, "now": datetime.utcnow()}
+    )
+
+def make_etag(user_id: UUID, request: Request, version: int, variant: str = "") -> str:
+    """Strong ETag for a (user, endpoint, params, version) combination, as "version-hash".
+
+    variant distinguishes requests whose parameters are not in the query string, such as a JSON body.
+    The version stays readable so a lagging replica can tell a client's copy is newer than its own.
+    """
+    params = "&".join(f"{key}={value}" for key, value in sorted(request.query_params.multi_items()))
+    material = f"{user_id}|{request.url.path}|{params}|{variant}"
+    return f'"{version}-{hashlib.sha256(material.encode()).hexdigest()[:32]}"'
+
+def _parse_etag(etag: str) -> Optional[Tuple[int, str]]:
+    version, _, digest = etag.removeprefix("W/").strip('"').partition("-")
+    if not version.isdigit() or not digest:
+        return None
+    return int(version), digest
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag.
+
+    A tag for the same request at a later version also matches: the client already holds
+    data at least as new as this server's, which happens when it reads from a lagging replica.
+    "*" is not handled here, since it depends on whether the representation exists.
+    """
+    current = _parse_etag(etag)
+    for candidate in (if_none_match or "").split(","):
+        held = _parse_etag(candidate.strip())
+        if held is not None and current is not None and held[1] == current[1] and held[0] >= current[0]:
+            return True
+    return False
+
+def matches_any(if_none_match: Optional[str]) -> bool:
+    """Whether If-None-Match is "*", matching any existing representation"""
+    return "*" in [candidate.strip() for candidate in (if_none_match or "").split(",")]
+
+class MemoryResponseCache:
+    """In-process LRU cache of serialized responses"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, dict]]:
+        return self._entries.get(key)
+
+    async def set(self, key: str, body: bytes, headers: dict):
+        self._entries.set(key, (body, headers))
+
+class DatabaseResponseCache:
+    """Response cache shared by all workers through an unlogged Postgres table"""
+
+    def __init__(self, session_factory, maxsize: int, ttl: float):
+        self.session_factory = session_factory
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, dict]]:
+        async with self.session_factory() as db:
+            result = await db.execute(
+                text("""
+                    UPDATE response_cache_entries SET accessed_at = :now
+                    WHERE cache_key = :key AND expires_at > :now
+                    RETURNING body, headers
+                """),
+                {"key": key, "now": datetime.utcnow()}
+            )
+            row = result.fetchone()
+            await db.commit()
+        if row is None:
+            return None
+        return row.body, json.loads(row.headers)
+
+    async def set(self, key: str, body: bytes, headers: dict):
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            await db.execute(
+                text("""
+                    INSERT INTO response_cache_entries (cache_key, body, headers, accessed_at, expires_at)
+                    VALUES (:key, :body, :headers, :now, :expires_at)
+                    ON CONFLICT (cache_key) DO UPDATE SET
+                        body = EXCLUDED.body,
+                        headers = EXCLUDED.headers,
+                        accessed_at = EXCLUDED.accessed_at,
+                        expires_at = EXCLUDED.expires_at
+                """),
+                {
+                    "key": key,
+                    "body": body,
+                    "headers": json.dumps(headers),
+                    "now": now,
+                    "expires_at": now + timedelta(seconds=self.ttl),
+                }
+            )
+            # Evict expired entries, then the least recently used beyond the size limit
+            await db.execute(
+                text("""
+                    DELETE FROM response_cache_entries
+                    WHERE expires_at <= :now
+                       OR cache_key IN (
+                           SELECT cache_key FROM response_cache_entries
+                           ORDER BY accessed_at DESC
+                           OFFSET :maxsize
+                       )
+                """),
+                {"now": now, "maxsize": self.maxsize}
+            )
+            await db.commit()
+
+class NullResponseCache:
+    """Response cache that stores nothing"""
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, dict]]:
+        return None
+
+    async def set(self, key: str, body: bytes, headers: dict):
+        pass
+
+def create_response_cache(session_factory):
+    """Build the response cache selected by RESPONSE_CACHE_BACKEND"""
+    if RESPONSE_CACHE_BACKEND == "database":
+        return DatabaseResponseCache(session_factory, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+    if RESPONSE_CACHE_BACKEND == "memory":
+        return MemoryResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+    return NullResponseCache()
+
+async def cached_json_response(
+    request: Request,
+    db: AsyncSession,
+    user_id: UUID,
+    response_cache,
+    build: Callable[[dict], Awaitable[object]],
+    variant: str = "",
+) -> Response:
+    """Answer a per-user GET from the ETag or response cache, or build and cache it.
+
+    build receives a dict it can add response headers to, and returns the payload
+    or already serialized JSON bytes. The version is read through db, the same session
+    build reads from, so a cached body is never older than the version it is stored under.
+    """
+    version = await get_data_version(db, user_id)
+    etag = make_etag(user_id, request, version, variant)
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    cached = await response_cache.get(etag)
+    if cached is None:
+        extra_headers = {}
+        payload = await build(extra_headers)
+        body = payload if isinstance(payload, bytes) else dumps(payload)
+        await response_cache.set(etag, body, extra_headers)
+    else:
+        body, extra_headers = cached
+    # Only now is it known that a representation exists; build raises for missing ones
+    if matches_any(if_none_match):
+        return Response(status_code=304, headers=cache_headers)
+    return Response(content=body, media_type="application/json", headers={**extra_headers, **cache_headers})
@@ -0,0 +1,300 @@
+import asyncio
+import contextlib
+import csv
+import json
+import logging
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import AsyncIterator, Iterator, Optional
+from uuid import UUID
+
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from abnormal import classify_result
+from rollups import apply_rollups
+from catalogue import apply_catalogue
+from database import mark_write
+from http_cache import bump_data_version
+from schemas import TestRecordBase
+
+logger = logging.getLogger(__name__)
+
+# Import configuration
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "100"))
+IMPORT_TMP_DIR = os.getenv("IMPORT_TMP_DIR") or tempfile.gettempdir()
+# Largest accepted upload; bigger bodies are rejected while streaming
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(200 * 1024 * 1024)))
+# Upload bytes buffered in memory before each write to the spool file
+IMPORT_SPOOL_FLUSH_BYTES = int(os.getenv("IMPORT_SPOOL_FLUSH_BYTES", str(1024 * 1024)))
+# Jobs without a heartbeat for this long, and spool files untouched for this long,
+# belong to a worker that died and are cleaned up at startup
+IMPORT_STALE_SECONDS = int(os.getenv("IMPORT_STALE_SECONDS", "900"))
+
+SPOOL_PREFIX = "import-"
+INTERRUPTED_MESSAGE = "Import interrupted by a server restart; please upload the file again"
+
+IMPORT_FORMATS = ("csv", "ndjson")
+
+# Accepted column names, in API (camelCase) or database (snake_case) form
+FIELD_ALIASES = {
+    "testCategory": "testCategory", "test_category": "testCategory",
+    "testType": "testType", "test_type": "testType",
+    "testValue": "testValue", "test_value": "testValue",
+    "unit": "unit",
+    "minRange": "minRange", "min_range": "minRange",
+    "maxRange": "maxRange", "max_range": "maxRange",
+    "testDate": "testDate", "test_date": "testDate",
+    "notes": "notes",
+}
+
+# Columns loaded into the staging table with COPY
+STAGING_COLUMNS = (
+    "id", "user_id", "test_category", "test_type", "test_value", "unit",
+    "min_range", "max_range", "test_date", "notes", "result_flag", "range_deviation",
+    "created_at", "updated_at",
+)
+
+MERGE_STAGING_SQL = text(f"""
+    INSERT INTO test_records ({", ".join(STAGING_COLUMNS)})
+    SELECT DISTINCT ON (s.test_category, s.test_type, s.test_date, s.test_value) {", ".join("s." + c for c in STAGING_COLUMNS)}
+    FROM test_records_import_staging s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM test_records t
+        WHERE t.user_id = s.user_id
+          AND t.test_category = s.test_category
+          AND t.test_type = s.test_type
+          AND t.test_date = s.test_date
+          AND t.test_value = s.test_value
+    )
+    ORDER BY s.test_category, s.test_type, s.test_date, s.test_value
+    RETURNING *
+""")
+
+def detect_format(requested: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """Pick the upload format from the query parameter or the Content-Type header"""
+    if requested:
+        return requested.lower() if requested.lower() in IMPORT_FORMATS else None
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in ("text/csv", "application/csv"):
+        return "csv"
+    if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+class UploadTooLarge(ValueError):
+    """The upload is larger than IMPORT_MAX_BYTES"""
+
+async def spool_upload(chunks: AsyncIterator[bytes], max_bytes: int = IMPORT_MAX_BYTES) -> str:
+    """Write a streamed request body to a temporary file and return its path.
+
+    Disk writes run in a worker thread, in blocks of IMPORT_SPOOL_FLUSH_BYTES. Raises
+    UploadTooLarge as soon as more than max_bytes have arrived.
+    """
+    fd, path = tempfile.mkstemp(prefix=SPOOL_PREFIX, dir=IMPORT_TMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            buffer = bytearray()
+            received = 0
+            async for chunk in chunks:
+                received += len(chunk)
+                if received > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+                buffer += chunk
+                if len(buffer) >= IMPORT_SPOOL_FLUSH_BYTES:
+                    await asyncio.to_thread(spool.write, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await asyncio.to_thread(spool.write, bytes(buffer))
+    except BaseException:
+        _remove_spool(path)
+        raise
+    return path
+
+def _remove_spool(path: str):
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+async def recover_interrupted_imports(session_factory) -> int:
+    """Fail jobs whose worker stopped sending heartbeats and delete stale spool files.
+
+    Safe to run from every worker at startup: live jobs keep a fresh heartbeat and spool mtime.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=IMPORT_STALE_SECONDS)
+    async with session_factory() as db:
+        result = await db.execute(
+            text("""
+                UPDATE import_jobs
+                SET status = 'failed', error_message = :error, finished_at = :now
+                WHERE status IN ('pending', 'running')
+                  AND COALESCE(heartbeat_at, started_at, created_at) < :cutoff
+            """),
+            {"error": INTERRUPTED_MESSAGE, "now": datetime.utcnow(), "cutoff": cutoff}
+        )
+        await db.commit()
+    await asyncio.to_thread(_sweep_spool_dir, cutoff.replace(tzinfo=timezone.utc).timestamp())
+    return result.rowcount
+
+def _sweep_spool_dir(cutoff: float):
+    for entry in os.scandir(IMPORT_TMP_DIR):
+        if entry.name.startswith(SPOOL_PREFIX) and entry.is_file() and entry.stat().st_mtime < cutoff:
+            logger.warning(f"Removing orphaned import spool file {entry.path}")
+            _remove_spool(entry.path)
+
+def _normalize(raw: dict) -> dict:
+    data = {}
+    for key, value in raw.items():
+        field = FIELD_ALIASES.get((key or "").strip())
+        if field is None:
+            continue
+        if isinstance(value, str) and not value.strip() and field in ("minRange", "maxRange", "notes"):
+            value = None
+        if field == "testDate" and isinstance(value, str) and len(value.strip()) == 10:
+            # Instrument exports often carry the draw date only
+            value = value.strip() + "T00:00:00"
+        data[field] = value
+    return data
+
+def _iter_rows(path: str, fmt: str) -> Iterator[tuple]:
+    """Yield (row number, parsed dict or error message) pairs from an upload"""
+    with open(path, encoding="utf-8-sig", newline="") as upload:
+        if fmt == "csv":
+            reader = csv.DictReader(upload)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_number, line in enumerate(upload, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line_number, "Each line must be a JSON object"
+                continue
+            yield line_number, row
+
+def _validate(row_number: int, row, user_id: UUID, now: datetime):
+    """Validate one row with the TestRecordBase rules; returns (record tuple, error)"""
+    if isinstance(row, str):
+        return None, {"row": row_number, "errors": [row]}
+    try:
+        record = TestRecordBase(**_normalize(row))
+    except ValidationError as e:
+        messages = [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()]
+        return None, {"row": row_number, "errors": messages}
+    test_date = record.testDate.astimezone(timezone.utc).replace(tzinfo=None)
+    result_flag, range_deviation = classify_result(record.testValue, record.minRange, record.maxRange)
+    return (
+        uuid.uuid4(), user_id, record.testCategory, record.testType, record.testValue, record.unit,
+        record.minRange, record.maxRange, test_date, record.notes, result_flag, range_deviation, now, now,
+    ), None
+
+def _read_batch(rows: Iterator[tuple], user_id: UUID, size: int):
+    """Parse and validate up to size rows; runs in a worker thread"""
+    now = datetime.utcnow()
+    valid, errors, processed = [], [], 0
+    for row_number, row in islice(rows, size):
+        processed += 1
+        record, error = _validate(row_number, row, user_id, now)
+        if error is not None:
+            errors.append(error)
+        else:
+            valid.append(record)
+    return processed, valid, errors
+
+async def _load_batch(db: AsyncSession, user_id: UUID, records: list):
+    """COPY a batch into a staging table and merge new rows into test_records"""
+    await db.execute(text(
+        "CREATE TEMP TABLE test_records_import_staging (LIKE test_records INCLUDING DEFAULTS) ON COMMIT DROP"
+    ))
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        "test_records_import_staging", records=records, columns=list(STAGING_COLUMNS)
+    )
+    result = await db.execute(MERGE_STAGING_SQL)
+    inserted = result.fetchall()
+    if inserted:
+        await apply_rollups(db, user_id, inserted)
+        await apply_catalogue(db, user_id, inserted)
+        await bump_data_version(db, user_id)
+    return inserted
+
+async def run_import(session_factory, job_id: UUID, user_id: UUID, user_email: str, path: str, fmt: str):
+    """Validate and load an uploaded file batch by batch, recording progress on the job"""
+    rows = _iter_rows(path, fmt)
+    reported_errors = []
+    try:
+        async with session_factory() as db:
+            await db.execute(
+                text("UPDATE import_jobs SET status = 'running', started_at = :now, heartbeat_at = :now WHERE id = :id"),
+                {"id": job_id, "now": datetime.utcnow()}
+            )
+            await db.commit()
+
+            while True:
+                processed, records, errors = await asyncio.to_thread(_read_batch, rows, user_id, IMPORT_BATCH_SIZE)
+                if processed == 0:
+                    break
+                inserted = await _load_batch(db, user_id, records) if records else []
+                room = IMPORT_MAX_REPORTED_ERRORS - len(reported_errors)
+                reported_errors.extend(errors[:max(room, 0)])
+                await db.execute(
+                    text("""
+                        UPDATE import_jobs
+                        SET rows_processed = rows_processed + :processed,
+                            rows_imported = rows_imported + :imported,
+                            rows_skipped = rows_skipped + :skipped,
+                            rows_failed = rows_failed + :failed,
+                            errors = :errors,
+                            heartbeat_at = :now
+                        WHERE id = :id
+                    """),
+                    {
+                        "id": job_id,
+                        "now": datetime.utcnow(),
+                        "processed": processed,
+                        "imported": len(inserted),
+                        "skipped": len(records) - len(inserted),
+                        "failed": len(errors),
+                        "errors": json.dumps(reported_errors),
+                    }
+                )
+                await db.commit()
+                if inserted:
+                    # Other workers learn of the write when the job is polled (see get_import_job)
+                    mark_write(user_email)
+                # Keeps the spool file out of the startup sweep while the import runs
+                await asyncio.to_thread(os.utime, path)
+
+            await db.execute(
+                text("UPDATE import_jobs SET status = 'completed', finished_at = :now WHERE id = :id"),
+                {"id": job_id, "now": datetime.utcnow()}
+            )
+            await db.commit()
+    except asyncio.CancelledError:
+        # The worker is shutting down; record why instead of leaving the job running
+        await _fail_job(session_factory, job_id, INTERRUPTED_MESSAGE)
+        raise
+    except Exception as e:
+        logger.exception(f"Import job {job_id} failed")
+        await _fail_job(session_factory, job_id, str(e)[:1000])
+    finally:
+        rows.close()
+        _remove_spool(path)
+
+async def _fail_job(session_factory, job_id: UUID, error: str):
+    async with session_factory() as db:
+        await db.execute(
+            text("UPDATE import_jobs SET status = 'failed', error_message = :error, finished_at = :now WHERE id = :id"),
+            {"id": job_id, "error": error, "now": datetime.utcnow()}
+        )
+        await db.commit()
@@ -1,29 +1,93 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from contextlib import asynccontextmanager
 import uvicorn
 from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-from database import get_db, init_db
-from models import User, TestRecord
-from auth import get_current_user, create_access_token, create_refresh_token, verify_refresh_token, verify_password, hash_password
-from schemas import UserCreate, UserLogin, TestRecordCreate, TestRecordResponse, TestRecordBulkCreate, EmailVerificationRequest, ResendVerificationRequest, TokenResponse, RefreshTokenRequest, ForgotPasswordRequest, ResetPasswordRequest
-from email_service import send_verification_email, send_password_reset_email
+from database import get_db, init_db, engine, async_session, pool_stats, read_session, replica_engine, REPLICA_STICKY_SECONDS
+from models import User, TestRecord, ImportJob
+from auth import get_current_user, get_read_db, create_access_token, verify_refresh_token, verify_password_async, hash_password_async, hash_pool_stats, shutdown_hash_pool, user_claims, invalidate_cached_user, start_user_cache_listener, stop_user_cache_listener, remember_write, read_write_hint, require_roles, CLINICIAN_ROLES
+from schemas import UserCreate, UserLogin, TestRecordCreate, TestRecordResponse, TestRecordBulkCreate, SeriesBatchRequest, TestRecordAggregateResponse, TestSeriesTrendResponse, CohortDistributionResponse, CohortAbnormalRateResponse, ImportJobResponse, EmailVerificationRequest, ResendVerificationRequest, TokenResponse, RefreshTokenRequest, ForgotPasswordRequest, ResetPasswordRequest
+from email_service import MailDispatcher, MAIL_DISPATCHER_ENABLED, queue_verification_email, queue_password_reset_email
+from pagination import encode_cursor, decode_cursor, parse_fields
+from rollups import apply_rollups, bucket_start
+from catalogue import apply_catalogue, user_catalogue
+from importer import detect_format, recover_interrupted_imports, spool_upload, run_import, UploadTooLarge, IMPORT_MAX_BYTES
+from export import EXPORT_FORMATS, accepts_gzip, encode_export, stream_record_chunks
+from http_cache import bump_data_version, cached_json_response, create_response_cache
+from serialization import records_to_json
+from abnormal import classify_result
+from analytics import ANALYTICS_ROLLING_WINDOW, series_trends
+from series import batch_series
+from downsample import downsample_records
+from cohort import abnormal_rate, value_distribution
+from migrate import MIGRATE_ON_STARTUP, migrate, pending_migrations
+from partitions import PARTITIONING_ENABLED, PartitionMaintainer, archive_partition, list_partitions, parse_month, restore_partition
+from refresh_sessions import issue_refresh_token, revoke_family, revoke_user_sessions, rotate_refresh_token
+from ratelimit import RATE_LIMIT_BACKEND, create_rate_limiter
+from metrics import METRICS_ENABLED, MetricsMiddleware, instrument_engine, metrics_access_allowed, render_metrics
+import asyncio
+import json
+import os
 import secrets
-from datetime import datetime, timedelta
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Literal, Optional
+from uuid import UUID
+
+mail_dispatcher = MailDispatcher(async_session)
+partition_maintainer = PartitionMaintainer(engine)
+import_tasks = set()
+response_cache = create_response_cache(async_session)
+rate_limiter = create_rate_limiter(async_session)
+
+if METRICS_ENABLED:
+    instrument_engine(engine)
+    if replica_engine is not None:
+        instrument_engine(replica_engine)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Initialize database with retry mechanism
     try:
         await init_db()
+        if MIGRATE_ON_STARTUP:
+            await migrate()
+        else:
+            pending = await pending_migrations()
+            if pending:
+                print(f"⚠️ {len(pending)} pending migration(s); run python migrate.py")
         print("✅ Database initialized successfully")
     except Exception as e:
         print(f"❌ Failed to initialize database: {e}")
         raise
+    try:
+        interrupted = await recover_interrupted_imports(async_session)
+        if interrupted:
+            print(f"⚠️ Marked {interrupted} interrupted import job(s) as failed")
+    except Exception as e:
+        print(f"❌ Failed to recover interrupted imports: {e}")
+    try:
+        await start_user_cache_listener()
+    except Exception as e:
+        print(f"❌ Failed to listen for user changes, cached users expire by TTL only: {e}")
+    if MAIL_DISPATCHER_ENABLED:
+        mail_dispatcher.start()
+    if PARTITIONING_ENABLED:
+        partition_maintainer.start()
     yield
+    # Imports still running are marked failed by run_import when cancelled
+    for task in list(import_tasks):
+        task.cancel()
+    await asyncio.gather(*import_tasks, return_exceptions=True)
+    await partition_maintainer.stop()
+    await mail_dispatcher.stop()
+    await stop_user_cache_listener()
+    shutdown_hash_pool()
 
 app = FastAPI(
     title="Medical Test Records API",
@@ -39,10 +103,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# Request timing and query counts; added last so it also times the CORS layer
+app.add_middleware(MetricsMiddleware)
+
 security = HTTPBearer()
 
+# Mapping of API field names to test_records columns, used for projections
+RECORD_FIELDS = {
+    "id": "id",
+    "userId": "user_id",
+    "testCategory": "test_category",
+    "testType": "test_type",
+    "testValue": "test_value",
+    "unit": "unit",
+    "minRange": "min_range",
+    "maxRange": "max_range",
+    "testDate": "test_date",
+    "notes": "notes",
+    "createdAt": "created_at",
+    "updatedAt": "updated_at",
+    "resultFlag": "result_flag",
+    "rangeDeviation": "range_deviation",
+}
+
+# Namespace for deriving record ids from bulk request idempotency keys
+BULK_IDEMPOTENCY_NAMESPACE = uuid.UUID("6f1c7f0e-3c1d-4a55-9a57-1f5b8e2b9d41")
+
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Convert a datetime to the naive UTC representation stored in the database"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
 @app.get("/")
 async def root():
     return {"message": "Medical Test Records API"}
@@ -51,11 +146,39 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+@app.get("/health/stats")
+async def health_stats():
+    """Runtime counters for capacity tuning"""
+    stats = {
+        "hashing": hash_pool_stats(),
+        "database": pool_stats(),
+        "rateLimit": {"backend": RATE_LIMIT_BACKEND, **rate_limiter.stats},
+    }
+    if replica_engine is not None:
+        stats["replica"] = pool_stats(replica_engine)
+    return stats
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Request, query and pool metrics in Prometheus text format, for internal scrapers only"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not metrics_access_allowed(request):
+        raise HTTPException(status_code=403, detail="Metrics are only available to internal clients")
+    pools = {"primary": pool_stats()}
+    if replica_engine is not None:
+        pools["replica"] = pool_stats(replica_engine)
+    return Response(
+        content=render_metrics(pools, hash_pool_stats()),
+        media_type="text/plain; version=0.0.4",
+    )
+
 # Authentication endpoints
 @app.post("/api/auth/register")
-async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
+async def register(request: Request, user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     """Register a new user"""
     try:
+        await rate_limiter.check("mail", request, user_data.email)
         # Check if user already exists
         existing_user = await db.execute(
             text("SELECT * FROM users WHERE email = :email"),
@@ -72,7 +195,7 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
         verification_expires = datetime.utcnow() + timedelta(minutes=10)
         
         # Create new user
-        hashed_password = hash_password(user_data.password)
+        hashed_password = await hash_password_async(user_data.password)
         user = User(
             email=user_data.email,
             hashed_password=hashed_password,
@@ -85,15 +208,10 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
         )
         
         db.add(user)
+        # Queue verification email; it is sent by the mail dispatcher after commit
+        await queue_verification_email(db, user_data.email, verification_code, user_data.firstName)
         await db.commit()
-        await db.refresh(user)
-        
-        # Send verification email
-        try:
-            await send_verification_email(user_data.email, verification_code, user_data.firstName)
-        except Exception as email_error:
-            print(f"Email sending error: {email_error}")
-            # Continue with registration even if email fails
+        mail_dispatcher.wake()
         
         return {
             "message": "Registration successful. Please check your email for verification code.",
@@ -101,14 +219,17 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
             "requiresVerification": True
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Registration error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/auth/login", response_model=TokenResponse)
-async def login(user_credentials: UserLogin, db: AsyncSession = Depends(get_db)):
+async def login(request: Request, user_credentials: UserLogin, db: AsyncSession = Depends(get_db)):
     """Login user"""
     try:
+        await rate_limiter.check("login", request, user_credentials.email)
         # Find user by email
         result = await db.execute(
             text("SELECT * FROM users WHERE email = :email"),
@@ -116,7 +237,7 @@ async def login(user_credentials: UserLogin, db: AsyncSession = Depends(get_db))
         )
         user_data = result.fetchone()
         
-        if not user_data or not verify_password(user_credentials.password, user_data.hashed_password):
+        if not user_data or not await verify_password_async(user_credentials.password, user_data.hashed_password):
             raise HTTPException(
                 status_code=401,
                 detail="Invalid credentials"
@@ -130,11 +251,11 @@ async def login(user_credentials: UserLogin, db: AsyncSession = Depends(get_db))
             )
         
         # Create access token and refresh token
-        access_token = create_access_token(data={"sub": user_data.email})
-        refresh_token = create_refresh_token(
-            data={"sub": user_data.email}, 
-            remember_me=user_credentials.rememberMe or False
+        access_token = create_access_token(data={"sub": user_data.email, **user_claims(user_data)})
+        refresh_token = await issue_refresh_token(
+            db, user_data.id, user_data.email, remember_me=user_credentials.rememberMe or False
         )
+        await db.commit()
         
         return TokenResponse(
             access_token=access_token,
@@ -149,9 +270,10 @@ async def login(user_credentials: UserLogin, db: AsyncSession = Depends(get_db))
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/auth/verify-email")
-async def verify_email(verification_data: EmailVerificationRequest, db: AsyncSession = Depends(get_db)):
+async def verify_email(request: Request, response: Response, verification_data: EmailVerificationRequest, db: AsyncSession = Depends(get_db)):
     """Verify user email with verification code"""
     try:
+        await rate_limiter.check("code", request, verification_data.email)
         # Find user by email
         result = await db.execute(
             text("SELECT * FROM users WHERE email = :email"),
@@ -198,11 +320,14 @@ async def verify_email(verification_data: EmailVerificationRequest, db: AsyncSes
                 "updated_at": datetime.utcnow()
             }
         )
+        refresh_token = await issue_refresh_token(db, user_data.id, user_data.email)
+        await bump_data_version(db, user_data.id)
+        await invalidate_cached_user(db, verification_data.email)
         await db.commit()
+        remember_write(response, verification_data.email)
         
-        # Create access token and refresh token
-        access_token = create_access_token(data={"sub": user_data.email})
-        refresh_token = create_refresh_token(data={"sub": user_data.email}, remember_me=False)
+        # Create access token
+        access_token = create_access_token(data={"sub": user_data.email, **user_claims(user_data), "verified": True})
         
         return {
             "message": "Email verified successfully",
@@ -225,9 +350,10 @@ async def verify_email(verification_data: EmailVerificationRequest, db: AsyncSes
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/auth/resend-verification")
-async def resend_verification(resend_data: ResendVerificationRequest, db: AsyncSession = Depends(get_db)):
+async def resend_verification(request: Request, resend_data: ResendVerificationRequest, db: AsyncSession = Depends(get_db)):
     """Resend verification email"""
     try:
+        await rate_limiter.check("mail", request, resend_data.email)
         # Find user by email
         result = await db.execute(
             text("SELECT * FROM users WHERE email = :email"),
@@ -267,17 +393,9 @@ async def resend_verification(resend_data: ResendVerificationRequest, db: AsyncS
                 "updated_at": datetime.utcnow()
             }
         )
+        await queue_verification_email(db, resend_data.email, verification_code, user_data.first_name)
         await db.commit()
-        
-        # Send new verification email
-        try:
-            await send_verification_email(resend_data.email, verification_code, user_data.first_name)
-        except Exception as email_error:
-            print(f"Email sending error: {email_error}")
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to send verification email"
-            )
+        mail_dispatcher.wake()
         
         return {
             "message": "Verification code sent successfully"
@@ -307,35 +425,16 @@ async def verify_token(current_user: User = Depends(get_current_user)):
 async def refresh_token(refresh_data: RefreshTokenRequest, db: AsyncSession = Depends(get_db)):
     """Refresh access token using refresh token"""
     try:
-        # Verify refresh token
+        # Verify refresh token, then rotate its session; the user must still be active
         payload = verify_refresh_token(refresh_data.refresh_token)
-        email = payload.get("sub")
-        
-        if not email:
-            raise HTTPException(
-                status_code=401,
-                detail="Invalid refresh token"
-            )
-        
-        # Check if user still exists and is active
-        result = await db.execute(
-            text("SELECT * FROM users WHERE email = :email"),
-            {"email": email}
-        )
-        user_data = result.fetchone()
-        
-        if not user_data or not user_data.is_active:
-            raise HTTPException(
-                status_code=401,
-                detail="User not found or inactive"
-            )
+        user_data, refresh_token = await rotate_refresh_token(db, payload)
         
         # Create new access token
-        access_token = create_access_token(data={"sub": email})
+        access_token = create_access_token(data={"sub": user_data.email, **user_claims(user_data)})
         
         return TokenResponse(
             access_token=access_token,
-            refresh_token=refresh_data.refresh_token,  # Return the same refresh token
+            refresh_token=refresh_token,
             expires_in=30 * 60  # 30 minutes in seconds
         )
         
@@ -345,10 +444,26 @@ async def refresh_token(refresh_data: RefreshTokenRequest, db: AsyncSession = De
         print(f"Token refresh error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/auth/logout")
+async def logout(refresh_data: RefreshTokenRequest, db: AsyncSession = Depends(get_db)):
+    """Revoke a refresh token and every token rotated from the same login"""
+    try:
+        payload = verify_refresh_token(refresh_data.refresh_token)
+        if payload.get("fam"):
+            await revoke_family(db, UUID(payload["fam"]))
+        return {"message": "Logged out successfully"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Logout error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/auth/forgot-password")
-async def forgot_password(forgot_data: ForgotPasswordRequest, db: AsyncSession = Depends(get_db)):
+async def forgot_password(request: Request, forgot_data: ForgotPasswordRequest, db: AsyncSession = Depends(get_db)):
     """Send password reset email"""
     try:
+        await rate_limiter.check("mail", request, forgot_data.email)
         # Find user by email
         result = await db.execute(
             text("SELECT * FROM users WHERE email = :email"),
@@ -380,17 +495,9 @@ async def forgot_password(forgot_data: ForgotPasswordRequest, db: AsyncSession =
                 "updated_at": datetime.utcnow()
             }
         )
+        await queue_password_reset_email(db, forgot_data.email, reset_code, user_data.first_name)
         await db.commit()
-        
-        # Send password reset email
-        try:
-            await send_password_reset_email(forgot_data.email, reset_code, user_data.first_name)
-        except Exception as email_error:
-            print(f"Password reset email sending error: {email_error}")
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to send password reset email"
-            )
+        mail_dispatcher.wake()
         
         return {"message": "If an account with that email exists, a password reset code has been sent."}
         
@@ -401,9 +508,10 @@ async def forgot_password(forgot_data: ForgotPasswordRequest, db: AsyncSession =
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/auth/reset-password")
-async def reset_password(reset_data: ResetPasswordRequest, db: AsyncSession = Depends(get_db)):
+async def reset_password(request: Request, response: Response, reset_data: ResetPasswordRequest, db: AsyncSession = Depends(get_db)):
     """Reset password using reset code"""
     try:
+        await rate_limiter.check("code", request, reset_data.email)
         # Find user by email
         result = await db.execute(
             text("SELECT * FROM users WHERE email = :email"),
@@ -430,7 +538,7 @@ async def reset_password(reset_data: ResetPasswordRequest, db: AsyncSession = De
             )
         
         # Hash new password
-        hashed_password = hash_password(reset_data.new_password)
+        hashed_password = await hash_password_async(reset_data.new_password)
         
         # Update user password and clear reset code
         await db.execute(
@@ -448,7 +556,12 @@ async def reset_password(reset_data: ResetPasswordRequest, db: AsyncSession = De
                 "updated_at": datetime.utcnow()
             }
         )
+        # Sign out every device that had the old password
+        await revoke_user_sessions(db, user_data.id)
+        await bump_data_version(db, user_data.id)
+        await invalidate_cached_user(db, reset_data.email)
         await db.commit()
+        remember_write(response, reset_data.email)
         
         return {"message": "Password reset successfully"}
         
@@ -462,14 +575,16 @@ async def reset_password(reset_data: ResetPasswordRequest, db: AsyncSession = De
 @app.post("/api/test-records", response_model=TestRecordResponse)
 async def create_test_record(
     record: TestRecordCreate,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """Create a new test record"""
     try:
-        # Convert timezone-aware datetime to naive datetime for database storage
-        test_date_naive = record.testDate.replace(tzinfo=None) if record.testDate.tzinfo else record.testDate
+        # Stored as naive UTC, the same as bulk creates and imports
+        test_date_naive = to_naive_utc(record.testDate)
         
+        result_flag, range_deviation = classify_result(record.testValue, record.minRange, record.maxRange)
         test_record = TestRecord(
             user_id=current_user.id,
             test_category=record.testCategory,
@@ -479,10 +594,16 @@ async def create_test_record(
             min_range=record.minRange,
             max_range=record.maxRange,
             test_date=test_date_naive,
-            notes=record.notes
+            notes=record.notes,
+            result_flag=result_flag,
+            range_deviation=range_deviation
         )
         db.add(test_record)
+        await apply_rollups(db, current_user.id, [test_record])
+        await apply_catalogue(db, current_user.id, [test_record])
+        await bump_data_version(db, current_user.id)
         await db.commit()
+        remember_write(response, current_user.email)
         await db.refresh(test_record)
         return TestRecordResponse(
             id=test_record.id,
@@ -496,7 +617,9 @@ async def create_test_record(
             testDate=test_record.test_date,
             notes=test_record.notes,
             createdAt=test_record.created_at,
-            updatedAt=test_record.updated_at
+            updatedAt=test_record.updated_at,
+            resultFlag=test_record.result_flag,
+            rangeDeviation=test_record.range_deviation
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -504,6 +627,8 @@ async def create_test_record(
 @app.post("/api/test-records/bulk", response_model=list[TestRecordResponse])
 async def create_bulk_test_records(
     bulk_data: TestRecordBulkCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
@@ -524,38 +649,64 @@ async def create_bulk_test_records(
         # Check for duplicate test types within the same date and category
         test_type_date_pairs = set()
         for record in bulk_data.records:
-            pair = (record.testType, record.testDate.date(), record.testCategory)
+            pair = (record.testType, to_naive_utc(record.testDate).date(), record.testCategory)
             if pair in test_type_date_pairs:
                 raise HTTPException(
                     status_code=400,
-                    detail=f"Duplicate test record found: {record.testType} on {record.testDate.date()}"
+                    detail=f"Duplicate test record found: {record.testType} on {pair[1]}"
                 )
             test_type_date_pairs.add(pair)
         
-        test_records = []
-        for record in bulk_data.records:
-            # Convert timezone-aware datetime to naive datetime for database storage
-            test_date_naive = record.testDate.replace(tzinfo=None) if record.testDate.tzinfo else record.testDate
-            
-            test_record = TestRecord(
-                user_id=current_user.id,
-                test_category=record.testCategory,
-                test_type=record.testType,
-                test_value=record.testValue,
-                unit=record.unit,
-                min_range=record.minRange,
-                max_range=record.maxRange,
-                test_date=test_date_naive,
-                notes=record.notes
-            )
-            test_records.append(test_record)
+        now = datetime.utcnow()
+        rows = []
+        for index, record in enumerate(bulk_data.records):
+            # Retries with the same idempotency key map to the same record ids
+            if idempotency_key:
+                record_id = uuid.uuid5(BULK_IDEMPOTENCY_NAMESPACE, f"{current_user.id}:{idempotency_key}:{index}")
+            else:
+                record_id = uuid.uuid4()
+            result_flag, range_deviation = classify_result(record.testValue, record.minRange, record.maxRange)
+            rows.append({
+                "id": record_id,
+                "user_id": current_user.id,
+                "test_category": record.testCategory,
+                "test_type": record.testType,
+                "test_value": record.testValue,
+                "unit": record.unit,
+                "min_range": record.minRange,
+                "max_range": record.maxRange,
+                "test_date": to_naive_utc(record.testDate),
+                "notes": record.notes,
+                "result_flag": result_flag,
+                "range_deviation": range_deviation,
+                "created_at": now,
+                "updated_at": now,
+            })
         
-        db.add_all(test_records)
+        # Single multi-row INSERT ... RETURNING; rows that already exist are skipped
+        result = await db.execute(
+            pg_insert(TestRecord.__table__)
+            .values(rows)
+            .on_conflict_do_nothing()
+            .returning(TestRecord.__table__)
+        )
+        inserted = result.fetchall()
+        if inserted:
+            await apply_rollups(db, current_user.id, inserted)
+            await apply_catalogue(db, current_user.id, inserted)
+            await bump_data_version(db, current_user.id)
         await db.commit()
+        remember_write(response, current_user.email)
         
-        # Refresh all records to get their IDs
-        for record in test_records:
-            await db.refresh(record)
+        records_by_id = {record.id: record for record in inserted}
+        existing_ids = [row["id"] for row in rows if row["id"] not in records_by_id]
+        if existing_ids:
+            # Replay of an earlier request with the same idempotency key
+            result = await db.execute(
+                text("SELECT * FROM test_records WHERE user_id = :user_id AND id = ANY(:ids)"),
+                {"user_id": current_user.id, "ids": existing_ids}
+            )
+            records_by_id.update((record.id, record) for record in result.fetchall())
         
         return [
             TestRecordResponse(
@@ -570,9 +721,12 @@ async def create_bulk_test_records(
                 testDate=record.test_date,
                 notes=record.notes,
                 createdAt=record.created_at,
-                updatedAt=record.updated_at
+                updatedAt=record.updated_at,
+                resultFlag=record.result_flag,
+                rangeDeviation=record.range_deviation
             )
-            for record in test_records
+            for record in (records_by_id.get(row["id"]) for row in rows)
+            if record is not None
         ]
         
     except HTTPException:
@@ -583,84 +737,487 @@ async def create_bulk_test_records(
 
 @app.get("/api/test-records")
 async def get_test_records(
+    request: Request,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get all test records for the current user"""
+    async def build(headers: dict):
+        try:
+            result = await db.execute(
+                text("SELECT * FROM test_records WHERE user_id = :user_id ORDER BY test_date DESC"),
+                {"user_id": current_user.id}
+            )
+            records = result.fetchall()
+            return records_to_json(records)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return await cached_json_response(request, db, current_user.id, response_cache, build)
+
+@app.get("/api/test-records/export")
+async def export_test_records(
+    request: Request,
+    export_format: Literal["ndjson", "csv", "columnar"] = Query("ndjson", alias="format", description="ndjson, csv or columnar"),
+    current_user: User = Depends(get_current_user)
+):
+    """Stream the current user's full test history"""
+    use_gzip = accepts_gzip(request.headers.get("accept-encoding"))
+    headers = {
+        "Content-Disposition": f'attachment; filename="test-records.{export_format}"',
+        "Vary": "Accept-Encoding",
+    }
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        encode_export(stream_record_chunks(lambda: read_session(current_user.email, read_write_hint(request, current_user.email)), current_user.id), export_format, gzip=use_gzip),
+        media_type=EXPORT_FORMATS[export_format],
+        headers=headers
+    )
+
+@app.get("/api/test-records/categories")
+async def get_test_categories(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Get unique test categories for the current user"""
+    async def build(headers: dict):
+        try:
+            # Read from the catalogue's primary key rather than scanning the user's records
+            result = await db.execute(
+                text("SELECT DISTINCT test_category FROM user_test_catalogue WHERE user_id = :user_id ORDER BY test_category"),
+                {"user_id": current_user.id}
+            )
+            categories = result.fetchall()
+            return [{"category": row.test_category} for row in categories]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return await cached_json_response(request, db, current_user.id, response_cache, build)
+
+@app.get("/api/test-records/catalogue")
+async def get_test_catalogue(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Categories and test types the current user has records for, with counts, date span and latest value"""
+    async def build(headers: dict):
+        try:
+            return await user_catalogue(db, current_user.id)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return await cached_json_response(request, db, current_user.id, response_cache, build)
+
+@app.get("/api/test-records/category/{category}")
+async def get_test_records_by_category(
+    category: str,
+    request: Request,
+    test_type: Optional[str] = Query(None, alias="testType", description="Only return records of this test type"),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Only return records on or after this date"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="Only return records on or before this date"),
+    fields: Optional[str] = Query(None, description="Comma-separated list of fields to return"),
+    cursor: Optional[str] = Query(None, description="Cursor returned in X-Next-Cursor by the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Maximum number of records to return"),
+    max_points: Optional[int] = Query(None, alias="maxPoints", ge=2, le=10000, description="Downsample each test type to at most this many records"),
+    downsample: Optional[Literal["lttb", "minmax"]] = Query(None, description="How test types are reduced to maxPoints"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Get test records for a specific category"""
+    projection = parse_fields(fields, RECORD_FIELDS)
+    conditions = ["user_id = :user_id", "test_category = :category"]
+    params = {"user_id": current_user.id, "category": category}
+
+    if test_type is not None:
+        conditions.append("test_type = :test_type")
+        params["test_type"] = test_type
+    if date_from is not None:
+        conditions.append("test_date >= :date_from")
+        params["date_from"] = to_naive_utc(date_from)
+    if date_to is not None:
+        conditions.append("test_date <= :date_to")
+        params["date_to"] = to_naive_utc(date_to)
+    if cursor is not None:
+        params["cursor_date"], params["cursor_id"] = decode_cursor(cursor)
+        conditions.append("(test_date, id) < (:cursor_date, :cursor_id)")
+
+    if projection is None:
+        columns = "*"
+    else:
+        # id and test_date are always selected so the next cursor can be built
+        selected = dict.fromkeys(["id", "test_date"] + [RECORD_FIELDS[field] for field in projection])
+        if max_points is not None:
+            selected.update(dict.fromkeys(["test_type", "test_value", "result_flag"]))
+        columns = ", ".join(selected)
+
+    query = f"SELECT {columns} FROM test_records WHERE {' AND '.join(conditions)} ORDER BY test_date DESC, id DESC"
+    if limit is not None:
+        # Fetch one extra row to know whether another page exists
+        query += " LIMIT :limit"
+        params["limit"] = limit + 1
+
+    async def build(headers: dict):
+        try:
+            result = await db.execute(text(query), params)
+            records = result.fetchall()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        if limit is not None and len(records) > limit:
+            records = records[:limit]
+            headers["X-Next-Cursor"] = encode_cursor(records[-1].test_date, records[-1].id)
+        if max_points is not None:
+            records = downsample_records(records, max_points, downsample)
+
+        if projection is not None:
+            items = []
+            for record in records:
+                item = {}
+                for field in projection:
+                    value = getattr(record, RECORD_FIELDS[field])
+                    if field == "testDate":
+                        value = value.replace(tzinfo=timezone.utc)
+                    item[field] = value
+                items.append(item)
+            return items
+
+        return records_to_json(records)
+
+    return await cached_json_response(request, db, current_user.id, response_cache, build)
+
+@app.get("/api/test-records/aggregates", response_model=list[TestRecordAggregateResponse])
+async def get_test_record_aggregates(
+    category: str = Query(..., description="Test category of the series"),
+    test_type: str = Query(..., alias="testType", description="Test type of the series"),
+    bucket: Literal["day", "week", "month"] = Query("week", description="Bucket size"),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Only return buckets covering this date or later"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="Only return buckets starting on or before this date"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Get per-bucket min/max/avg/last/count for one test series"""
+    conditions = [
+        "user_id = :user_id",
+        "test_category = :category",
+        "test_type = :test_type",
+        "bucket = :bucket",
+    ]
+    params = {"user_id": current_user.id, "category": category, "test_type": test_type, "bucket": bucket}
+    if date_from is not None:
+        conditions.append("bucket_start >= :date_from")
+        params["date_from"] = bucket_start(bucket, to_naive_utc(date_from))
+    if date_to is not None:
+        conditions.append("bucket_start <= :date_to")
+        params["date_to"] = to_naive_utc(date_to)
+
     try:
         result = await db.execute(
-            text("SELECT * FROM test_records WHERE user_id = :user_id ORDER BY test_date DESC"),
-            {"user_id": current_user.id}
+            text(f"SELECT * FROM test_record_rollups WHERE {' AND '.join(conditions)} ORDER BY bucket_start"),
+            params
         )
-        records = result.fetchall()
+        rows = result.fetchall()
         return [
-            TestRecordResponse(
-                id=record.id,
-                userId=record.user_id,
-                testCategory=record.test_category,
-                testType=record.test_type,
-                testValue=record.test_value,
-                unit=record.unit,
-                minRange=record.min_range,
-                maxRange=record.max_range,
-                testDate=record.test_date,
-                notes=record.notes,
-                createdAt=record.created_at,
-                updatedAt=record.updated_at
+            TestRecordAggregateResponse(
+                bucketStart=row.bucket_start,
+                count=row.value_count,
+                min=row.min_value,
+                max=row.max_value,
+                avg=row.value_sum / row.value_count,
+                last=row.last_value,
+                lastTestDate=row.last_test_date,
+                outOfRangeCount=row.out_of_range_count
             )
-            for record in records
+            for row in rows
         ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/test-records/categories")
-async def get_test_categories(
+@app.get("/api/test-records/trends", response_model=list[TestSeriesTrendResponse])
+async def get_test_record_trends(
+    request: Request,
+    category: Optional[str] = Query(None, description="Only analyse series in this test category"),
+    test_type: Optional[str] = Query(None, alias="testType", description="Only analyse series of this test type"),
+    window: int = Query(ANALYTICS_ROLLING_WINDOW, ge=2, le=100, description="Draws per rolling window"),
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Get unique test categories for the current user"""
+    """Get slope, rolling statistics, rate of change, z-scores and shifts for each test series"""
+    async def build(headers: dict):
+        try:
+            return await series_trends(db, current_user.id, window, category, test_type)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return await cached_json_response(request, db, current_user.id, response_cache, build)
+
+@app.post("/api/test-records/series")
+async def get_test_record_series(
+    batch: SeriesBatchRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Latest value, count and points for several (category, test type, date window) series in one query"""
+    async def build(headers: dict):
+        try:
+            return await batch_series(db, current_user.id, batch.series, batch.maxPoints, batch.downsample)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    # The series are in the body, so they key the cache alongside the query string
+    variant = batch.model_dump_json(by_alias=True)
+    return await cached_json_response(request, db, current_user.id, response_cache, build, variant)
+
+@app.get("/api/test-records/abnormal")
+async def get_abnormal_test_records(
+    flag: Optional[Literal["low", "high", "critical"]] = Query(None, description="Only return results with this flag"),
+    patient_ids: Optional[list[UUID]] = Query(None, alias="patientId", description="Patients to include (doctors and admins only)"),
+    category: Optional[str] = Query(None, description="Only return results in this test category"),
+    test_type: Optional[str] = Query(None, alias="testType", description="Only return results of this test type"),
+    min_deviation: Optional[float] = Query(None, alias="minDeviation", ge=0, description="Minimum distance outside the range, in range widths"),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Only return results on or after this date"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="Only return results on or before this date"),
+    cursor: Optional[str] = Query(None, description="Cursor returned in X-Next-Cursor by the previous page"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of results to return"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Get out-of-range test results, newest first"""
+    # Matches the predicate of the partial indexes on abnormal results
+    conditions = ["result_flag <> 'normal'"]
+    params = {"limit": limit + 1}
+
+    if current_user.role in CLINICIAN_ROLES:
+        # Clinicians see every patient unless they narrow the query down
+        if patient_ids:
+            conditions.append("user_id = ANY(:patient_ids)")
+            params["patient_ids"] = patient_ids
+    else:
+        if patient_ids and any(patient_id != current_user.id for patient_id in patient_ids):
+            raise HTTPException(status_code=403, detail="Not allowed to read other patients' records")
+        conditions.append("user_id = :user_id")
+        params["user_id"] = current_user.id
+
+    if flag is not None:
+        conditions.append("result_flag = :flag")
+        params["flag"] = flag
+    if category is not None:
+        conditions.append("test_category = :category")
+        params["category"] = category
+    if test_type is not None:
+        conditions.append("test_type = :test_type")
+        params["test_type"] = test_type
+    if min_deviation is not None:
+        conditions.append("abs(range_deviation) >= :min_deviation")
+        params["min_deviation"] = min_deviation
+    if date_from is not None:
+        conditions.append("test_date >= :date_from")
+        params["date_from"] = to_naive_utc(date_from)
+    if date_to is not None:
+        conditions.append("test_date <= :date_to")
+        params["date_to"] = to_naive_utc(date_to)
+    if cursor is not None:
+        params["cursor_date"], params["cursor_id"] = decode_cursor(cursor)
+        conditions.append("(test_date, id) < (:cursor_date, :cursor_id)")
+
     try:
         result = await db.execute(
-            text("SELECT DISTINCT test_category FROM test_records WHERE user_id = :user_id ORDER BY test_category"),
-            {"user_id": current_user.id}
+            text(f"""
+                SELECT * FROM test_records
+                WHERE {' AND '.join(conditions)}
+                ORDER BY test_date DESC, id DESC
+                LIMIT :limit
+            """),
+            params
         )
-        categories = result.fetchall()
-        return [{"category": row.test_category} for row in categories]
+        records = result.fetchall()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/test-records/category/{category}")
-async def get_test_records_by_category(
-    category: str,
+    headers = {}
+    if len(records) > limit:
+        records = records[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(records[-1].test_date, records[-1].id)
+    return Response(content=records_to_json(records), media_type="application/json", headers=headers)
+
+def cohort_window(date_from: Optional[datetime], date_to: Optional[datetime]):
+    """Resolve a cohort date window, defaulting to the last year"""
+    date_to = to_naive_utc(date_to) if date_to is not None else datetime.utcnow()
+    date_from = to_naive_utc(date_from) if date_from is not None else date_to - timedelta(days=365)
+    if date_from >= date_to:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+    return date_from, date_to
+
+@app.get("/api/cohort/distribution", response_model=CohortDistributionResponse)
+async def get_cohort_distribution(
+    category: str = Query(..., description="Test category"),
+    test_type: str = Query(..., alias="testType", description="Test type"),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Start of the window (default one year before 'to')"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="End of the window, exclusive (default now)"),
+    bins: int = Query(20, ge=1, le=200, description="Number of histogram bins"),
+    low: Optional[float] = Query(None, alias="min", description="Lower bound of the histogram (default smallest value)"),
+    high: Optional[float] = Query(None, alias="max", description="Upper bound of the histogram (default largest value)"),
+    current_user: User = Depends(require_roles(*CLINICIAN_ROLES))
+):
+    """Get the distribution of one test type's values across all patients"""
+    date_from, date_to = cohort_window(date_from, date_to)
+    if low is not None and high is not None and high <= low:
+        raise HTTPException(status_code=400, detail="'max' must be greater than 'min'")
+    try:
+        return await value_distribution(category, test_type, date_from, date_to, bins, low, high)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error computing cohort distribution: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.get("/api/cohort/abnormal-rate", response_model=list[CohortAbnormalRateResponse])
+async def get_cohort_abnormal_rate(
+    category: str = Query(..., description="Test category"),
+    test_type: Optional[str] = Query(None, alias="testType", description="Only count this test type"),
+    bucket: Literal["day", "week", "month"] = Query("month", description="Bucket size"),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Start of the window (default one year before 'to')"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="End of the window, exclusive (default now)"),
+    current_user: User = Depends(require_roles(*CLINICIAN_ROLES))
+):
+    """Get the percentage of out-of-range results per bucket across all patients"""
+    date_from, date_to = cohort_window(date_from, date_to)
+    try:
+        return await abnormal_rate(category, test_type, bucket, date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error computing cohort abnormal rate: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.get("/api/admin/partitions")
+async def get_partitions(current_user: User = Depends(require_roles("admin"))):
+    """List test_records partitions and archived months"""
+    try:
+        async with engine.connect() as conn:
+            return await list_partitions(conn)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/admin/partitions/{month}/archive")
+async def archive_test_record_partition(month: str, current_user: User = Depends(require_roles("admin"))):
+    """Move a past month of test records to a compressed archive file"""
+    try:
+        start = parse_month(month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Month must be formatted as YYYY-MM")
+    try:
+        async with engine.begin() as conn:
+            return await archive_partition(conn, start)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"Error archiving partition {month}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/api/admin/partitions/{month}/restore")
+async def restore_test_record_partition(month: str, current_user: User = Depends(require_roles("admin"))):
+    """Load an archived month of test records back into the database"""
+    try:
+        start = parse_month(month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Month must be formatted as YYYY-MM")
+    try:
+        async with engine.begin() as conn:
+            return await restore_partition(conn, start)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"Error restoring partition {month}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+def import_job_response(job) -> ImportJobResponse:
+    """Build the API representation of an import job"""
+    return ImportJobResponse(
+        id=job.id,
+        format=job.format,
+        status=job.status,
+        rowsProcessed=job.rows_processed,
+        rowsImported=job.rows_imported,
+        rowsSkipped=job.rows_skipped,
+        rowsFailed=job.rows_failed,
+        errors=json.loads(job.errors) if job.errors else [],
+        errorMessage=job.error_message,
+        createdAt=job.created_at,
+        startedAt=job.started_at,
+        finishedAt=job.finished_at
+    )
+
+@app.post("/api/test-records/import", response_model=ImportJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def import_test_records(
+    request: Request,
+    upload_format: Optional[str] = Query(None, alias="format", description="csv or ndjson; defaults to the Content-Type"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get test records for a specific category"""
-    try:
-        result = await db.execute(
-            text("SELECT * FROM test_records WHERE user_id = :user_id AND test_category = :category ORDER BY test_date DESC"),
-            {"user_id": current_user.id, "category": category}
+    """Import test records from a streamed CSV or NDJSON upload of any size"""
+    fmt = detect_format(upload_format, request.headers.get("content-type"))
+    if fmt is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Upload must be CSV (text/csv) or NDJSON (application/x-ndjson)"
         )
-        records = result.fetchall()
-        return [
-            TestRecordResponse(
-                id=record.id,
-                userId=record.user_id,
-                testCategory=record.test_category,
-                testType=record.test_type,
-                testValue=record.test_value,
-                unit=record.unit,
-                minRange=record.min_range,
-                maxRange=record.max_range,
-                testDate=record.test_date,
-                notes=record.notes,
-                createdAt=record.created_at,
-                updatedAt=record.updated_at
-            )
-            for record in records
-        ]
+    
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Upload must not exceed {IMPORT_MAX_BYTES} bytes"
+    )
+    if int(request.headers.get("content-length") or 0) > IMPORT_MAX_BYTES:
+        raise too_large
+    
+    # Spool the body to disk so memory use does not depend on the upload size
+    try:
+        path = await spool_upload(request.stream())
+    except UploadTooLarge:
+        raise too_large
+    try:
+        job = ImportJob(user_id=current_user.id, format=fmt, status="pending")
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
     except Exception as e:
+        os.unlink(path)
+        print(f"Import job creation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    task = asyncio.create_task(run_import(async_session, job.id, current_user.id, current_user.email, path, fmt))
+    import_tasks.add(task)
+    task.add_done_callback(import_tasks.discard)
+    return import_job_response(job)
+
+@app.get("/api/test-records/imports/{job_id}", response_model=ImportJobResponse)
+async def get_import_job(
+    job_id: uuid.UUID,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get the progress and row errors of an import job"""
+    result = await db.execute(
+        text("SELECT * FROM import_jobs WHERE id = :id AND user_id = :user_id"),
+        {"id": job_id, "user_id": current_user.id}
+    )
+    job = result.fetchone()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    if job.rows_imported and job.heartbeat_at and datetime.utcnow() - job.heartbeat_at < timedelta(seconds=REPLICA_STICKY_SECONDS):
+        # Rows from the latest batch may not be on the replica yet
+        remember_write(response, current_user.email)
+    return import_job_response(job)
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        reload=os.getenv("ENVIRONMENT", "development") != "production",
+    )
\ No newline at end of file
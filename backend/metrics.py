@@ -0,0 +1,301 @@
+import hmac
+import ipaddress
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy import event
+
+from ratelimit import client_ip
+
+logger = logging.getLogger(__name__)
+
+# Request metrics configuration
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# /metrics answers only clients in these networks, or any client sending
+# "Authorization: Bearer <METRICS_TOKEN>" when a token is set
+METRICS_ALLOWED_CIDRS = [
+    ipaddress.ip_network(cidr.strip(), strict=False)
+    for cidr in os.getenv("METRICS_ALLOWED_CIDRS", "127.0.0.1/32,::1/128").split(",")
+    if cidr.strip()
+]
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Requests slower than this are logged with their query breakdown (0 disables the log)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+# Executions of one statement within a request that count as an N+1 pattern
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+
+# Histogram buckets in seconds
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+# Statements shown per request in the slow-request log
+SLOW_LOG_TOP_STATEMENTS = 5
+
+def metrics_access_allowed(request: Request) -> bool:
+    """Whether the request may read /metrics: an allowed client address or the metrics token"""
+    if METRICS_TOKEN:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode(), METRICS_TOKEN.encode()):
+            return True
+    try:
+        address = ipaddress.ip_address(client_ip(request))
+    except ValueError:
+        return False
+    return any(address in network for network in METRICS_ALLOWED_CIDRS)
+
+class Histogram:
+    """Cumulative latency histogram keyed by a tuple of label values"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            # Per-bucket counts, then the +Inf count and the sum
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def items(self) -> Iterable[tuple]:
+        for labels, series in self._series.items():
+            cumulative, running = [], 0
+            for count in series[:-1]:
+                running += count
+                cumulative.append(running)
+            yield labels, cumulative, series[-1]
+
+class RequestStats:
+    """Queries issued while serving one request"""
+
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # statement -> [executions, seconds]
+        self.statements: Dict[str, list] = {}
+
+    def record(self, statement: str, seconds: float):
+        self.queries += 1
+        self.db_seconds += seconds
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def repeated(self, threshold: int) -> list:
+        """Statements executed at least threshold times, most frequent first"""
+        if threshold <= 0:
+            return []
+        return sorted(
+            ((statement, count) for statement, (count, _) in self.statements.items() if count >= threshold),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request_stats", default=None)
+
+# Counters are kept per worker process; scrape each worker or aggregate in Prometheus
+request_latency = Histogram(REQUEST_BUCKETS)
+request_db_latency = Histogram(REQUEST_BUCKETS)
+query_latency = Histogram(QUERY_BUCKETS)
+request_counts: Counter = Counter()
+request_queries: Counter = Counter()
+n_plus_one_counts: Counter = Counter()
+in_flight: Counter = Counter()
+query_errors = 0
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    query_latency.observe((), elapsed)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+def _handle_error(exception_context):
+    global query_errors
+    query_errors += 1
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+def instrument_engine(engine):
+    """Time every statement an engine executes and attribute it to the current request"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+_route_templates: Dict[object, str] = {}
+
+def _route_label(scope) -> str:
+    """Path template of the route that handled the request, to keep label cardinality bounded"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    template = _route_templates.get(endpoint)
+    if template is None:
+        for route in scope["app"].routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                template = route.path
+                break
+        else:
+            template = "unmatched"
+        _route_templates[endpoint] = template
+    return template
+
+def _statement_preview(statement: str, size: int = 200) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= size else statement[:size] + "..."
+
+def _report(method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+    request_counts[(method, route, str(status))] += 1
+    request_latency.observe((method, route), elapsed)
+    request_db_latency.observe((method, route), stats.db_seconds)
+    request_queries[(method, route)] += stats.queries
+
+    repeated = stats.repeated(N_PLUS_ONE_THRESHOLD)
+    if repeated:
+        n_plus_one_counts[(method, route)] += 1
+        statement, count = repeated[0]
+        logger.warning(
+            f"Possible N+1 in {method} {route}: statement ran {count} times in one request: "
+            f"{_statement_preview(statement)}"
+        )
+
+    if SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS:
+        top = sorted(stats.statements.items(), key=lambda item: item[1][1], reverse=True)[:SLOW_LOG_TOP_STATEMENTS]
+        breakdown = "".join(
+            f"\n  {count}x {seconds * 1000:.1f}ms {_statement_preview(statement)}"
+            for statement, (count, seconds) in top
+        )
+        logger.warning(
+            f"Slow request {method} {route} -> {status}: {elapsed * 1000:.1f}ms total, "
+            f"{stats.queries} queries, {stats.db_seconds * 1000:.1f}ms in database{breakdown}"
+        )
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status codes, in-flight requests and per-request queries"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_flight[method] += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight[method] -= 1
+            _current_request.reset(token)
+            _report(method, _route_label(scope), status_code, elapsed, stats)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _histogram_lines(name: str, help_text: str, histogram: Histogram, label_names: tuple) -> list:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, cumulative, total in histogram.items():
+        for bound, count in zip(histogram.buckets + ("+Inf",), cumulative):
+            bucket_labels = _labels(label_names, labels, 'le="' + str(bound) + '"')
+            lines.append(f"{name}_bucket{bucket_labels} {count}")
+        lines.append(f"{name}_sum{_labels(label_names, labels)} {total}")
+        lines.append(f"{name}_count{_labels(label_names, labels)} {cumulative[-1]}")
+    return lines
+
+def _counter_lines(name: str, help_text: str, kind: str, values: dict, label_names: tuple) -> list:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{_labels(label_names, labels)} {value}" for labels, value in values.items())
+    return lines
+
+def render_metrics(pools: Dict[str, dict], hash_pool: dict) -> str:
+    """Render all metrics in the Prometheus text exposition format"""
+    lines = []
+    lines += _histogram_lines(
+        "http_request_duration_seconds", "Request latency by route", request_latency, ("method", "route")
+    )
+    lines += _histogram_lines(
+        "http_request_db_seconds", "Database time per request by route", request_db_latency, ("method", "route")
+    )
+    lines += _counter_lines(
+        "http_requests_total", "Requests by route and status code", "counter",
+        request_counts, ("method", "route", "status")
+    )
+    lines += _counter_lines(
+        "http_requests_in_flight", "Requests currently being served", "gauge",
+        {(method,): count for method, count in in_flight.items()}, ("method",)
+    )
+    lines += _counter_lines(
+        "http_request_queries_total", "Database queries issued by route", "counter",
+        request_queries, ("method", "route")
+    )
+    lines += _counter_lines(
+        "http_request_n_plus_one_total", "Requests repeating one statement N_PLUS_ONE_THRESHOLD or more times",
+        "counter", n_plus_one_counts, ("method", "route")
+    )
+    lines += _histogram_lines("db_query_duration_seconds", "Statement execution time", query_latency, ())
+    lines += _counter_lines("db_query_errors_total", "Statements that raised an error", "counter", {(): query_errors}, ())
+
+    pool_metrics = (
+        ("db_pool_size", "gauge", "size"),
+        ("db_pool_checked_out", "gauge", "checkedOut"),
+        ("db_pool_overflow", "gauge", "overflow"),
+        ("db_pool_checkouts_total", "counter", "checkouts"),
+        ("db_pool_wait_seconds_total", "counter", "waitSecondsTotal"),
+        ("db_pool_wait_seconds_max", "gauge", "waitSecondsMax"),
+        ("db_pool_timeouts_total", "counter", "timeouts"),
+    )
+    for name, kind, key in pool_metrics:
+        lines += _counter_lines(
+            name, f"Connection pool {key}", kind, {(pool,): stats[key] for pool, stats in pools.items()}, ("pool",)
+        )
+
+    hash_metrics = (
+        ("password_hash_in_flight", "gauge", "inFlight"),
+        ("password_hash_completed_total", "counter", "completed"),
+        ("password_hash_rejected_total", "counter", "rejected"),
+        ("password_hash_seconds_total", "counter", "totalSeconds"),
+    )
+    for name, kind, key in hash_metrics:
+        lines += _counter_lines(name, f"Password hashing pool {key}", kind, {(): hash_pool[key]}, ())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sys
+import time
+from typing import NamedTuple
+
+from abnormal import ABNORMAL_CRITICAL_DEVIATION
+from database import engine, wait_for_db
+from partitions import PARTITIONING_ENABLED, convert_to_partitioned, ensure_partitions
+from rollups import backfill_rollups
+
+logger = logging.getLogger(__name__)
+
+# Migration configuration
+MIGRATIONS_DIR = os.getenv("MIGRATIONS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations"))
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "false").lower() == "true"
+
+# Advisory lock held while migrating so only one process applies migrations
+MIGRATION_LOCK_KEY = 4281907114
+# Seconds between attempts to take the lock, and how long to keep trying
+MIGRATION_LOCK_POLL_SECONDS = float(os.getenv("MIGRATION_LOCK_POLL_SECONDS", "1"))
+MIGRATION_LOCK_TIMEOUT_SECONDS = float(os.getenv("MIGRATION_LOCK_TIMEOUT_SECONDS", "900"))
+
+# First line of a migration that must run outside a transaction, e.g. for
+# CREATE INDEX CONCURRENTLY; its statements are separated by semicolons at line ends
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+_MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+_CONCURRENT_INDEX = re.compile(
+    r"^CREATE\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)\s+ON\s+(\w+)\s+(.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+SCHEMA_MIGRATIONS_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR PRIMARY KEY,
+        name VARCHAR NOT NULL,
+        checksum VARCHAR NOT NULL,
+        duration_ms INTEGER NOT NULL,
+        applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+    )
+"""
+
+class Migration(NamedTuple):
+    version: str
+    name: str
+    sql: str
+    checksum: str
+    transactional: bool
+
+def load_migrations(directory: str = MIGRATIONS_DIR) -> list:
+    """Read migration files ordered by version"""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = _MIGRATION_FILE.match(filename)
+        if match is None:
+            continue
+        with open(os.path.join(directory, filename), encoding="utf-8") as migration_file:
+            sql = migration_file.read()
+        migrations.append(Migration(
+            version=match.group(1),
+            name=match.group(2),
+            sql=sql,
+            checksum=hashlib.sha256(sql.encode()).hexdigest(),
+            transactional=not sql.lstrip().startswith(NO_TRANSACTION_MARKER),
+        ))
+    return migrations
+
+def split_statements(sql: str) -> list:
+    """Split a no-transaction migration into statements, dropping comment lines"""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    statements = re.split(r";\s*$", "\n".join(lines), flags=re.MULTILINE)
+    return [statement.strip() for statement in statements if statement.strip()]
+
+async def _drop_if_invalid(pg, index_name: str):
+    """Drop an index left invalid by an interrupted CREATE INDEX CONCURRENTLY"""
+    invalid = await pg.fetchval(
+        """
+        SELECT 1 FROM pg_index x JOIN pg_class c ON c.oid = x.indexrelid
+        WHERE c.relname = $1 AND c.relkind = 'i' AND NOT x.indisvalid
+        """,
+        index_name
+    )
+    if invalid:
+        logger.warning(f"Dropping invalid index {index_name} before rebuilding it")
+        await pg.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+
+async def _create_partitioned_index(pg, unique: str, name: str, table: str, definition: str):
+    """Build an index on every partition concurrently, then attach them to a parent index"""
+    if await pg.fetchval("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", name):
+        return
+    await pg.execute(f"CREATE {unique}INDEX IF NOT EXISTS {name} ON ONLY {table} {definition}")
+    partitions = await pg.fetch(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass($1)",
+        table
+    )
+    for partition in partitions:
+        child = f"{partition['relname']}_{name}"[:63]
+        await _drop_if_invalid(pg, child)
+        await pg.execute(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition['relname']} {definition}")
+        await pg.execute(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+
+async def _execute_statement(pg, statement: str):
+    match = _CONCURRENT_INDEX.match(statement)
+    if match is None:
+        await pg.execute(statement)
+        return
+    unique, name, table, definition = match.groups()
+    # CONCURRENTLY is not supported on a partitioned parent table
+    if await pg.fetchval("SELECT relkind::text FROM pg_class WHERE oid = to_regclass($1)", table) == "p":
+        await _create_partitioned_index(pg, unique or "", name, table, definition)
+        return
+    await _drop_if_invalid(pg, name)
+    await pg.execute(statement)
+
+async def _apply(pg, migration: Migration):
+    started = time.monotonic()
+    if migration.transactional:
+        async with pg.transaction():
+            await pg.execute(migration.sql)
+            await _record(pg, migration, started)
+    else:
+        for statement in split_statements(migration.sql):
+            await _execute_statement(pg, statement)
+        await _record(pg, migration, started)
+
+async def _record(pg, migration: Migration, started: float):
+    await pg.execute(
+        "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES ($1, $2, $3, $4)",
+        migration.version, migration.name, migration.checksum, int((time.monotonic() - started) * 1000)
+    )
+
+async def _applied_checksums(pg) -> dict:
+    rows = await pg.fetch("SELECT version, checksum FROM schema_migrations")
+    return {row["version"]: row["checksum"] for row in rows}
+
+async def pending_migrations() -> list:
+    """Migrations not yet recorded in schema_migrations"""
+    async with engine.connect() as conn:
+        raw_connection = await conn.get_raw_connection()
+        pg = raw_connection.driver_connection
+        if not await pg.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL"):
+            return load_migrations()
+        applied = await _applied_checksums(pg)
+    return [migration for migration in load_migrations() if migration.version not in applied]
+
+async def _acquire_lock(pg):
+    """Poll for the migration lock between autocommit statements.
+
+    Waiting inside pg_advisory_lock keeps a snapshot open, and CREATE INDEX CONCURRENTLY
+    in the process holding the lock waits for every open snapshot, so blocked waiters
+    would deadlock it.
+    """
+    deadline = time.monotonic() + MIGRATION_LOCK_TIMEOUT_SECONDS
+    while not await pg.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_KEY):
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Migration lock not acquired within {MIGRATION_LOCK_TIMEOUT_SECONDS:.0f}s")
+        logger.info("Waiting for another process to finish migrating")
+        await asyncio.sleep(MIGRATION_LOCK_POLL_SECONDS)
+
+async def migrate() -> list:
+    """Apply pending migrations once, serialized across processes by an advisory lock"""
+    applied_now = []
+    async with engine.connect() as conn:
+        raw_connection = await conn.get_raw_connection()
+        pg = raw_connection.driver_connection
+        await _acquire_lock(pg)
+        try:
+            await pg.execute(SCHEMA_MIGRATIONS_SQL)
+            # Settings that data migrations read with current_setting()
+            await pg.execute("SELECT set_config('app.abnormal_critical_deviation', $1, false)", str(ABNORMAL_CRITICAL_DEVIATION))
+            applied = await _applied_checksums(pg)
+            for migration in load_migrations():
+                if migration.version in applied:
+                    if applied[migration.version] != migration.checksum:
+                        logger.warning(f"Migration {migration.version}_{migration.name} changed after it was applied")
+                    continue
+                logger.info(f"Applying migration {migration.version}_{migration.name}")
+                await _apply(pg, migration)
+                applied_now.append(f"{migration.version}_{migration.name}")
+
+            # Schema steps that need application code, still under the lock
+            async with engine.begin() as step_conn:
+                if PARTITIONING_ENABLED:
+                    await convert_to_partitioned(step_conn)
+                    await ensure_partitions(step_conn)
+                await backfill_rollups(step_conn)
+        finally:
+            await pg.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+    return applied_now
+
+async def main(command: str):
+    await wait_for_db()
+    try:
+        if command == "status":
+            pending = await pending_migrations()
+            for migration in pending:
+                print(f"pending  {migration.version}_{migration.name}")
+            if not pending:
+                print("Database schema is up to date")
+        else:
+            applied = await migrate()
+            print(f"Applied {len(applied)} migration(s)" + (f": {', '.join(applied)}" if applied else ""))
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "up"
+    if command not in ("up", "status"):
+        print("Usage: python migrate.py [up|status]")
+        sys.exit(2)
+    asyncio.run(main(command))
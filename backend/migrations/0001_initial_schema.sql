@@ -0,0 +1,134 @@
+-- Tables as defined in models.py. Every statement is idempotent so databases
+-- created earlier by Base.metadata.create_all adopt this history unchanged.
+
+CREATE TABLE IF NOT EXISTS users (
+    id UUID NOT NULL,
+    email VARCHAR NOT NULL,
+    hashed_password VARCHAR NOT NULL,
+    first_name VARCHAR NOT NULL,
+    last_name VARCHAR NOT NULL,
+    role VARCHAR,
+    is_active BOOLEAN,
+    email_verified BOOLEAN,
+    email_verification_code VARCHAR,
+    email_verification_expires TIMESTAMP WITHOUT TIME ZONE,
+    password_reset_code VARCHAR,
+    password_reset_expires TIMESTAMP WITHOUT TIME ZONE,
+    created_at TIMESTAMP WITHOUT TIME ZONE,
+    updated_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE IF NOT EXISTS test_records (
+    id UUID NOT NULL,
+    user_id UUID NOT NULL,
+    test_category VARCHAR NOT NULL,
+    test_type VARCHAR NOT NULL,
+    test_value FLOAT NOT NULL,
+    unit VARCHAR NOT NULL,
+    min_range FLOAT,
+    max_range FLOAT,
+    test_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    notes TEXT,
+    result_flag VARCHAR,
+    range_deviation FLOAT,
+    created_at TIMESTAMP WITHOUT TIME ZONE,
+    updated_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (id),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+-- Added after the first releases
+ALTER TABLE test_records ADD COLUMN IF NOT EXISTS result_flag VARCHAR;
+ALTER TABLE test_records ADD COLUMN IF NOT EXISTS range_deviation FLOAT;
+
+CREATE TABLE IF NOT EXISTS test_panels (
+    id UUID NOT NULL,
+    name VARCHAR NOT NULL,
+    display_name VARCHAR NOT NULL,
+    description TEXT,
+    tests TEXT NOT NULL,
+    is_active BOOLEAN,
+    created_at TIMESTAMP WITHOUT TIME ZONE,
+    updated_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (id),
+    UNIQUE (name)
+);
+
+CREATE TABLE IF NOT EXISTS test_record_rollups (
+    user_id UUID NOT NULL,
+    test_category VARCHAR NOT NULL,
+    test_type VARCHAR NOT NULL,
+    bucket VARCHAR NOT NULL,
+    bucket_start TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    value_count INTEGER NOT NULL,
+    value_sum FLOAT NOT NULL,
+    min_value FLOAT NOT NULL,
+    max_value FLOAT NOT NULL,
+    last_value FLOAT NOT NULL,
+    last_test_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    out_of_range_count INTEGER NOT NULL,
+    updated_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (user_id, test_category, test_type, bucket, bucket_start),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS user_data_versions (
+    user_id UUID NOT NULL,
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (user_id),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS response_cache_entries (
+    cache_key VARCHAR NOT NULL,
+    body BYTEA NOT NULL,
+    headers TEXT NOT NULL,
+    accessed_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (cache_key)
+);
+
+CREATE TABLE IF NOT EXISTS import_jobs (
+    id UUID NOT NULL,
+    user_id UUID NOT NULL,
+    format VARCHAR NOT NULL,
+    status VARCHAR NOT NULL,
+    rows_processed INTEGER NOT NULL,
+    rows_imported INTEGER NOT NULL,
+    rows_skipped INTEGER NOT NULL,
+    rows_failed INTEGER NOT NULL,
+    errors TEXT,
+    error_message TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE,
+    started_at TIMESTAMP WITHOUT TIME ZONE,
+    finished_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (id),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS test_record_archives (
+    partition_name VARCHAR NOT NULL,
+    range_start TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    range_end TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    path VARCHAR NOT NULL,
+    row_count BIGINT NOT NULL,
+    archived_at TIMESTAMP WITHOUT TIME ZONE,
+    restored_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (partition_name)
+);
+
+CREATE TABLE IF NOT EXISTS outbound_emails (
+    id UUID NOT NULL,
+    recipient VARCHAR NOT NULL,
+    subject VARCHAR NOT NULL,
+    html_body TEXT NOT NULL,
+    status VARCHAR NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    last_error TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE,
+    sent_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (id)
+);
@@ -0,0 +1,28 @@
+-- Flag rows written before result_flag existed; mirrors abnormal.classify_result.
+-- migrate.py sets app.abnormal_critical_deviation from ABNORMAL_CRITICAL_DEVIATION.
+-- Rows whose range has no width are left unflagged, as classify_result rejects them.
+WITH scored AS (
+    SELECT id,
+           CASE
+               WHEN min_range IS NOT NULL AND test_value < min_range
+                   THEN (test_value - min_range) / COALESCE(max_range - min_range, NULLIF(abs(min_range), 0), 1)
+               WHEN max_range IS NOT NULL AND test_value > max_range
+                   THEN (test_value - max_range) / COALESCE(max_range - min_range, NULLIF(abs(max_range), 0), 1)
+               ELSE 0
+           END AS deviation
+    FROM test_records
+    WHERE result_flag IS NULL
+      AND (min_range IS NOT NULL OR max_range IS NOT NULL)
+      AND (min_range IS NULL OR max_range IS NULL OR max_range > min_range)
+)
+UPDATE test_records t
+SET range_deviation = s.deviation,
+    result_flag = CASE
+        WHEN abs(s.deviation) >= COALESCE(NULLIF(current_setting('app.abnormal_critical_deviation', true), '')::float8, 0.5)
+            THEN 'critical'
+        WHEN s.deviation < 0 THEN 'low'
+        WHEN s.deviation > 0 THEN 'high'
+        ELSE 'normal'
+    END
+FROM scored s
+WHERE t.id = s.id;
@@ -0,0 +1,21 @@
+-- migrate: no-transaction
+-- Secondary indexes, built without blocking writes
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_users_email ON users (email);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_email_verification_code ON users (email_verification_code);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_test_records_user_id ON test_records (user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_test_records_test_category ON test_records (test_category);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_test_records_test_date ON test_records (test_date);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_test_records_user_category_type_date ON test_records (user_id, test_category, test_type, test_date);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_test_records_category_type_date ON test_records (test_category, test_type, test_date) INCLUDE (test_value);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_test_records_abnormal_user_date ON test_records (user_id, test_date) WHERE result_flag <> 'normal';
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_test_records_abnormal_date ON test_records (test_date) WHERE result_flag <> 'normal';
+
+-- Duplicate of ix_test_records_test_category left behind by the Supabase migrations
+DROP INDEX CONCURRENTLY IF EXISTS idx_test_records_category;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_test_record_rollups_category_type_bucket ON test_record_rollups (test_category, test_type, bucket, bucket_start) INCLUDE (value_count, out_of_range_count, min_value, max_value);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_response_cache_entries_accessed_at ON response_cache_entries (accessed_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_import_jobs_user_id ON import_jobs (user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_outbound_emails_pending ON outbound_emails (next_attempt_at) WHERE status = 'pending';
@@ -0,0 +1,10 @@
+-- Token buckets for auth rate limiting, shared by all workers (ratelimit.py).
+-- Unlogged: losing the buckets on a crash only resets the limits.
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+    bucket_key VARCHAR NOT NULL,
+    tokens FLOAT NOT NULL,
+    updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (bucket_key)
+);
+
+CREATE INDEX IF NOT EXISTS ix_rate_limit_buckets_updated_at ON rate_limit_buckets (updated_at);
@@ -0,0 +1,17 @@
+-- Server-side refresh tokens: rotated on every refresh, revoked per family (refresh_sessions.py)
+CREATE TABLE IF NOT EXISTS refresh_sessions (
+    token_hash VARCHAR NOT NULL,
+    family_id UUID NOT NULL,
+    user_id UUID NOT NULL,
+    remember_me BOOLEAN NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    rotated_at TIMESTAMP WITHOUT TIME ZONE,
+    revoked_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (token_hash),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_refresh_sessions_family_id ON refresh_sessions (family_id);
+CREATE INDEX IF NOT EXISTS ix_refresh_sessions_user_id ON refresh_sessions (user_id);
+CREATE INDEX IF NOT EXISTS ix_refresh_sessions_expires_at ON refresh_sessions (expires_at);
@@ -0,0 +1,31 @@
+-- Per-user catalogue of categories and test types (catalogue.py), maintained on insert
+CREATE TABLE IF NOT EXISTS user_test_catalogue (
+    user_id UUID NOT NULL,
+    test_category VARCHAR NOT NULL,
+    test_type VARCHAR NOT NULL,
+    unit VARCHAR NOT NULL,
+    record_count INTEGER NOT NULL,
+    first_test_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    last_test_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    last_value FLOAT NOT NULL,
+    last_result_flag VARCHAR,
+    updated_at TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (user_id, test_category, test_type),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+-- Build the catalogue from existing records
+INSERT INTO user_test_catalogue (
+    user_id, test_category, test_type, unit, record_count,
+    first_test_date, last_test_date, last_value, last_result_flag, updated_at
+)
+SELECT
+    user_id, test_category, test_type,
+    (array_agg(unit ORDER BY test_date DESC))[1], count(*),
+    min(test_date), max(test_date),
+    (array_agg(test_value ORDER BY test_date DESC))[1],
+    (array_agg(result_flag ORDER BY test_date DESC))[1],
+    now() AT TIME ZONE 'utc'
+FROM test_records
+GROUP BY user_id, test_category, test_type
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,3 @@
+-- Last sign of life from the worker running an import (importer.py), so jobs whose
+-- worker died can be told apart from jobs still in progress
+ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITHOUT TIME ZONE;
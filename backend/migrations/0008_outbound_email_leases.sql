@@ -0,0 +1,3 @@
+-- Dispatchers lease the messages they are sending (email_service.py) instead of
+-- holding row locks during SMTP; a lapsed lease lets another dispatcher retry
+ALTER TABLE outbound_emails ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITHOUT TIME ZONE;
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, DateTime, ForeignKey, Boolean, Integer, Text
+from sqlalchemy import Column, String, Float, DateTime, ForeignKey, Boolean, Integer, BigInteger, Text, LargeBinary, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
@@ -9,6 +9,9 @@ Base = declarative_base()
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("idx_users_email_verification_code", "email_verification_code"),
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     email = Column(String, unique=True, index=True, nullable=False)
@@ -30,6 +33,26 @@ class User(Base):
 
 class TestRecord(Base):
     __tablename__ = "test_records"
+    # With PARTITIONING_ENABLED the table is range-partitioned by test_date and
+    # its primary key becomes (id, test_date); see partitions.py
+    __table_args__ = (
+        # Serves per-series chart queries filtered by type and date window
+        Index("ix_test_records_user_category_type_date", "user_id", "test_category", "test_type", "test_date"),
+        # Serves cohort queries over one test type across all patients without touching the heap
+        Index(
+            "ix_test_records_category_type_date", "test_category", "test_type", "test_date",
+            postgresql_include=["test_value"]
+        ),
+        # Partial indexes over abnormal results only, per patient and across patients
+        Index(
+            "ix_test_records_abnormal_user_date", "user_id", "test_date",
+            postgresql_where=text("result_flag <> 'normal'")
+        ),
+        Index(
+            "ix_test_records_abnormal_date", "test_date",
+            postgresql_where=text("result_flag <> 'normal'")
+        ),
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -41,12 +64,143 @@ class TestRecord(Base):
     max_range = Column(Float, nullable=True)
     test_date = Column(DateTime, nullable=False, index=True)
     notes = Column(Text, nullable=True)  # Optional notes for the test record
+    result_flag = Column(String, nullable=True)  # low, normal, high, critical; NULL without a reference range
+    range_deviation = Column(Float, nullable=True)  # Signed distance outside the range, in range widths
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     user = relationship("User", back_populates="test_records")
 
+class TestRecordRollup(Base):
+    __tablename__ = "test_record_rollups"
+    __table_args__ = (
+        # Serves cohort queries that sum buckets across all patients
+        Index(
+            "ix_test_record_rollups_category_type_bucket", "test_category", "test_type", "bucket", "bucket_start",
+            postgresql_include=["value_count", "out_of_range_count", "min_value", "max_value"]
+        ),
+    )
+    
+    # One row per (user, category, test type) series and time bucket
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    test_category = Column(String, primary_key=True)
+    test_type = Column(String, primary_key=True)
+    bucket = Column(String, primary_key=True)  # day, week, month
+    bucket_start = Column(DateTime, primary_key=True)
+    value_count = Column(Integer, nullable=False)
+    value_sum = Column(Float, nullable=False)
+    min_value = Column(Float, nullable=False)
+    max_value = Column(Float, nullable=False)
+    last_value = Column(Float, nullable=False)
+    last_test_date = Column(DateTime, nullable=False)
+    out_of_range_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UserTestCatalogue(Base):
+    __tablename__ = "user_test_catalogue"
+    
+    # One row per (user, category, test type) the user has records for
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    test_category = Column(String, primary_key=True)
+    test_type = Column(String, primary_key=True)
+    unit = Column(String, nullable=False)  # unit of the latest record
+    record_count = Column(Integer, nullable=False)
+    first_test_date = Column(DateTime, nullable=False)
+    last_test_date = Column(DateTime, nullable=False)
+    last_value = Column(Float, nullable=False)
+    last_result_flag = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UserDataVersion(Base):
+    __tablename__ = "user_data_versions"
+    
+    # Bumped on every write to a user's test records; used for ETags and cache keys
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ResponseCacheEntry(Base):
+    __tablename__ = "response_cache_entries"
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+    
+    cache_key = Column(String, primary_key=True)
+    body = Column(LargeBinary, nullable=False)
+    headers = Column(Text, nullable=False)  # JSON object of extra response headers
+    accessed_at = Column(DateTime, nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False)
+
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+    
+    # Token bucket shared by all workers, e.g. "login:ip:203.0.113.7"
+    bucket_key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime, nullable=False, index=True)
+
+class RefreshSession(Base):
+    __tablename__ = "refresh_sessions"
+    
+    # One row per issued refresh token; a family is the chain of rotations from one login
+    token_hash = Column(String, primary_key=True)  # SHA-256 of the token's jti
+    family_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    remember_me = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    rotated_at = Column(DateTime, nullable=True)  # set when exchanged for the next token
+    revoked_at = Column(DateTime, nullable=True)
+
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    format = Column(String, nullable=False)  # csv, ndjson
+    status = Column(String, nullable=False, default="pending")  # pending, running, completed, failed
+    rows_processed = Column(Integer, nullable=False, default=0)
+    rows_imported = Column(Integer, nullable=False, default=0)
+    rows_skipped = Column(Integer, nullable=False, default=0)  # duplicates of existing records
+    rows_failed = Column(Integer, nullable=False, default=0)
+    errors = Column(Text, nullable=True)  # JSON list of the first row errors
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # updated after every batch while running
+
+class TestRecordArchive(Base):
+    __tablename__ = "test_record_archives"
+    
+    # One row per monthly test_records partition moved to a compressed file
+    partition_name = Column(String, primary_key=True)
+    range_start = Column(DateTime, nullable=False)
+    range_end = Column(DateTime, nullable=False)
+    path = Column(String, nullable=False)
+    row_count = Column(BigInteger, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    restored_at = Column(DateTime, nullable=True)
+
+class OutboundEmail(Base):
+    __tablename__ = "outbound_emails"
+    __table_args__ = (
+        # Only pending messages are polled by the mail dispatcher
+        Index("ix_outbound_emails_pending", "next_attempt_at", postgresql_where=text("status = 'pending'")),
+    )
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    html_body = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending, sending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    lease_expires_at = Column(DateTime, nullable=True)  # while sending: when other dispatchers may reclaim it
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
 class TestPanel(Base):
     __tablename__ = "test_panels"
     
@@ -0,0 +1,406 @@
+import asyncio
+import gzip
+import os
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from catalogue import rebuild_catalogue
+from models import TestRecord
+from rollups import rebuild_rollups
+
+# Partitioning configuration
+PARTITIONING_ENABLED = os.getenv("PARTITIONING_ENABLED", "false").lower() == "true"
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))  # future partitions kept ready
+PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", "0"))  # 0 keeps every month online
+# Absolute, so archive paths recorded in test_record_archives do not depend on the working directory
+PARTITION_ARCHIVE_DIR = os.path.abspath(
+    os.getenv("PARTITION_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archives"))
+)
+PARTITION_MAINTENANCE_SECONDS = float(os.getenv("PARTITION_MAINTENANCE_SECONDS", "3600"))
+
+PARENT_TABLE = "test_records"
+# Catches rows dated in months that have no partition, e.g. archived ones
+DEFAULT_PARTITION = "test_records_default"
+
+# Advisory lock serializing partition changes across workers
+PARTITION_LOCK_KEY = 4281907113
+# Session-level advisory lock held by the one worker that runs PartitionMaintainer
+PARTITION_MAINTAINER_LOCK_KEY = 4281907115
+# Temp table listing the series with rows in the partition being archived or restored
+AFFECTED_SERIES_TABLE = "partition_affected_series"
+_ARCHIVE_CHUNK_BYTES = 1 << 20
+
+def month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def add_months(value: datetime, months: int) -> datetime:
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1)
+
+def parse_month(value: str) -> datetime:
+    """Parse a YYYY-MM month; raises ValueError"""
+    return datetime.strptime(value, "%Y-%m")
+
+def partition_name(start: datetime) -> str:
+    return f"{PARENT_TABLE}_p{start:%Y%m}"
+
+def _bounds(start: datetime) -> str:
+    return f"FROM ('{start:%Y-%m-%d}') TO ('{add_months(start, 1):%Y-%m-%d}')"
+
+async def _lock(conn: AsyncConnection):
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+
+async def _table_exists(conn: AsyncConnection, name: str) -> bool:
+    result = await conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+    return result.scalar()
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    result = await conn.execute(
+        text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass(:table)"), {"table": PARENT_TABLE}
+    )
+    return result.scalar() == "p"
+
+async def _collect_affected_series(conn: AsyncConnection, name: str):
+    """List the series with rows in a partition, for _refresh_derived"""
+    await conn.execute(text(f"""
+        CREATE TEMP TABLE {AFFECTED_SERIES_TABLE} ON COMMIT DROP AS
+        SELECT DISTINCT user_id, test_category, test_type FROM {name}
+    """))
+
+async def _refresh_derived(conn: AsyncConnection, start: datetime):
+    """Bring rollups, catalogues and data versions in line after a month's rows came or went.
+
+    Runs in the archive or restore transaction, so readers never see them disagree with test_records.
+    """
+    await rebuild_rollups(conn, AFFECTED_SERIES_TABLE, start, add_months(start, 1))
+    await rebuild_catalogue(conn, AFFECTED_SERIES_TABLE)
+    await conn.execute(
+        text(f"""
+            INSERT INTO user_data_versions (user_id, version, updated_at)
+            SELECT DISTINCT user_id, 1, CAST(:now AS timestamp) FROM {AFFECTED_SERIES_TABLE}
+            ON CONFLICT (user_id) DO UPDATE SET
+                version = user_data_versions.version + 1,
+                updated_at = EXCLUDED.updated_at
+        """),
+        {"now": datetime.utcnow()}
+    )
+    await conn.execute(text(f"DROP TABLE {AFFECTED_SERIES_TABLE}"))
+
+async def _attach_month(conn: AsyncConnection, start: datetime, source: Optional[AsyncIterator[bytes]] = None):
+    """Create a month's partition, optionally loading an archive, and attach it"""
+    name = partition_name(start)
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS)"))
+    if source is not None:
+        raw_connection = await conn.get_raw_connection()
+        await raw_connection.driver_connection.copy_to_table(name, source=source, format="binary")
+    # Rows that landed in the default partition while the month had no partition of its own
+    await conn.execute(
+        text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION}
+                WHERE test_date >= :start AND test_date < :end
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """),
+        {"start": start, "end": add_months(start, 1)}
+    )
+    await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} FOR VALUES {_bounds(start)}"))
+
+async def convert_to_partitioned(conn: AsyncConnection) -> bool:
+    """Rebuild test_records as a table range-partitioned by month of test_date.
+
+    Copies every row, so on a large table run it in a maintenance window.
+    Returns False if the table is already partitioned.
+    """
+    await _lock(conn)
+    if await is_partitioned(conn):
+        return False
+
+    result = await conn.execute(text(f"SELECT min(test_date) FROM {PARENT_TABLE}"))
+    oldest = result.scalar()
+    now = datetime.utcnow()
+    legacy = f"{PARENT_TABLE}_unpartitioned"
+
+    await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} RENAME TO {legacy}"))
+    await conn.execute(text(
+        f"CREATE TABLE {PARENT_TABLE} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (test_date)"
+    ))
+    await conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"))
+    start = month_start(oldest or now)
+    last = add_months(month_start(now), PARTITION_PREMAKE_MONTHS)
+    while start <= last:
+        await conn.execute(text(
+            f"CREATE TABLE {partition_name(start)} PARTITION OF {PARENT_TABLE} FOR VALUES {_bounds(start)}"
+        ))
+        start = add_months(start, 1)
+
+    await conn.execute(text(f"INSERT INTO {PARENT_TABLE} SELECT * FROM {legacy}"))
+    await conn.execute(text(f"DROP TABLE {legacy}"))
+
+    # Unique constraints on a partitioned table must include the partition key
+    await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} ADD PRIMARY KEY (id, test_date)"))
+    await conn.execute(text(
+        f"ALTER TABLE {PARENT_TABLE} ADD FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE"
+    ))
+    await conn.run_sync(lambda sync_conn: [
+        index.create(sync_conn, checkfirst=True) for index in TestRecord.__table__.indexes
+    ])
+    print(f"Partitioned {PARENT_TABLE} by month of test_date")
+    return True
+
+async def ensure_partitions(conn: AsyncConnection, now: Optional[datetime] = None) -> list:
+    """Create partitions for the current month and the next PARTITION_PREMAKE_MONTHS"""
+    await _lock(conn)
+    if not await is_partitioned(conn):
+        return []
+    current = month_start(now or datetime.utcnow())
+    created = []
+    for offset in range(PARTITION_PREMAKE_MONTHS + 1):
+        start = add_months(current, offset)
+        if not await _table_exists(conn, partition_name(start)):
+            await _attach_month(conn, start)
+            created.append(partition_name(start))
+    return created
+
+async def expired_partitions(conn: AsyncConnection, now: Optional[datetime] = None) -> list:
+    """Start months of online partitions older than the retention period"""
+    if PARTITION_RETENTION_MONTHS <= 0 or not await is_partitioned(conn):
+        return []
+    cutoff = add_months(month_start(now or datetime.utcnow()), -PARTITION_RETENTION_MONTHS)
+    result = await conn.execute(
+        text("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:table) AND c.relname LIKE :pattern
+            ORDER BY c.relname
+        """),
+        {"table": PARENT_TABLE, "pattern": f"{PARENT_TABLE}_p%"}
+    )
+    starts = [datetime.strptime(name[-6:], "%Y%m") for name in result.scalars()]
+    return [start for start in starts if add_months(start, 1) <= cutoff]
+
+async def list_partitions(conn: AsyncConnection) -> dict:
+    """Online partitions with their size, and archived months"""
+    partitioned = await is_partitioned(conn)
+    partitions = []
+    if partitioned:
+        result = await conn.execute(
+            text("""
+                SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bounds,
+                       greatest(c.reltuples, 0)::bigint AS estimated_rows,
+                       pg_total_relation_size(c.oid) AS total_bytes
+                FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass(:table)
+                ORDER BY c.relname
+            """),
+            {"table": PARENT_TABLE}
+        )
+        partitions = [
+            {"name": row.name, "bounds": row.bounds, "estimatedRows": row.estimated_rows, "totalBytes": row.total_bytes}
+            for row in result.fetchall()
+        ]
+    result = await conn.execute(text("SELECT * FROM test_record_archives ORDER BY range_start"))
+    archives = [
+        {
+            "name": row.partition_name,
+            "rangeStart": row.range_start,
+            "rangeEnd": row.range_end,
+            "path": row.path,
+            "rowCount": row.row_count,
+            "archivedAt": row.archived_at,
+            "restoredAt": row.restored_at,
+        }
+        for row in result.fetchall()
+    ]
+    return {"partitioned": partitioned, "partitions": partitions, "archives": archives}
+
+def _open_archive(path: str):
+    raw = open(path, "wb")
+    return raw, gzip.GzipFile(fileobj=raw, mode="wb")
+
+def _close_archive(raw, archive):
+    archive.close()
+    raw.flush()
+    os.fsync(raw.fileno())
+    raw.close()
+
+async def archive_partition(conn: AsyncConnection, start: datetime) -> dict:
+    """Write a past month's partition to a gzip file, then detach and drop it.
+
+    The caller's transaction must commit for the partition to be removed.
+    """
+    await _lock(conn)
+    name = partition_name(start)
+    if not await is_partitioned(conn) or not await _table_exists(conn, name):
+        raise ValueError(f"No online partition for {start:%Y-%m}")
+    if add_months(start, 1) > month_start(datetime.utcnow()):
+        raise ValueError("Only months before the current one can be archived")
+
+    # Block writes to the month until the partition is gone
+    await conn.execute(text(f"LOCK TABLE {name} IN SHARE MODE"))
+    os.makedirs(PARTITION_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(PARTITION_ARCHIVE_DIR, f"{name}.copy.gz")
+    partial_path = path + ".partial"
+    raw, archive = await asyncio.to_thread(_open_archive, partial_path)
+    try:
+        async def write(chunk: bytes):
+            await asyncio.to_thread(archive.write, chunk)
+
+        raw_connection = await conn.get_raw_connection()
+        status = await raw_connection.driver_connection.copy_from_table(name, output=write, format="binary")
+    finally:
+        await asyncio.to_thread(_close_archive, raw, archive)
+    os.replace(partial_path, path)
+    row_count = int(status.split()[-1])
+
+    await _collect_affected_series(conn, name)
+    await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+    await conn.execute(text(f"DROP TABLE {name}"))
+    await _refresh_derived(conn, start)
+    await conn.execute(
+        text("""
+            INSERT INTO test_record_archives (partition_name, range_start, range_end, path, row_count, archived_at)
+            VALUES (:name, :start, :end, :path, :row_count, :now)
+            ON CONFLICT (partition_name) DO UPDATE SET
+                path = EXCLUDED.path,
+                row_count = EXCLUDED.row_count,
+                archived_at = EXCLUDED.archived_at,
+                restored_at = NULL
+        """),
+        {
+            "name": name, "start": start, "end": add_months(start, 1),
+            "path": path, "row_count": row_count, "now": datetime.utcnow(),
+        }
+    )
+    print(f"Archived {row_count} rows of {name} to {path}")
+    return {"name": name, "path": path, "rowCount": row_count}
+
+async def _read_archive(path: str) -> AsyncIterator[bytes]:
+    archive = await asyncio.to_thread(gzip.open, path, "rb")
+    try:
+        while True:
+            chunk = await asyncio.to_thread(archive.read, _ARCHIVE_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        await asyncio.to_thread(archive.close)
+
+async def restore_partition(conn: AsyncConnection, start: datetime) -> dict:
+    """Load an archived month back from its file and attach it as a partition"""
+    await _lock(conn)
+    name = partition_name(start)
+    if not await is_partitioned(conn):
+        raise ValueError(f"{PARENT_TABLE} is not partitioned")
+    if await _table_exists(conn, name):
+        raise ValueError(f"Partition for {start:%Y-%m} is already online")
+    result = await conn.execute(
+        text("SELECT path FROM test_record_archives WHERE partition_name = :name AND restored_at IS NULL"),
+        {"name": name}
+    )
+    path = result.scalar()
+    if path is None or not os.path.exists(path):
+        raise ValueError(f"No archive for {start:%Y-%m}")
+
+    await _attach_month(conn, start, source=_read_archive(path))
+    await _collect_affected_series(conn, name)
+    await _refresh_derived(conn, start)
+    await conn.execute(
+        text("UPDATE test_record_archives SET restored_at = :now WHERE partition_name = :name"),
+        {"name": name, "now": datetime.utcnow()}
+    )
+    result = await conn.execute(text(f"SELECT count(*) FROM {name}"))
+    row_count = result.scalar()
+    print(f"Restored {row_count} rows of {name} from {path}")
+    return {"name": name, "path": path, "rowCount": row_count}
+
+class PartitionMaintainer:
+    """Background task that keeps future partitions ready and archives expired ones.
+
+    Started in every worker, but only the one holding PARTITION_MAINTAINER_LOCK_KEY does
+    the work; the others retry the lock each interval and take over if that worker exits.
+    """
+
+    def __init__(self, engine: AsyncEngine, interval_seconds: float = PARTITION_MAINTENANCE_SECONDS):
+        self.engine = engine
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._lock_connection: Optional[AsyncConnection] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._release_lock()
+
+    async def _hold_lock(self) -> bool:
+        """Take or confirm the maintainer lock on a connection kept open while it is held"""
+        if self._lock_connection is not None:
+            try:
+                await self._lock_connection.execute(text("SELECT 1"))
+                await self._lock_connection.commit()
+                return True
+            except Exception:
+                # The connection, and with it the lock, is gone
+                await self._lock_connection.invalidate()
+                self._lock_connection = None
+        connection = await self.engine.connect()
+        acquired = await connection.scalar(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": PARTITION_MAINTAINER_LOCK_KEY}
+        )
+        # Session-level locks outlive the transaction; don't sit idle in one
+        await connection.commit()
+        if not acquired:
+            await connection.close()
+            return False
+        self._lock_connection = connection
+        return True
+
+    async def _release_lock(self):
+        if self._lock_connection is None:
+            return
+        try:
+            await self._lock_connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": PARTITION_MAINTAINER_LOCK_KEY}
+            )
+            await self._lock_connection.commit()
+            await self._lock_connection.close()
+        except Exception:
+            await self._lock_connection.invalidate()
+        self._lock_connection = None
+
+    async def _run(self):
+        while True:
+            try:
+                if await self._hold_lock():
+                    await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Partition maintenance error: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def run_once(self):
+        async with self.engine.begin() as conn:
+            created = await ensure_partitions(conn)
+            expired = await expired_partitions(conn)
+        if created:
+            print(f"Created partitions: {', '.join(created)}")
+        for start in expired:
+            try:
+                async with self.engine.begin() as conn:
+                    await archive_partition(conn, start)
+            except ValueError:
+                # Another worker archived it first
+                pass
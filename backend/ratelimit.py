@@ -0,0 +1,201 @@
+import ipaddress
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from sqlalchemy import text
+
+from cache import TTLCache
+
+# Rate limit configuration
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "database")  # database, memory, none
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))  # per worker, memory store and deny cache
+# Buckets idle this long are deleted from the database store
+RATE_LIMIT_IDLE_SECONDS = int(os.getenv("RATE_LIMIT_IDLE_SECONDS", "86400"))
+RATE_LIMIT_PRUNE_SECONDS = float(os.getenv("RATE_LIMIT_PRUNE_SECONDS", "300"))
+# Networks of reverse proxies whose X-Forwarded-For / X-Real-IP name the client.
+# Requests from anywhere else are keyed on their own address, so clients cannot pick their key.
+TRUSTED_PROXY_CIDRS = [
+    ipaddress.ip_network(cidr.strip(), strict=False)
+    for cidr in os.getenv("TRUSTED_PROXY_CIDRS", "127.0.0.1/32,::1/128").split(",")
+    if cidr.strip()
+]
+
+def parse_rate(value: str) -> Tuple[float, float]:
+    """Parse "attempts/seconds" into a bucket capacity and refill rate per second"""
+    attempts, _, seconds = value.partition("/")
+    capacity = float(attempts)
+    return capacity, capacity / float(seconds)
+
+# Bucket sizes as "attempts/seconds": a full bucket allows a burst of attempts,
+# then refills at attempts per seconds
+RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    # Password logins
+    "login:ip": parse_rate(os.getenv("RATE_LIMIT_LOGIN_PER_IP", "30/300")),
+    "login:email": parse_rate(os.getenv("RATE_LIMIT_LOGIN_PER_EMAIL", "10/900")),
+    # 6-digit verification and password reset codes, valid for 10 minutes
+    "code:ip": parse_rate(os.getenv("RATE_LIMIT_CODE_PER_IP", "20/600")),
+    "code:email": parse_rate(os.getenv("RATE_LIMIT_CODE_PER_EMAIL", "5/600")),
+    # Requests that hash a password or send an email
+    "mail:ip": parse_rate(os.getenv("RATE_LIMIT_MAIL_PER_IP", "20/3600")),
+    "mail:email": parse_rate(os.getenv("RATE_LIMIT_MAIL_PER_EMAIL", "5/3600")),
+}
+
+# One statement refills and takes a token from each bucket. A denied attempt also takes one,
+# down to -1, so clients that keep retrying wait longer; the result is 0 or more when allowed.
+TAKE_TOKENS_SQL = text("""
+    INSERT INTO rate_limit_buckets AS b (bucket_key, tokens, updated_at)
+    SELECT t.bucket_key, t.capacity - 1, :now
+    FROM unnest(
+        CAST(:keys AS text[]),
+        CAST(:capacities AS float8[]),
+        CAST(:rates AS float8[])
+    ) AS t(bucket_key, capacity, rate)
+    ORDER BY t.bucket_key
+    ON CONFLICT (bucket_key) DO UPDATE SET
+        tokens = GREATEST(
+            LEAST(
+                EXCLUDED.tokens + 1,
+                b.tokens + EXTRACT(EPOCH FROM (:now - b.updated_at)) * (
+                    SELECT t.rate FROM unnest(CAST(:keys AS text[]), CAST(:rates AS float8[])) AS t(bucket_key, rate)
+                    WHERE t.bucket_key = b.bucket_key
+                )
+            ) - 1,
+            -1
+        ),
+        updated_at = :now
+    RETURNING bucket_key, tokens
+""")
+
+def _retry_after(tokens: float, rate: float) -> float:
+    """Seconds until the next take succeeds, given a bucket's tokens after a denied take"""
+    return 0.0 if tokens >= 0 else (1 - tokens) / rate
+
+Bucket = Tuple[str, float, float]  # key, capacity, refill rate per second
+
+def client_ip(request: Request) -> str:
+    """The client address, read from proxy headers only when the peer is a trusted proxy"""
+    peer = request.client.host if request.client else "unknown"
+    if not _is_trusted_proxy(peer):
+        return peer
+    # Walk the chain from the nearest hop; the first untrusted address is the client
+    forwarded = [host.strip() for host in request.headers.get("x-forwarded-for", "").split(",") if host.strip()]
+    for host in reversed(forwarded):
+        if not _is_trusted_proxy(host):
+            return host
+    return request.headers.get("x-real-ip", "").strip() or peer
+
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXY_CIDRS)
+
+class MemoryRateLimitStore:
+    """Token buckets held in this worker process only"""
+
+    def __init__(self, maxsize: int):
+        self._buckets = TTLCache(maxsize=maxsize, ttl=RATE_LIMIT_IDLE_SECONDS)
+
+    async def take(self, buckets: List[Bucket]) -> List[float]:
+        now = time.monotonic()
+        retry_afters = []
+        for key, capacity, rate in buckets:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = max(min(capacity, tokens + (now - updated_at) * rate) - 1, -1)
+            self._buckets.set(key, (tokens, now))
+            retry_afters.append(_retry_after(tokens, rate))
+        return retry_afters
+
+class DatabaseRateLimitStore:
+    """Token buckets shared by all workers through an unlogged Postgres table"""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self._pruned_at = time.monotonic()
+
+    async def take(self, buckets: List[Bucket]) -> List[float]:
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            result = await db.execute(TAKE_TOKENS_SQL, {
+                "keys": [key for key, _, _ in buckets],
+                "capacities": [capacity for _, capacity, _ in buckets],
+                "rates": [rate for _, _, rate in buckets],
+                "now": now,
+            })
+            tokens = dict(result.fetchall())
+            if time.monotonic() - self._pruned_at >= RATE_LIMIT_PRUNE_SECONDS:
+                self._pruned_at = time.monotonic()
+                await db.execute(
+                    text("DELETE FROM rate_limit_buckets WHERE updated_at < :cutoff"),
+                    {"cutoff": now - timedelta(seconds=RATE_LIMIT_IDLE_SECONDS)}
+                )
+            await db.commit()
+        return [_retry_after(tokens[key], rate) for key, _, rate in buckets]
+
+class NullRateLimitStore:
+    """Store that allows everything"""
+
+    async def take(self, buckets: List[Bucket]) -> List[float]:
+        return [0.0] * len(buckets)
+
+class RateLimiter:
+    """Checks token buckets, rejecting keys already known to be limited without touching the store"""
+
+    def __init__(self, store):
+        self.store = store
+        # Keys denied recently, mapped to when they may retry; kept per worker
+        self._denied = TTLCache(
+            maxsize=RATE_LIMIT_MAX_KEYS, ttl=max(2 / rate for _, rate in RATE_LIMITS.values())
+        )
+        self.stats = {"allowed": 0, "rejected": 0, "rejectedLocally": 0, "storeErrors": 0}
+
+    def _reject(self, retry_after: float):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, please try again later",
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+        )
+
+    async def check(self, action: str, request: Request, email: Optional[str] = None):
+        """Take a token from the action's IP and email buckets in one store call, or raise 429"""
+        subjects = [(f"{action}:ip", client_ip(request))]
+        if email:
+            subjects.append((f"{action}:email", email.strip().lower()))
+        buckets = [(f"{rule}:{subject}", *RATE_LIMITS[rule]) for rule, subject in subjects]
+        keys = [key for key, _, _ in buckets]
+
+        now = time.monotonic()
+        for key in keys:
+            retry_at = self._denied.get(key)
+            if retry_at is not None and retry_at > now:
+                self.stats["rejectedLocally"] += 1
+                self._reject(retry_at - now)
+
+        try:
+            retry_afters = await self.store.take(buckets)
+        except Exception as e:
+            # Fail open: a store outage must not lock every user out
+            self.stats["storeErrors"] += 1
+            print(f"Rate limit store error: {e}")
+            return
+
+        retry_after = max(retry_afters)
+        for key, wait in zip(keys, retry_afters):
+            if wait > 0:
+                self._denied.set(key, time.monotonic() + wait)
+        if retry_after > 0:
+            self.stats["rejected"] += 1
+            self._reject(retry_after)
+        self.stats["allowed"] += 1
+
+def create_rate_limiter(session_factory) -> RateLimiter:
+    """Build the rate limiter with the store selected by RATE_LIMIT_BACKEND"""
+    if RATE_LIMIT_BACKEND == "database":
+        return RateLimiter(DatabaseRateLimitStore(session_factory))
+    if RATE_LIMIT_BACKEND == "memory":
+        return RateLimiter(MemoryRateLimitStore(RATE_LIMIT_MAX_KEYS))
+    return RateLimiter(NullRateLimitStore())
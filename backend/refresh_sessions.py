@@ -0,0 +1,184 @@
+import hashlib
+import os
+import secrets
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, status
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from auth import REFRESH_TOKEN_EXPIRE_DAYS, REFRESH_TOKEN_EXPIRE_HOURS, create_refresh_token, refresh_token_expiry
+from cache import TTLCache
+
+# Refresh session configuration
+# Seconds after a rotation during which replaying the old token issues another token in
+# the same family instead of revoking it, so concurrent refreshes from one client all succeed
+REFRESH_REUSE_GRACE_SECONDS = float(os.getenv("REFRESH_REUSE_GRACE_SECONDS", "10"))
+REFRESH_REVOKED_CACHE_MAX_ENTRIES = int(os.getenv("REFRESH_REVOKED_CACHE_MAX_ENTRIES", "100000"))
+# Seconds between deletions of expired sessions
+REFRESH_PRUNE_SECONDS = float(os.getenv("REFRESH_PRUNE_SECONDS", "3600"))
+
+# Token hashes and family ids known to be revoked; entries outlive any refresh token
+_revoked = TTLCache(maxsize=REFRESH_REVOKED_CACHE_MAX_ENTRIES, ttl=REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+_pruned_at = time.monotonic()
+
+INSERT_SESSION_SQL = text("""
+    INSERT INTO refresh_sessions (token_hash, family_id, user_id, remember_me, created_at, expires_at)
+    VALUES (:token_hash, :family_id, :user_id, :remember_me, :now, :expires_at)
+""")
+
+# Claims the current token and reads what the next access token needs in one statement
+ROTATE_SESSION_SQL = text("""
+    UPDATE refresh_sessions s SET rotated_at = :now
+    FROM users u
+    WHERE s.token_hash = :token_hash
+      AND s.rotated_at IS NULL
+      AND s.revoked_at IS NULL
+      AND s.expires_at > :now
+      AND u.id = s.user_id
+      AND u.is_active
+    RETURNING s.family_id, s.remember_me,
+              u.id, u.email, u.role, u.email_verified, u.first_name, u.last_name
+""")
+
+# Records a refresh token issued before sessions were stored, so it rotates like any other
+ADOPT_LEGACY_SQL = text("""
+    INSERT INTO refresh_sessions (token_hash, family_id, user_id, remember_me, created_at, expires_at)
+    SELECT :token_hash, :family_id, id, :remember_me, :now, :expires_at FROM users WHERE email = :email
+    ON CONFLICT (token_hash) DO NOTHING
+""")
+
+# Reads what a replay inside the grace window needs, without claiming anything
+REISSUE_SESSION_SQL = text("""
+    SELECT s.family_id, s.remember_me,
+           u.id, u.email, u.role, u.email_verified, u.first_name, u.last_name
+    FROM refresh_sessions s
+    JOIN users u ON u.id = s.user_id
+    WHERE s.token_hash = :token_hash
+      AND s.revoked_at IS NULL
+      AND s.expires_at > :now
+      AND u.is_active
+""")
+
+def hash_token_id(jti: str) -> str:
+    return hashlib.sha256(jti.encode()).hexdigest()
+
+def _invalid(detail: str = "Invalid refresh token") -> HTTPException:
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+
+async def issue_refresh_token(
+    db: AsyncSession,
+    user_id: UUID,
+    email: str,
+    remember_me: bool = False,
+    family_id: Optional[UUID] = None,
+) -> str:
+    """Record a new refresh session in the caller's transaction and return its token"""
+    jti = secrets.token_urlsafe(32)
+    family_id = family_id or uuid.uuid4()
+    expires_at = refresh_token_expiry(remember_me)
+    await db.execute(INSERT_SESSION_SQL, {
+        "token_hash": hash_token_id(jti),
+        "family_id": family_id,
+        "user_id": user_id,
+        "remember_me": remember_me,
+        "now": datetime.utcnow(),
+        "expires_at": expires_at,
+    })
+    return create_refresh_token({"sub": email, "jti": jti, "fam": str(family_id)}, remember_me, expires_at)
+
+async def revoke_family(db: AsyncSession, family_id: UUID):
+    """Revoke every token in a family and commit"""
+    await db.execute(
+        text("UPDATE refresh_sessions SET revoked_at = :now WHERE family_id = :family_id AND revoked_at IS NULL"),
+        {"family_id": family_id, "now": datetime.utcnow()}
+    )
+    await db.commit()
+    _revoked.set(str(family_id), True)
+
+async def revoke_user_sessions(db: AsyncSession, user_id: UUID):
+    """Revoke all of a user's refresh tokens in the caller's transaction"""
+    result = await db.execute(
+        text("""
+            WITH revoked AS (
+                UPDATE refresh_sessions SET revoked_at = :now
+                WHERE user_id = :user_id AND revoked_at IS NULL AND expires_at > :now
+                RETURNING family_id
+            )
+            SELECT DISTINCT family_id FROM revoked
+        """),
+        {"user_id": user_id, "now": datetime.utcnow()}
+    )
+    for family_id in result.scalars():
+        _revoked.set(str(family_id), True)
+
+async def _adopt_legacy_token(db: AsyncSession, payload: dict, now: datetime) -> str:
+    """Give a token without jti a session in a new family and return the id it rotates under.
+
+    The id is derived from the token's subject and expiry, so presenting the same legacy
+    token again finds the already rotated session and is treated as reuse.
+    """
+    expires_at = datetime.utcfromtimestamp(payload["exp"])
+    jti = f"legacy:{payload['sub']}:{payload['exp']}"
+    await db.execute(ADOPT_LEGACY_SQL, {
+        "token_hash": hash_token_id(jti),
+        "family_id": uuid.uuid4(),
+        "remember_me": expires_at - now > timedelta(hours=REFRESH_TOKEN_EXPIRE_HOURS),
+        "email": payload["sub"],
+        "now": now,
+        "expires_at": expires_at,
+    })
+    return jti
+
+async def _prune_expired(db: AsyncSession, now: datetime):
+    global _pruned_at
+    if time.monotonic() - _pruned_at < REFRESH_PRUNE_SECONDS:
+        return
+    _pruned_at = time.monotonic()
+    await db.execute(text("DELETE FROM refresh_sessions WHERE expires_at < :now"), {"now": now})
+
+async def rotate_refresh_token(db: AsyncSession, payload: dict) -> Tuple[object, str]:
+    """Exchange a verified refresh token payload for (user row, next refresh token).
+
+    Replaying an already rotated token revokes its whole family, unless it was rotated
+    within REFRESH_REUSE_GRACE_SECONDS. Tokens issued before sessions were stored carry
+    no jti; each is accepted once and starts a family. Commits on success.
+    """
+    now = datetime.utcnow()
+    jti, family = payload.get("jti"), payload.get("fam")
+    if not jti:
+        if not payload.get("sub") or not payload.get("exp"):
+            raise _invalid()
+        jti = await _adopt_legacy_token(db, payload, now)
+    token_hash = hash_token_id(jti)
+    if _revoked.get(token_hash) or (family and _revoked.get(family)):
+        raise _invalid()
+
+    result = await db.execute(ROTATE_SESSION_SQL, {"token_hash": token_hash, "now": now})
+    user = result.fetchone()
+    if user is None:
+        await db.rollback()
+        session = (await db.execute(
+            text("SELECT family_id, rotated_at, revoked_at FROM refresh_sessions WHERE token_hash = :token_hash"),
+            {"token_hash": token_hash}
+        )).fetchone()
+        if session is not None and session.revoked_at is not None:
+            _revoked.set(token_hash, True)
+        elif session is not None and session.rotated_at is not None:
+            if now - session.rotated_at > timedelta(seconds=REFRESH_REUSE_GRACE_SECONDS):
+                # A rotated token came back: treat the family as stolen
+                await revoke_family(db, session.family_id)
+                raise _invalid("Refresh token reuse detected")
+            # A concurrent refresh by the same client: it gets its own token in the family
+            user = (await db.execute(REISSUE_SESSION_SQL, {"token_hash": token_hash, "now": now})).fetchone()
+        if user is None:
+            raise _invalid()
+
+    token = await issue_refresh_token(db, user.id, user.email, user.remember_me, user.family_id)
+    await _prune_expired(db, now)
+    await db.commit()
+    return user, token
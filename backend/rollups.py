@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
+
+# Bucket sizes maintained for every series; names match Postgres date_trunc units
+BUCKETS = ("day", "week", "month")
+
+UPSERT_ROLLUP_SQL = text("""
+    INSERT INTO test_record_rollups AS r (
+        user_id, test_category, test_type, bucket, bucket_start,
+        value_count, value_sum, min_value, max_value,
+        last_value, last_test_date, out_of_range_count, updated_at
+    ) VALUES (
+        :user_id, :test_category, :test_type, :bucket, :bucket_start,
+        :value_count, :value_sum, :min_value, :max_value,
+        :last_value, :last_test_date, :out_of_range_count, :updated_at
+    )
+    ON CONFLICT (user_id, test_category, test_type, bucket, bucket_start) DO UPDATE SET
+        value_count = r.value_count + EXCLUDED.value_count,
+        value_sum = r.value_sum + EXCLUDED.value_sum,
+        min_value = LEAST(r.min_value, EXCLUDED.min_value),
+        max_value = GREATEST(r.max_value, EXCLUDED.max_value),
+        last_value = CASE
+            WHEN EXCLUDED.last_test_date >= r.last_test_date THEN EXCLUDED.last_value
+            ELSE r.last_value
+        END,
+        last_test_date = GREATEST(r.last_test_date, EXCLUDED.last_test_date),
+        out_of_range_count = r.out_of_range_count + EXCLUDED.out_of_range_count,
+        updated_at = EXCLUDED.updated_at
+""")
+
+def bucket_start(bucket: str, value: datetime) -> datetime:
+    """Return the start of the bucket containing value, matching date_trunc"""
+    day = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        return day
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown bucket: {bucket}")
+
+def is_out_of_range(value: float, min_range: Optional[float], max_range: Optional[float]) -> bool:
+    """Check whether a value falls outside its reference range"""
+    return (min_range is not None and value < min_range) or (max_range is not None and value > max_range)
+
+async def apply_rollups(db: AsyncSession, user_id: UUID, records: Iterable):
+    """Fold newly inserted records into the rollup table.
+
+    Runs in the caller's transaction so rollups commit together with the records.
+    """
+    now = datetime.utcnow()
+    buckets = {}
+    for record in records:
+        out_of_range = int(is_out_of_range(record.test_value, record.min_range, record.max_range))
+        for bucket in BUCKETS:
+            key = (record.test_category, record.test_type, bucket, bucket_start(bucket, record.test_date))
+            row = buckets.get(key)
+            if row is None:
+                buckets[key] = {
+                    "user_id": user_id,
+                    "test_category": key[0],
+                    "test_type": key[1],
+                    "bucket": bucket,
+                    "bucket_start": key[3],
+                    "value_count": 1,
+                    "value_sum": record.test_value,
+                    "min_value": record.test_value,
+                    "max_value": record.test_value,
+                    "last_value": record.test_value,
+                    "last_test_date": record.test_date,
+                    "out_of_range_count": out_of_range,
+                    "updated_at": now,
+                }
+                continue
+            row["value_count"] += 1
+            row["value_sum"] += record.test_value
+            row["min_value"] = min(row["min_value"], record.test_value)
+            row["max_value"] = max(row["max_value"], record.test_value)
+            if record.test_date >= row["last_test_date"]:
+                row["last_value"] = record.test_value
+                row["last_test_date"] = record.test_date
+            row["out_of_range_count"] += out_of_range
+
+    if buckets:
+        # Sorted so concurrent writers lock rollup rows in the same order
+        await db.execute(UPSERT_ROLLUP_SQL, [buckets[key] for key in sorted(buckets)])
+
+async def backfill_rollups(conn: AsyncConnection):
+    """Build rollups from existing test records if the rollup table is empty"""
+    has_rollups = await conn.execute(text("SELECT 1 FROM test_record_rollups LIMIT 1"))
+    if has_rollups.first() is not None:
+        return
+
+    for bucket in BUCKETS:
+        await conn.execute(text(f"""
+            INSERT INTO test_record_rollups (
+                user_id, test_category, test_type, bucket, bucket_start,
+                value_count, value_sum, min_value, max_value,
+                last_value, last_test_date, out_of_range_count, updated_at
+            )
+            SELECT
+                user_id, test_category, test_type, '{bucket}', date_trunc('{bucket}', test_date),
+                count(*), sum(test_value), min(test_value), max(test_value),
+                (array_agg(test_value ORDER BY test_date DESC))[1], max(test_date),
+                count(*) FILTER (
+                    WHERE (min_range IS NOT NULL AND test_value < min_range)
+                       OR (max_range IS NOT NULL AND test_value > max_range)
+                ),
+                now() AT TIME ZONE 'utc'
+            FROM test_records
+            GROUP BY user_id, test_category, test_type, date_trunc('{bucket}', test_date)
+            ON CONFLICT DO NOTHING
+        """))
+
+def _bucket_end(bucket: str, start: datetime) -> datetime:
+    """Start of the bucket after the one beginning at start"""
+    if bucket == "month":
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=7 if bucket == "week" else 1)
+
+async def rebuild_rollups(conn: AsyncConnection, series_table: str, start: datetime, end: datetime):
+    """Recompute the rollup buckets overlapping [start, end) for the series listed in series_table.
+
+    series_table holds (user_id, test_category, test_type) rows. Used when a range of
+    records appears or disappears at once, as when a partition is archived or restored.
+    """
+    for bucket in BUCKETS:
+        low = bucket_start(bucket, start)
+        high = bucket_start(bucket, end)
+        if high < end:
+            high = _bucket_end(bucket, high)
+        params = {"bucket": bucket, "low": low, "high": high}
+        await conn.execute(text(f"""
+            DELETE FROM test_record_rollups r
+            USING {series_table} s
+            WHERE r.user_id = s.user_id AND r.test_category = s.test_category AND r.test_type = s.test_type
+              AND r.bucket = :bucket AND r.bucket_start >= :low AND r.bucket_start < :high
+        """), params)
+        await conn.execute(text(f"""
+            INSERT INTO test_record_rollups (
+                user_id, test_category, test_type, bucket, bucket_start,
+                value_count, value_sum, min_value, max_value,
+                last_value, last_test_date, out_of_range_count, updated_at
+            )
+            SELECT
+                t.user_id, t.test_category, t.test_type, :bucket, date_trunc('{bucket}', t.test_date),
+                count(*), sum(t.test_value), min(t.test_value), max(t.test_value),
+                (array_agg(t.test_value ORDER BY t.test_date DESC))[1], max(t.test_date),
+                count(*) FILTER (
+                    WHERE (t.min_range IS NOT NULL AND t.test_value < t.min_range)
+                       OR (t.max_range IS NOT NULL AND t.test_value > t.max_range)
+                ),
+                now() AT TIME ZONE 'utc'
+            FROM test_records t
+            JOIN {series_table} s
+              ON s.user_id = t.user_id AND s.test_category = t.test_category AND s.test_type = t.test_type
+            WHERE t.test_date >= :low AND t.test_date < :high
+            GROUP BY t.user_id, t.test_category, t.test_type, date_trunc('{bucket}', t.test_date)
+        """), params)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, validator, Field
-from typing import Optional, List
+from typing import Dict, Literal, Optional, List
 from datetime import datetime, timezone
 from uuid import UUID
 
@@ -97,10 +97,89 @@ class TestRecordResponse(TestRecordBase):
     userId: UUID
     createdAt: datetime
     updatedAt: datetime
+    resultFlag: Optional[str] = None
+    rangeDeviation: Optional[float] = None
     
     class Config:
         orm_mode = True
 
+class TestRecordAggregateResponse(BaseModel):
+    bucketStart: datetime
+    count: int
+    min: float
+    max: float
+    avg: float
+    last: float
+    lastTestDate: datetime
+    outOfRangeCount: int
+
+class HistogramBin(BaseModel):
+    lower: float
+    upper: float
+    count: int
+
+class CohortDistributionResponse(BaseModel):
+    testCategory: str
+    testType: str
+    dateFrom: datetime
+    dateTo: datetime
+    count: int
+    mean: Optional[float] = None
+    std: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    percentiles: Dict[str, float] = {}
+    bins: List[HistogramBin]
+    underflow: int
+    overflow: int
+
+class CohortAbnormalRateResponse(BaseModel):
+    bucketStart: datetime
+    total: int
+    abnormal: int
+    abnormalPercent: Optional[float] = None
+
+class TrendChangePoint(BaseModel):
+    index: int
+    testDate: datetime
+    meanBefore: float
+    meanAfter: float
+    score: Optional[float] = Field(None, description="Two-sample t-statistic of the shift; null for a step between noiseless segments")
+
+class TestSeriesTrendResponse(BaseModel):
+    testCategory: str
+    testType: str
+    window: int
+    count: int
+    mean: float
+    std: float = Field(description="Sample standard deviation (ddof=1); 0 for a single draw")
+    slopePerDay: Optional[float] = None
+    changePoint: Optional[TrendChangePoint] = None
+    testDates: List[datetime]
+    values: List[float]
+    rollingMean: List[float]
+    rollingStd: List[Optional[float]] = Field(description="Sample standard deviation of the trailing window; null while it holds one draw")
+    rateOfChangePerDay: List[Optional[float]]
+    zScore: List[float]
+
+class ImportRowError(BaseModel):
+    row: int
+    errors: List[str]
+
+class ImportJobResponse(BaseModel):
+    id: UUID
+    format: str
+    status: str
+    rowsProcessed: int
+    rowsImported: int
+    rowsSkipped: int
+    rowsFailed: int
+    errors: List[ImportRowError] = []
+    errorMessage: Optional[str] = None
+    createdAt: datetime
+    startedAt: Optional[datetime] = None
+    finishedAt: Optional[datetime] = None
+
 class TestRecordBulkCreate(BaseModel):
     records: List[TestRecordCreate] = Field(..., min_items=1, max_items=100, description="List of test records to create")
 
@@ -112,6 +191,24 @@ class TestRecordBulkCreate(BaseModel):
             raise ValueError('Cannot create more than 100 test records at once')
         return v
 
+class SeriesQuery(BaseModel):
+    category: str = Field(..., min_length=1, max_length=50)
+    testType: str = Field(..., min_length=1, max_length=100)
+    date_from: Optional[datetime] = Field(None, alias="from", description="Only include records on or after this date")
+    date_to: Optional[datetime] = Field(None, alias="to", description="Only include records on or before this date")
+
+    @validator('date_from', 'date_to')
+    def to_naive_utc(cls, v):
+        # Stored test dates are naive UTC
+        if v is None or v.tzinfo is None:
+            return v
+        return v.astimezone(timezone.utc).replace(tzinfo=None)
+
+class SeriesBatchRequest(BaseModel):
+    series: List[SeriesQuery] = Field(..., min_items=1, max_items=50, description="Series to load, answered in this order")
+    maxPoints: Optional[int] = Field(None, ge=2, le=10000, description="Maximum points returned per series")
+    downsample: Optional[Literal["lttb", "minmax"]] = Field(None, description="How long series are reduced to maxPoints")
+
 class TestPanelBase(BaseModel):
     name: str
     displayName: str
@@ -0,0 +1,39 @@
+from datetime import timezone
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+def _default(value):
+    # Pydantic models and other types orjson does not know natively
+    return jsonable_encoder(value)
+
+def dumps(payload) -> bytes:
+    """Serialize a response payload to JSON bytes"""
+    return orjson.dumps(payload, default=_default, option=orjson.OPT_UTC_Z)
+
+def record_to_dict(record) -> dict:
+    """Map a test_records row to the TestRecordResponse shape without re-validating it.
+
+    Stored rows already passed TestRecordBase validation on write, so the
+    future-date and range validators are not run again here.
+    """
+    return {
+        "testCategory": record.test_category,
+        "testType": record.test_type,
+        "testValue": record.test_value,
+        "unit": record.unit,
+        "minRange": record.min_range,
+        "maxRange": record.max_range,
+        "testDate": record.test_date.replace(tzinfo=timezone.utc),
+        "notes": record.notes,
+        "id": record.id,
+        "userId": record.user_id,
+        "createdAt": record.created_at,
+        "updatedAt": record.updated_at,
+        "resultFlag": record.result_flag,
+        "rangeDeviation": record.range_deviation,
+    }
+
+def records_to_json(records) -> bytes:
+    """Serialize test_records rows straight to JSON bytes"""
+    return dumps([record_to_dict(record) for record in records])
@@ -0,0 +1,98 @@
+import os
+from typing import List, Optional
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from analytics import iso_dates
+from downsample import downsample_indices, epoch_seconds, out_of_range_mask
+
+# Batch series configuration
+SERIES_DEFAULT_MAX_POINTS = int(os.getenv("SERIES_DEFAULT_MAX_POINTS", "500"))  # points per series when not given
+
+# One row per requested series, in request order, with its points as arrays oldest first.
+# Each series is an index range scan on ix_test_records_user_category_type_date;
+# series without records in their window come back with NULL arrays.
+SERIES_BATCH_SQL = text("""
+    SELECT s.position,
+           count(r.id) AS record_count,
+           array_agg(r.test_date ORDER BY r.test_date, r.id) FILTER (WHERE r.id IS NOT NULL) AS test_dates,
+           array_agg(r.test_value ORDER BY r.test_date, r.id) FILTER (WHERE r.id IS NOT NULL) AS test_values,
+           array_agg(r.min_range ORDER BY r.test_date, r.id) FILTER (WHERE r.id IS NOT NULL) AS min_ranges,
+           array_agg(r.max_range ORDER BY r.test_date, r.id) FILTER (WHERE r.id IS NOT NULL) AS max_ranges,
+           array_agg(r.result_flag ORDER BY r.test_date, r.id) FILTER (WHERE r.id IS NOT NULL) AS result_flags
+    FROM unnest(
+        CAST(:categories AS text[]),
+        CAST(:test_types AS text[]),
+        CAST(:dates_from AS timestamp[]),
+        CAST(:dates_to AS timestamp[])
+    ) WITH ORDINALITY AS s(test_category, test_type, date_from, date_to, position)
+    LEFT JOIN test_records r
+        ON r.user_id = :user_id
+       AND r.test_category = s.test_category
+       AND r.test_type = s.test_type
+       AND r.test_date >= COALESCE(s.date_from, '-infinity')
+       AND r.test_date <= COALESCE(s.date_to, 'infinity')
+    GROUP BY s.position
+    ORDER BY s.position
+""")
+
+def _series_points(row, max_points: int, method: Optional[str]) -> dict:
+    test_dates = np.array(row.test_dates, dtype="datetime64[us]")
+    values = np.array(row.test_values, dtype=np.float64)
+    keep = downsample_indices(
+        epoch_seconds(test_dates), values, max_points, out_of_range_mask(row.result_flags), method
+    )
+    return {
+        "latest": {
+            "testDate": iso_dates(test_dates[-1:])[0],
+            "value": float(values[-1]),
+            "resultFlag": row.result_flags[-1],
+        },
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "points": {
+            "testDates": iso_dates(test_dates[keep]),
+            "values": values[keep].tolist(),
+            "minRange": [row.min_ranges[index] for index in keep],
+            "maxRange": [row.max_ranges[index] for index in keep],
+            "resultFlags": [row.result_flags[index] for index in keep],
+        },
+    }
+
+async def batch_series(
+    db: AsyncSession,
+    user_id: UUID,
+    series: List,
+    max_points: Optional[int] = None,
+    method: Optional[str] = None,
+) -> list:
+    """Latest value, count, bounds and downsampled points for several (category, test type, window) series in one query"""
+    max_points = max_points or SERIES_DEFAULT_MAX_POINTS
+    result = await db.execute(SERIES_BATCH_SQL, {
+        "user_id": user_id,
+        "categories": [item.category for item in series],
+        "test_types": [item.testType for item in series],
+        "dates_from": [item.date_from for item in series],
+        "dates_to": [item.date_to for item in series],
+    })
+    rows = {row.position: row for row in result}
+
+    response = []
+    for position, item in enumerate(series, start=1):
+        row = rows[position]
+        entry = {
+            "category": item.category,
+            "testType": item.testType,
+            "count": row.record_count,
+            "latest": None,
+            "min": None,
+            "max": None,
+            "points": {"testDates": [], "values": [], "minRange": [], "maxRange": [], "resultFlags": []},
+        }
+        if row.record_count:
+            entry.update(_series_points(row, max_points, method))
+        response.append(entry)
+    return response
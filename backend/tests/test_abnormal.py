@@ -0,0 +1,68 @@
+"""Result flags: deviation from the reference range, the critical threshold and ranges without width.
+
+The backfill test needs TEST_DATABASE_URL, see test_email_service.py.
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import abnormal
+from abnormal import classify_result
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+BACKFILL_SQL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations", "0002_backfill_result_flags.sql")
+
+def test_values_are_flagged_in_range_widths():
+    assert classify_result(5.0, 4.0, 6.0) == ("normal", 0.0)
+    assert classify_result(3.5, 4.0, 6.0) == ("low", -0.25)
+    assert classify_result(6.5, 4.0, 6.0) == ("high", 0.25)
+    assert classify_result(7.0, 4.0, 6.0) == ("critical", 0.5)
+    assert classify_result(5.0, None, None) == (None, None)
+
+def test_one_sided_ranges_scale_by_the_bound():
+    assert classify_result(12.0, None, 10.0) == ("high", 0.2)
+    assert classify_result(1.0, 2.0, None) == ("critical", -0.5)
+    assert classify_result(-1.0, 0.0, None) == ("critical", -1.0)
+
+def test_critical_threshold_follows_the_setting(monkeypatch):
+    monkeypatch.setattr(abnormal, "ABNORMAL_CRITICAL_DEVIATION", 1.0)
+    assert classify_result(7.0, 4.0, 6.0) == ("high", 0.5)
+
+@pytest.mark.parametrize("min_range,max_range", [(5.0, 5.0), (6.0, 4.0)])
+def test_range_without_width_is_rejected(min_range, max_range):
+    with pytest.raises(ValueError):
+        classify_result(5.0, min_range, max_range)
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+def test_backfill_matches_classify_result():
+    rows = [(3.5, 4.0, 6.0), (6.5, 4.0, 6.0), (7.0, 4.0, 6.0), (12.0, None, 10.0), (5.0, 5.0, 5.0)]
+
+    async def scenario():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text("""
+                    CREATE TEMPORARY TABLE test_records (
+                        id UUID PRIMARY KEY, test_value FLOAT, min_range FLOAT, max_range FLOAT,
+                        result_flag VARCHAR, range_deviation FLOAT
+                    )
+                """))
+                ids = [uuid.uuid4() for _ in rows]
+                await conn.execute(
+                    text("INSERT INTO test_records (id, test_value, min_range, max_range) VALUES (:id, :value, :min, :max)"),
+                    [{"id": row_id, "value": value, "min": low, "max": high} for row_id, (value, low, high) in zip(ids, rows)]
+                )
+                await conn.execute(text("SELECT set_config('app.abnormal_critical_deviation', '0.6', true)"))
+                with open(BACKFILL_SQL) as backfill:
+                    await conn.execute(text(backfill.read()))
+                flags = dict((await conn.execute(text("SELECT id, result_flag FROM test_records"))).fetchall())
+        finally:
+            await engine.dispose()
+        return [flags[row_id] for row_id in ids]
+
+    # 0.5 range widths above is only high with a threshold of 0.6; the zero-width row stays unflagged
+    assert asyncio.run(scenario()) == ["low", "high", "high", "high", None]
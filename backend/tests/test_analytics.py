@@ -0,0 +1,38 @@
+"""Trend analytics: sample standard deviations throughout and a JSON-safe change-point score."""
+import json
+
+import numpy as np
+
+from analytics import compute_trend
+from serialization import dumps
+
+def _dates(count: int) -> np.ndarray:
+    return np.datetime64("2024-01-01", "us") + np.arange(count) * np.timedelta64(1, "D")
+
+def test_rolling_and_overall_std_are_sample_std():
+    values = np.array([1.0, 4.0, 2.0, 8.0, 5.0, 7.0])
+    trend = compute_trend(_dates(len(values)), values, 3)
+    assert np.isclose(trend["std"], values.std(ddof=1))
+    assert np.isnan(trend["rollingStd"][0])
+    expected = [values[max(i - 2, 0):i + 1].std(ddof=1) for i in range(1, len(values))]
+    assert np.allclose(trend["rollingStd"][1:], expected)
+    # A full-length window matches the overall figure
+    assert np.isclose(compute_trend(_dates(len(values)), values, len(values))["rollingStd"][-1], trend["std"])
+
+def test_noiseless_step_reports_no_score_instead_of_infinity():
+    values = np.array([1.0] * 4 + [5.0] * 4)
+    change_point = compute_trend(_dates(len(values)), values, 3)["changePoint"]
+    assert change_point["index"] == 4
+    assert change_point["score"] is None
+
+def test_noisy_step_reports_a_finite_score():
+    values = np.array([1.0, 1.2, 0.9, 1.1, 5.0, 5.2, 4.9, 5.1])
+    change_point = compute_trend(_dates(len(values)), values, 3)["changePoint"]
+    assert change_point["index"] == 4
+    assert np.isfinite(change_point["score"])
+
+def test_trend_serializes_without_non_finite_numbers():
+    values = np.array([1.0] * 4 + [5.0] * 4)
+    body = json.loads(dumps(compute_trend(_dates(len(values)), values, 3)))
+    assert body["rollingStd"][0] is None
+    assert body["rateOfChangePerDay"][0] is None
@@ -0,0 +1,62 @@
+"""Password hashing pool counters and cross-worker invalidation of the authenticated user cache.
+
+The invalidation test needs TEST_DATABASE_URL, see test_email_service.py.
+"""
+import asyncio
+import os
+
+import pytest
+
+import auth
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+def _boom():
+    raise RuntimeError("hash backend unavailable")
+
+def test_hash_pool_counts_failures_apart_from_completions():
+    before = auth.hash_pool_stats()
+
+    async def scenario():
+        assert await auth._run_in_hash_pool(len, "abc") == 3
+        with pytest.raises(RuntimeError):
+            await auth._run_in_hash_pool(_boom)
+
+    asyncio.run(scenario())
+    after = auth.hash_pool_stats()
+    assert after["completed"] == before["completed"] + 1
+    assert after["failed"] == before["failed"] + 1
+    assert after["inFlight"] == 0
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+def test_user_change_reaches_other_workers_on_commit(monkeypatch):
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+
+    async def scenario():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        monkeypatch.setattr(auth, "engine", engine)
+        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        try:
+            await auth.start_user_cache_listener()
+            async with session_factory() as db:
+                await auth.invalidate_cached_user(db, "changed@example.com")
+                # Stands in for another worker's cache, which only hears of the change on commit
+                auth.user_cache.set("changed@example.com", "stale user")
+                auth.user_cache.set("other@example.com", "other user")
+                await asyncio.sleep(0.2)
+                assert auth.user_cache.get("changed@example.com") == "stale user"
+                await db.commit()
+
+            for _ in range(50):
+                if auth.user_cache.get("changed@example.com") is None:
+                    break
+                await asyncio.sleep(0.05)
+            assert auth.user_cache.get("changed@example.com") is None
+            assert auth.user_cache.get("other@example.com") == "other user"
+        finally:
+            await auth.stop_user_cache_listener()
+            auth.user_cache.pop("other@example.com")
+            await engine.dispose()
+
+    asyncio.run(scenario())
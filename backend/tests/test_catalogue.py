@@ -0,0 +1,115 @@
+"""User test catalogue: folding new records into entries, the upsert's merge rules and the grouped response.
+
+The upsert test needs TEST_DATABASE_URL, see test_email_service.py.
+"""
+import asyncio
+import os
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+
+from catalogue import UPSERT_CATALOGUE_SQL, apply_catalogue, user_catalogue
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+USER_ID = uuid.UUID("00000000-0000-0000-0000-0000000000aa")
+
+CatalogueRow = namedtuple("CatalogueRow", [
+    "test_category", "test_type", "unit", "record_count",
+    "first_test_date", "last_test_date", "last_value", "last_result_flag",
+])
+
+class RecordingSession:
+    """Collects statements, answering each with the rows it was given"""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.calls = []
+
+    async def execute(self, statement, params=None):
+        self.calls.append((statement, params))
+        return self.rows
+
+def _record(test_type, value, test_date, unit="mmol/L", flag="normal", category="Blood"):
+    return SimpleNamespace(test_category=category, test_type=test_type, test_value=value, unit=unit,
+                           test_date=test_date, result_flag=flag)
+
+def test_records_fold_into_one_entry_per_series():
+    records = [
+        _record("Glucose", 5.0, datetime(2024, 2, 1), unit="mg/dL"),
+        _record("Glucose", 7.1, datetime(2024, 3, 1), flag="high"),
+        _record("Glucose", 4.2, datetime(2024, 1, 1)),
+        _record("Ferritin", 40.0, datetime(2024, 1, 15), unit="ng/mL", category="Iron"),
+    ]
+    db = RecordingSession()
+    asyncio.run(apply_catalogue(db, USER_ID, records))
+    [(statement, entries)] = db.calls
+    assert statement is UPSERT_CATALOGUE_SQL
+    # Sorted by series so concurrent writers lock rows in the same order
+    assert [(entry["test_category"], entry["test_type"]) for entry in entries] == [("Blood", "Glucose"), ("Iron", "Ferritin")]
+    glucose = entries[0]
+    assert glucose["record_count"] == 3
+    assert (glucose["first_test_date"], glucose["last_test_date"]) == (datetime(2024, 1, 1), datetime(2024, 3, 1))
+    # The latest record supplies the value, flag and unit, whatever order records arrive in
+    assert (glucose["last_value"], glucose["last_result_flag"], glucose["unit"]) == (7.1, "high", "mmol/L")
+    assert glucose["user_id"] == USER_ID
+
+def test_no_records_run_no_statement():
+    db = RecordingSession()
+    asyncio.run(apply_catalogue(db, USER_ID, []))
+    assert db.calls == []
+
+def test_catalogue_groups_tests_by_category():
+    rows = [
+        CatalogueRow("Blood", "Glucose", "mmol/L", 3, datetime(2024, 1, 1), datetime(2024, 3, 1), 7.1, "high"),
+        CatalogueRow("Blood", "Sodium", "mmol/L", 2, datetime(2023, 12, 1), datetime(2024, 2, 1), 140.0, "normal"),
+        CatalogueRow("Iron", "Ferritin", "ng/mL", 1, datetime(2024, 1, 15), datetime(2024, 1, 15), 40.0, None),
+    ]
+    [blood, iron] = asyncio.run(user_catalogue(RecordingSession(rows), USER_ID))
+    assert blood["category"] == "Blood"
+    assert blood["recordCount"] == 5
+    assert blood["firstTestDate"] == datetime(2023, 12, 1, tzinfo=timezone.utc)
+    assert blood["lastTestDate"] == datetime(2024, 3, 1, tzinfo=timezone.utc)
+    assert [test["testType"] for test in blood["tests"]] == ["Glucose", "Sodium"]
+    assert blood["tests"][0]["lastValue"] == 7.1
+    assert iron["tests"] == [{
+        "testType": "Ferritin", "unit": "ng/mL", "recordCount": 1,
+        "firstTestDate": datetime(2024, 1, 15, tzinfo=timezone.utc),
+        "lastTestDate": datetime(2024, 1, 15, tzinfo=timezone.utc),
+        "lastValue": 40.0, "lastResultFlag": None,
+    }]
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+def test_upsert_merges_batches_regardless_of_their_order():
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from models import User, UserTestCatalogue
+
+    async def scenario():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        try:
+            async with engine.begin() as conn:
+                for model in (User, UserTestCatalogue):
+                    await conn.run_sync(model.__table__.create, checkfirst=True)
+                user_id = uuid.uuid4()
+                await conn.execute(
+                    text("INSERT INTO users (id, email, hashed_password, first_name, last_name) VALUES (:id, :email, 'x', 'Test', 'User')"),
+                    {"id": user_id, "email": f"catalogue-{user_id.hex[:12]}@example.com"}
+                )
+                await apply_catalogue(conn, user_id, [_record("Glucose", 5.0, datetime(2024, 2, 1))])
+                # A later batch holding an older record keeps the latest value, and a newer one replaces it
+                await apply_catalogue(conn, user_id, [_record("Glucose", 4.2, datetime(2024, 1, 1), unit="mg/dL")])
+                await apply_catalogue(conn, user_id, [_record("Glucose", 7.1, datetime(2024, 3, 1), flag="high")])
+                return (await conn.execute(
+                    text("SELECT record_count, first_test_date, last_test_date, last_value, last_result_flag, unit "
+                         "FROM user_test_catalogue WHERE user_id = :user_id"),
+                    {"user_id": user_id}
+                )).fetchall()
+        finally:
+            await engine.dispose()
+
+    assert [tuple(row) for row in asyncio.run(scenario())] == [
+        (3, datetime(2024, 1, 1), datetime(2024, 3, 1), 7.1, "high", "mmol/L"),
+    ]
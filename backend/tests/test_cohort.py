@@ -0,0 +1,132 @@
+"""Cohort histograms: chunk grid, bins, underflow/overflow and bounds inferred from the rollups.
+
+Chunk queries are answered in Python, with width_bucket emulated as Postgres defines it.
+"""
+import asyncio
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import cohort
+from cache import TTLCache
+
+RangeRow = namedtuple("RangeRow", "min_value max_value")
+BinRow = namedtuple("BinRow", "bin value_count value_sum value_squares min_value max_value")
+
+DATE_FROM = datetime(2024, 1, 1)
+DATE_TO = datetime(2024, 4, 1)
+
+def _width_bucket(value: float, low: float, high: float, bins: int) -> int:
+    if value < low:
+        return 0
+    if value >= high:
+        return bins + 1
+    return int(math.floor((value - low) / (high - low) * bins)) + 1
+
+class FakeCohort:
+    """Values of one series spread across the window, served the way the chunk queries return them"""
+
+    def __init__(self, values):
+        step = (DATE_TO - DATE_FROM) / max(len(values), 1)
+        self.samples = [(DATE_FROM + step * index, value) for index, value in enumerate(values)]
+        self.histogram_queries = 0
+
+    async def query_chunk(self, statement, params):
+        if statement is cohort.VALUE_RANGE_SQL:
+            values = [value for _, value in self.samples]
+            return [RangeRow(min(values, default=None), max(values, default=None))]
+        self.histogram_queries += 1
+        rows = {}
+        for test_date, value in self.samples:
+            if not params["chunk_start"] <= test_date < params["chunk_end"]:
+                continue
+            rows.setdefault(_width_bucket(value, params["low"], params["high"], params["bins"]), []).append(value)
+        return [
+            BinRow(bin, len(values), sum(values), sum(v * v for v in values), min(values), max(values))
+            for bin, values in rows.items()
+        ]
+
+@pytest.fixture
+def series(monkeypatch):
+    monkeypatch.setattr(cohort, "cohort_cache", TTLCache(maxsize=1000, ttl=600))
+
+    def install(values):
+        fake = FakeCohort(values)
+        monkeypatch.setattr(cohort, "_query_chunk", fake.query_chunk)
+        return fake
+    return install
+
+def _distribution(bins=4, low=None, high=None):
+    return asyncio.run(cohort.value_distribution("Blood", "Glucose", DATE_FROM, DATE_TO, bins, low, high))
+
+def test_chunks_are_grid_aligned_and_cover_the_window(monkeypatch):
+    monkeypatch.setattr(cohort, "COHORT_CHUNK_DAYS", 30)
+    chunks = cohort.chunk_window(DATE_FROM, DATE_TO)
+    assert chunks[0][0] == DATE_FROM and chunks[-1][1] == DATE_TO
+    assert all(end == next_start for (_, end), (next_start, _) in zip(chunks, chunks[1:]))
+    # Interior boundaries sit on the grid, so overlapping windows share chunks
+    assert all((end - cohort._CHUNK_ORIGIN) % timedelta(days=30) == timedelta(0) for _, end in chunks[:-1])
+
+def test_overlong_window_is_rejected(monkeypatch):
+    monkeypatch.setattr(cohort, "COHORT_MAX_CHUNKS", 2)
+    with pytest.raises(ValueError):
+        cohort.chunk_window(DATE_FROM, DATE_TO)
+
+def test_values_outside_explicit_bounds_go_to_underflow_and_overflow(series):
+    series([1.0, 3.9, 4.0, 4.4, 5.5, 7.9, 8.0, 12.0])
+    result = _distribution(bins=4, low=4.0, high=8.0)
+    # The lower bound is inclusive and the upper bound exclusive, as in width_bucket
+    assert [b["count"] for b in result["bins"]] == [2, 1, 0, 1]
+    assert (result["underflow"], result["overflow"]) == (2, 2)
+    assert result["count"] == 8
+    assert [(b["lower"], b["upper"]) for b in result["bins"]] == [(4.0, 5.0), (5.0, 6.0), (6.0, 7.0), (7.0, 8.0)]
+    assert (result["min"], result["max"]) == (1.0, 12.0)
+    # Out-of-range values are counted at the bounds for percentiles
+    assert result["percentiles"]["p5"] == 4.0
+    assert result["percentiles"]["p95"] == 8.0
+
+def test_inferred_bounds_keep_the_maximum_in_the_last_bin(series):
+    values = [2.0, 3.0, 4.5, 6.0]
+    series(values)
+    result = _distribution(bins=2)
+    assert (result["underflow"], result["overflow"]) == (0, 0)
+    assert [b["count"] for b in result["bins"]] == [2, 2]
+    assert result["mean"] == pytest.approx(np.mean(values))
+    assert result["std"] == pytest.approx(np.std(values))
+
+def test_minimum_above_all_values_counts_them_as_underflow(series):
+    series([2.0, 3.0, 4.0])
+    result = _distribution(bins=3, low=10.0)
+    assert result["underflow"] == 3
+    assert result["overflow"] == 0
+    assert result["bins"][0]["lower"] == 10.0
+    assert result["bins"][-1]["upper"] > 10.0
+
+def test_maximum_below_all_values_counts_them_as_overflow(series):
+    series([2.0, 3.0, 4.0])
+    result = _distribution(bins=3, high=1.0)
+    assert result["overflow"] == 3
+    assert result["underflow"] == 0
+    assert result["bins"][0]["lower"] < result["bins"][-1]["upper"] == 1.0
+
+def test_empty_series_has_no_moments(series):
+    series([])
+    result = _distribution(bins=3)
+    assert result["count"] == 0
+    assert (result["mean"], result["std"], result["percentiles"]) == (None, None, {})
+
+def test_chunks_are_memoized(series):
+    fake = series([2.0, 3.0, 4.0, 6.0])
+    first = _distribution(bins=2)
+    queries = fake.histogram_queries
+    assert _distribution(bins=2) == first
+    assert fake.histogram_queries == queries
+
+def test_percentiles_interpolate_within_a_bin():
+    counts = np.array([0, 2, 2, 0])
+    edges = np.array([0.0, 0.0, 1.0, 2.0, 2.0])
+    assert cohort._percentile(counts, edges, 4, 50) == 1.0
+    assert cohort._percentile(counts, edges, 4, 25) == 0.5
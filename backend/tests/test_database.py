@@ -0,0 +1,56 @@
+"""Engine configuration: URL normalization, pool and statement cache settings, and pool counters."""
+import asyncio
+from unittest import mock
+
+import pytest
+from sqlalchemy import exc
+from sqlalchemy.util import greenlet_spawn
+
+import database
+from database import InstrumentedPool, asyncpg_url, create_engine_from_url, pool_stats
+
+@pytest.mark.parametrize("url,expected", [
+    ("postgresql://user:pw@db/medtest", "postgresql+asyncpg://user:pw@db/medtest"),
+    ("postgresql+asyncpg://user:pw@db/medtest", "postgresql+asyncpg://user:pw@db/medtest"),
+    ("user:pw@db/medtest", "postgresql+asyncpg://user:pw@db/medtest"),
+])
+def test_urls_use_asyncpg(url, expected):
+    assert asyncpg_url(url) == expected
+
+def test_engine_uses_configured_pool_and_statement_cache(monkeypatch):
+    monkeypatch.setattr(database, "DB_POOL_SIZE", 3)
+    monkeypatch.setattr(database, "DB_MAX_OVERFLOW", 2)
+    monkeypatch.setattr(database, "DB_STATEMENT_CACHE_SIZE", 0)
+    engine = create_engine_from_url("postgresql+asyncpg://user:pw@db/medtest")
+    try:
+        assert isinstance(engine.pool, InstrumentedPool)
+        assert engine.pool.size() == 3
+        assert engine.url.query["prepared_statement_cache_size"] == "0"
+        stats = pool_stats(engine)
+        assert (stats["size"], stats["checkedOut"], stats["checkouts"], stats["waitSecondsAvg"]) == (3, 0, 0, 0.0)
+    finally:
+        engine.sync_engine.dispose()
+
+def test_explicit_statement_cache_size_in_the_url_is_kept():
+    engine = create_engine_from_url("postgresql+asyncpg://user:pw@db/medtest?prepared_statement_cache_size=7")
+    try:
+        assert engine.url.query["prepared_statement_cache_size"] == "7"
+    finally:
+        engine.sync_engine.dispose()
+
+def test_pool_counts_checkouts_and_timeouts():
+    pool = InstrumentedPool(mock.MagicMock, pool_size=1, max_overflow=0, timeout=0.01)
+
+    def checkouts():
+        held = pool.connect()
+        with pytest.raises(exc.TimeoutError):
+            pool.connect()
+        held.close()
+        pool.connect().close()
+
+    # The async pool waits on an asyncio queue, so checkouts run the way the engine runs them
+    asyncio.run(greenlet_spawn(checkouts))
+    assert pool.checkouts == 3
+    assert pool.timeouts == 1
+    assert pool.wait_seconds_max > 0
+    assert pool.wait_seconds_total >= pool.wait_seconds_max
@@ -0,0 +1,75 @@
+"""Series downsampling: selected indices are a valid, bounded subset that keeps endpoints and flagged points."""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from downsample import downsample_indices, downsample_records
+
+METHODS = ["lttb", "minmax"]
+
+def _series(count: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    x = np.cumsum(rng.uniform(1, 100, count))
+    y = np.sin(x / 500) * 10 + rng.normal(0, 1, count)
+    return x, y
+
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("count,max_points", [(1000, 100), (1000, 7), (101, 100), (50, 4), (10, 3), (10, 2)])
+def test_indices_are_sorted_unique_bounded_and_keep_endpoints(method, count, max_points):
+    x, y = _series(count)
+    indices = downsample_indices(x, y, max_points, method=method)
+    assert len(indices) <= max_points
+    assert np.all(np.diff(indices) > 0)
+    assert indices[0] == 0 and indices[-1] == count - 1
+    assert 0 <= indices.min() and indices.max() < count
+
+@pytest.mark.parametrize("method", METHODS)
+def test_flagged_points_are_always_kept(method):
+    x, y = _series(2000)
+    keep = np.zeros(2000, dtype=bool)
+    keep[[3, 500, 501, 1337, 1998]] = True
+    indices = downsample_indices(x, y, 50, keep, method)
+    assert len(indices) <= 50
+    assert np.all(np.diff(indices) > 0)
+    assert set(np.flatnonzero(keep)) <= set(indices.tolist())
+    assert indices[0] == 0 and indices[-1] == 1999
+
+@pytest.mark.parametrize("method", METHODS)
+def test_more_flagged_points_than_budget_are_downsampled_among_themselves(method):
+    x, y = _series(500)
+    keep = np.zeros(500, dtype=bool)
+    keep[::5] = True
+    indices = downsample_indices(x, y, 20, keep, method)
+    assert len(indices) <= 20
+    assert np.all(np.diff(indices) > 0)
+    assert keep[indices].all()
+
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("count,max_points", [(0, 10), (1, 10), (10, 10), (10, 500)])
+def test_short_series_are_returned_unchanged(method, count, max_points):
+    x, y = _series(count)
+    assert downsample_indices(x, y, max_points, method=method).tolist() == list(range(count))
+
+def test_downsample_records_keeps_input_order_and_short_types_whole():
+    start = datetime(2024, 1, 1)
+    long_type = [
+        SimpleNamespace(test_type="Glucose", test_date=start + timedelta(hours=i), test_value=float(i % 17),
+                        result_flag="high" if i == 250 else "normal")
+        for i in range(400)
+    ]
+    short_type = [
+        SimpleNamespace(test_type="Ferritin", test_date=start + timedelta(days=i), test_value=30.0, result_flag=None)
+        for i in range(5)
+    ]
+    # Newest first, as the list endpoints return them, with the types interleaved
+    records = sorted(long_type + short_type, key=lambda record: record.test_date, reverse=True)
+
+    selected = downsample_records(records, max_points=40)
+    positions = [records.index(record) for record in selected]
+    assert positions == sorted(positions)
+    assert [record for record in selected if record.test_type == "Ferritin"] == short_type[::-1]
+    glucose = [record for record in selected if record.test_type == "Glucose"]
+    assert len(glucose) <= 40
+    assert long_type[250] in glucose and long_type[0] in glucose and long_type[-1] in glucose
@@ -0,0 +1,77 @@
+"""Export encoders: every format carries the same values, including NULL optional fields."""
+import asyncio
+import csv
+import gzip
+import io
+import json
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+from export import CSV_HEADER, encode_export, read_columnar
+
+ROWS = [
+    SimpleNamespace(
+        id=uuid.UUID("00000000-0000-0000-0000-000000000001"), test_category="Blood", test_type="Glucose",
+        test_value=5.4, unit="mmol/L", min_range=3.9, max_range=5.6, test_date=datetime(2024, 3, 1, 8, 30),
+        notes="fasting", created_at=datetime(2024, 3, 1, 9, 0, 0, 123456), updated_at=datetime(2024, 3, 2, 10, 0),
+        result_flag="normal", range_deviation=0.0,
+    ),
+    # Rows created before created_at/updated_at were filled in, without a range or notes
+    SimpleNamespace(
+        id=uuid.UUID("00000000-0000-0000-0000-000000000002"), test_category="Blood", test_type="Ferritin",
+        test_value=12.0, unit="ug/L", min_range=None, max_range=None, test_date=datetime(2023, 12, 24),
+        notes=None, created_at=None, updated_at=None, result_flag=None, range_deviation=None,
+    ),
+]
+
+def _export(fmt: str, use_gzip: bool = False) -> bytes:
+    async def chunks():
+        yield ROWS[:1]
+        yield ROWS[1:]
+
+    async def collect():
+        return b"".join([part async for part in encode_export(chunks(), fmt, gzip=use_gzip)])
+
+    return asyncio.run(collect())
+
+def _expected(row, empty=None) -> dict:
+    def iso(value, utc=False):
+        return empty if value is None else value.isoformat() + ("Z" if utc else "")
+    return {
+        "id": str(row.id), "testCategory": row.test_category, "testType": row.test_type,
+        "testValue": row.test_value, "unit": row.unit, "minRange": row.min_range, "maxRange": row.max_range,
+        "testDate": iso(row.test_date, utc=True), "notes": row.notes,
+        "createdAt": iso(row.created_at), "updatedAt": iso(row.updated_at),
+        "resultFlag": row.result_flag, "rangeDeviation": row.range_deviation,
+    }
+
+def test_ndjson_round_trip_keeps_nulls():
+    lines = _export("ndjson").decode().splitlines()
+    assert [json.loads(line) for line in lines] == [_expected(row) for row in ROWS]
+
+def test_csv_round_trip_writes_nulls_as_empty_fields():
+    reader = csv.reader(io.StringIO(_export("csv").decode()))
+    assert next(reader) == CSV_HEADER
+    records = [dict(zip(CSV_HEADER, values)) for values in reader]
+    expected = [
+        {name: "" if value is None else str(value) for name, value in _expected(row, empty="").items()}
+        for row in ROWS
+    ]
+    assert records == expected
+
+def test_columnar_round_trip_keeps_nulls():
+    records = read_columnar(_export("columnar"))
+    assert records == [
+        {
+            "id": row.id, "testCategory": row.test_category, "testType": row.test_type,
+            "testValue": row.test_value, "unit": row.unit, "minRange": row.min_range, "maxRange": row.max_range,
+            "testDate": row.test_date, "notes": row.notes, "createdAt": row.created_at,
+            "updatedAt": row.updated_at, "resultFlag": row.result_flag, "rangeDeviation": row.range_deviation,
+        }
+        for row in ROWS
+    ]
+
+def test_gzip_export_decompresses_to_plain_export():
+    for fmt in ("ndjson", "csv", "columnar"):
+        assert gzip.decompress(_export(fmt, use_gzip=True)) == _export(fmt)
@@ -0,0 +1,84 @@
+"""Conditional GETs: ETags follow the user's data version, and If-None-Match: * needs an existing representation."""
+import asyncio
+import json
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import http_cache
+from http_cache import MemoryResponseCache, cached_json_response
+
+USER_ID = uuid.UUID("00000000-0000-0000-0000-0000000000aa")
+
+class Versions:
+    """Stands in for user_data_versions as seen through the request's session"""
+
+    def __init__(self):
+        self.version = 0
+
+    async def get(self, db, user_id):
+        return self.version
+
+@pytest.fixture
+def versions(monkeypatch):
+    versions = Versions()
+    monkeypatch.setattr(http_cache, "get_data_version", versions.get)
+    return versions
+
+def _request(if_none_match=None, query=b"category=Blood"):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/api/test-records", "query_string": query, "headers": headers})
+
+def _get(cache, builds, if_none_match=None, query=b"category=Blood", missing=False):
+    async def build(extra_headers):
+        builds.append(1)
+        if missing:
+            raise HTTPException(status_code=404, detail="Not found")
+        return {"records": len(builds)}
+    return asyncio.run(cached_json_response(_request(if_none_match, query), None, USER_ID, cache, build))
+
+def test_etag_revalidates_until_a_write_bumps_the_version(versions):
+    cache, builds = MemoryResponseCache(maxsize=10, ttl=60), []
+    first = _get(cache, builds)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    assert _get(cache, builds, etag).status_code == 304
+    assert _get(cache, builds, f"W/{etag}").status_code == 304
+    assert len(builds) == 1
+
+    versions.version += 1
+    after_write = _get(cache, builds, etag)
+    assert after_write.status_code == 200
+    assert after_write.headers["etag"] != etag
+    assert json.loads(after_write.body) == {"records": 2}
+    assert _get(cache, builds, after_write.headers["etag"]).status_code == 304
+
+def test_etag_depends_on_query(versions):
+    cache, builds = MemoryResponseCache(maxsize=10, ttl=60), []
+    etag = _get(cache, builds).headers["etag"]
+    assert _get(cache, builds, etag, query=b"category=Urine").status_code == 200
+
+def test_client_copy_newer_than_a_lagging_replica_is_not_replaced(versions):
+    cache, builds = MemoryResponseCache(maxsize=10, ttl=60), []
+    versions.version = 5
+    newer = _get(cache, builds).headers["etag"]
+    # The next read lands on a replica that has not seen the last write yet
+    versions.version = 4
+    assert _get(cache, builds, newer).status_code == 304
+
+def test_cached_body_is_served_for_a_new_client(versions):
+    cache, builds = MemoryResponseCache(maxsize=10, ttl=60), []
+    first = _get(cache, builds)
+    second = _get(cache, builds)
+    assert second.status_code == 200 and second.body == first.body
+    assert len(builds) == 1
+
+def test_if_none_match_star_needs_an_existing_representation(versions):
+    cache, builds = MemoryResponseCache(maxsize=10, ttl=60), []
+    assert _get(cache, builds, "*").status_code == 304
+    with pytest.raises(HTTPException) as missing:
+        _get(cache, builds, "*", query=b"category=None", missing=True)
+    assert missing.value.status_code == 404
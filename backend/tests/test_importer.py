@@ -0,0 +1,168 @@
+"""File imports: the upload size cap, recovery of interrupted jobs and deduplication when merging batches.
+
+The database tests need TEST_DATABASE_URL, see test_email_service.py.
+"""
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import importer
+from importer import UploadTooLarge, recover_interrupted_imports, run_import, spool_upload
+import models
+from models import ImportJob, User
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+requires_database = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+async def _chunks(*parts: bytes):
+    for part in parts:
+        yield part
+
+def test_spool_upload_writes_the_body(tmp_path, monkeypatch):
+    monkeypatch.setattr(importer, "IMPORT_TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(importer, "IMPORT_SPOOL_FLUSH_BYTES", 4)
+    path = asyncio.run(spool_upload(_chunks(b"abc", b"defg", b"h"), max_bytes=8))
+    with open(path, "rb") as spool:
+        assert spool.read() == b"abcdefgh"
+
+def test_spool_upload_stops_at_the_byte_cap_and_removes_the_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(importer, "IMPORT_TMP_DIR", str(tmp_path))
+    consumed = []
+
+    async def endless():
+        while True:
+            consumed.append(1)
+            yield b"x" * 1024
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(spool_upload(endless(), max_bytes=10 * 1024))
+    assert len(consumed) == 11
+    assert os.listdir(tmp_path) == []
+
+async def _session_factory():
+    engine = create_async_engine(TEST_DATABASE_URL)
+    async with engine.begin() as conn:
+        for model in (User, models.TestRecord, models.TestRecordRollup, models.UserTestCatalogue, models.UserDataVersion, ImportJob):
+            await conn.run_sync(model.__table__.create, checkfirst=True)
+    return engine, sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+async def _create_user(session_factory):
+    user_id, email = uuid.uuid4(), f"import-{uuid.uuid4().hex[:12]}@example.com"
+    async with session_factory() as db:
+        await db.execute(
+            text("""
+                INSERT INTO users (id, email, hashed_password, first_name, last_name, role, is_active, email_verified)
+                VALUES (:id, :email, 'x', 'Test', 'User', 'patient', true, true)
+            """),
+            {"id": user_id, "email": email}
+        )
+        await db.commit()
+    return user_id, email
+
+async def _create_job(session_factory, user_id, **columns) -> uuid.UUID:
+    job_id = uuid.uuid4()
+    async with session_factory() as db:
+        db.add(ImportJob(id=job_id, user_id=user_id, format="ndjson", **columns))
+        await db.commit()
+    return job_id
+
+async def _job(session_factory, job_id):
+    async with session_factory() as db:
+        return (await db.execute(text("SELECT * FROM import_jobs WHERE id = :id"), {"id": job_id})).fetchone()
+
+def _run(scenario):
+    async def wrapper():
+        engine, session_factory = await _session_factory()
+        try:
+            await scenario(session_factory)
+        finally:
+            await engine.dispose()
+    asyncio.run(wrapper())
+
+@requires_database
+def test_recovery_fails_jobs_without_a_recent_heartbeat(tmp_path, monkeypatch):
+    monkeypatch.setattr(importer, "IMPORT_TMP_DIR", str(tmp_path))
+    stale = datetime.utcnow() - timedelta(seconds=importer.IMPORT_STALE_SECONDS + 60)
+    fresh = datetime.utcnow() - timedelta(seconds=5)
+
+    orphan = tmp_path / f"{importer.SPOOL_PREFIX}orphan"
+    live = tmp_path / f"{importer.SPOOL_PREFIX}live"
+    unrelated = tmp_path / "unrelated"
+    for path in (orphan, live, unrelated):
+        path.write_bytes(b"{}\n")
+    old = time.time() - importer.IMPORT_STALE_SECONDS - 60
+    os.utime(orphan, (old, old))
+    os.utime(unrelated, (old, old))
+
+    async def scenario(session_factory):
+        user_id, _ = await _create_user(session_factory)
+        dead = await _create_job(session_factory, user_id, status="running", created_at=stale, started_at=stale, heartbeat_at=stale)
+        # Started long ago but still reporting progress
+        running = await _create_job(session_factory, user_id, status="running", created_at=stale, started_at=stale, heartbeat_at=fresh)
+        never_started = await _create_job(session_factory, user_id, status="pending", created_at=stale)
+        queued = await _create_job(session_factory, user_id, status="pending", created_at=fresh)
+        finished = await _create_job(session_factory, user_id, status="completed", created_at=stale, heartbeat_at=stale)
+
+        await recover_interrupted_imports(session_factory)
+
+        for job_id in (dead, never_started):
+            job = await _job(session_factory, job_id)
+            assert job.status == "failed"
+            assert job.error_message == importer.INTERRUPTED_MESSAGE
+        assert (await _job(session_factory, running)).status == "running"
+        assert (await _job(session_factory, queued)).status == "pending"
+        assert (await _job(session_factory, finished)).status == "completed"
+
+    _run(scenario)
+    assert sorted(os.listdir(tmp_path)) == sorted([live.name, unrelated.name])
+
+@requires_database
+def test_staging_merge_skips_duplicates_within_and_across_imports(tmp_path, monkeypatch):
+    monkeypatch.setattr(importer, "IMPORT_TMP_DIR", str(tmp_path))
+    monkeypatch.setattr(importer, "IMPORT_BATCH_SIZE", 2)
+    rows = [
+        '{"testCategory": "Blood", "testType": "Glucose", "testValue": 5.1, "unit": "mmol/L", "testDate": "2024-01-02"}',
+        # Same record again, in the same batch and in the next one
+        '{"testCategory": "Blood", "testType": "Glucose", "testValue": 5.1, "unit": "mmol/L", "testDate": "2024-01-02"}',
+        '{"testCategory": "Blood", "testType": "Glucose", "testValue": 5.1, "unit": "mmol/L", "testDate": "2024-01-02T00:00:00Z"}',
+        '{"testCategory": "Blood", "testType": "Glucose", "testValue": 6.3, "unit": "mmol/L", "testDate": "2024-01-02"}',
+        '{"testCategory": "Blood", "testType": "Glucose", "testValue": "high", "unit": "mmol/L", "testDate": "2024-01-03"}',
+    ]
+
+    def upload() -> str:
+        path = tmp_path / f"{importer.SPOOL_PREFIX}{uuid.uuid4().hex}"
+        path.write_text("\n".join(rows) + "\n")
+        return str(path)
+
+    async def scenario(session_factory):
+        user_id, email = await _create_user(session_factory)
+
+        first = await _create_job(session_factory, user_id)
+        await run_import(session_factory, first, user_id, email, upload(), "ndjson")
+        job = await _job(session_factory, first)
+        assert job.status == "completed"
+        assert job.heartbeat_at is not None
+        assert (job.rows_processed, job.rows_imported, job.rows_skipped, job.rows_failed) == (5, 2, 2, 1)
+
+        second = await _create_job(session_factory, user_id)
+        await run_import(session_factory, second, user_id, email, upload(), "ndjson")
+        job = await _job(session_factory, second)
+        assert (job.rows_processed, job.rows_imported, job.rows_skipped, job.rows_failed) == (5, 0, 4, 1)
+
+        async with session_factory() as db:
+            values = (await db.execute(
+                text("SELECT test_value FROM test_records WHERE user_id = :user_id ORDER BY test_value"),
+                {"user_id": user_id}
+            )).scalars().all()
+        assert values == [5.1, 6.3]
+
+    _run(scenario)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,38 @@
+"""Access to /metrics: internal client addresses or the metrics token."""
+import ipaddress
+
+import pytest
+from starlette.requests import Request
+
+import metrics
+import ratelimit
+from metrics import metrics_access_allowed
+
+@pytest.fixture(autouse=True)
+def networks(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ALLOWED_CIDRS", [ipaddress.ip_network("10.0.0.0/8")])
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXY_CIDRS", [ipaddress.ip_network("127.0.0.1/32")])
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", None)
+
+def _request(peer: str, headers: dict = None) -> Request:
+    return Request({
+        "type": "http", "method": "GET", "path": "/metrics", "client": (peer, 40000),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    })
+
+def test_internal_addresses_are_allowed():
+    assert metrics_access_allowed(_request("10.1.2.3"))
+    assert not metrics_access_allowed(_request("203.0.113.9"))
+
+def test_forwarded_for_is_only_trusted_from_proxies():
+    # A public client behind the trusted proxy is still a public client
+    assert not metrics_access_allowed(_request("127.0.0.1", {"X-Forwarded-For": "203.0.113.9"}))
+    assert metrics_access_allowed(_request("127.0.0.1", {"X-Forwarded-For": "10.1.2.3"}))
+    # An untrusted peer cannot claim an internal address
+    assert not metrics_access_allowed(_request("203.0.113.9", {"X-Forwarded-For": "10.1.2.3"}))
+
+def test_token_allows_any_address(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "scrape-secret")
+    assert metrics_access_allowed(_request("203.0.113.9", {"Authorization": "Bearer scrape-secret"}))
+    assert not metrics_access_allowed(_request("203.0.113.9", {"Authorization": "Bearer wrong"}))
+    assert not metrics_access_allowed(_request("203.0.113.9"))
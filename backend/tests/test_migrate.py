@@ -0,0 +1,149 @@
+"""Migration runner: file discovery and ordering, statement splitting, and the advisory lock.
+
+The database is replaced by a fake asyncpg connection that records what the runner sends.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+import migrate
+from migrate import MIGRATION_LOCK_KEY, load_migrations, split_statements
+
+class FakeConnection:
+    """Stands in for the raw asyncpg connection: answers the lock and records statements"""
+
+    def __init__(self, lock_answers=(True,), applied=None, fail_on=None):
+        self.lock_answers = list(lock_answers)
+        self.applied = dict(applied or {})
+        self.fail_on = fail_on
+        self.statements = []
+        self.in_transaction = False
+
+    async def fetchval(self, query, *args):
+        if "pg_try_advisory_lock" in query:
+            return self.lock_answers.pop(0)
+        return None
+
+    async def fetch(self, query, *args):
+        return [{"version": version, "checksum": checksum} for version, checksum in self.applied.items()]
+
+    async def execute(self, query, *args):
+        if self.fail_on and self.fail_on in query:
+            raise RuntimeError("migration failed")
+        self.statements.append((query, args, self.in_transaction))
+        if query.startswith("INSERT INTO schema_migrations"):
+            self.applied[args[0]] = args[2]
+
+    @asynccontextmanager
+    async def _transaction(self):
+        self.in_transaction = True
+        try:
+            yield
+        finally:
+            self.in_transaction = False
+
+    def transaction(self):
+        return self._transaction()
+
+class FakeEngine:
+    def __init__(self, pg):
+        self.pg = pg
+
+    @asynccontextmanager
+    async def connect(self):
+        async def get_raw_connection():
+            return SimpleNamespace(driver_connection=self.pg)
+        yield SimpleNamespace(get_raw_connection=get_raw_connection)
+
+    @asynccontextmanager
+    async def begin(self):
+        yield None
+
+def _write(directory, files: dict):
+    for name, sql in files.items():
+        (directory / name).write_text(sql, encoding="utf-8")
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    monkeypatch.setattr(migrate, "PARTITIONING_ENABLED", False)
+    monkeypatch.setattr(migrate, "MIGRATION_LOCK_POLL_SECONDS", 0)
+
+    async def backfill_rollups(conn):
+        pass
+    monkeypatch.setattr(migrate, "backfill_rollups", backfill_rollups)
+    _write(tmp_path, {
+        "0010_later.sql": "CREATE TABLE later (id INT);",
+        "0002_second.sql": "-- migrate: no-transaction\nCREATE INDEX CONCURRENTLY IF NOT EXISTS ix_a ON a (x);\nCREATE INDEX CONCURRENTLY IF NOT EXISTS ix_b ON b (y);\n",
+        "0001_first.sql": "CREATE TABLE first (id INT);",
+        "README.md": "not a migration",
+        "0003_draft.sql.bak": "not a migration either",
+    })
+    monkeypatch.setattr(migrate, "load_migrations", lambda: load_migrations(str(tmp_path)))
+
+    def run(pg):
+        monkeypatch.setattr(migrate, "engine", FakeEngine(pg))
+        return asyncio.run(migrate.migrate())
+    return run
+
+def test_migrations_load_in_version_order(tmp_path, runner):
+    migrations = load_migrations(str(tmp_path))
+    assert [(m.version, m.name) for m in migrations] == [("0001", "first"), ("0002", "second"), ("0010", "later")]
+    assert [m.transactional for m in migrations] == [True, False, True]
+    assert len({m.checksum for m in migrations}) == 3
+
+def test_shipped_migrations_have_unique_increasing_versions():
+    versions = [migration.version for migration in load_migrations()]
+    assert versions == sorted(set(versions))
+    assert versions[0] == "0001"
+
+def test_no_transaction_migrations_split_on_line_ending_semicolons():
+    sql = "-- migrate: no-transaction\n-- a comment; with a semicolon\nSELECT 'a;b';\nCREATE INDEX x\n  ON t (c);\n\n"
+    assert split_statements(sql) == ["SELECT 'a;b'", "CREATE INDEX x\n  ON t (c)"]
+
+def test_pending_migrations_are_applied_in_order_under_the_lock(runner):
+    pg = FakeConnection()
+    assert runner(pg) == ["0001_first", "0002_second", "0010_later"]
+
+    queries = [query for query, _, _ in pg.statements]
+    assert queries[-1] == "SELECT pg_advisory_unlock($1)"
+    assert pg.statements[-1][1] == (MIGRATION_LOCK_KEY,)
+    applied = [query for query in queries if query.startswith(("CREATE TABLE first", "CREATE INDEX", "CREATE TABLE later"))]
+    assert applied == [
+        "CREATE TABLE first (id INT);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_a ON a (x)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_b ON b (y)",
+        "CREATE TABLE later (id INT);",
+    ]
+    # Transactional migrations record themselves in the same transaction; CONCURRENTLY runs outside one
+    in_transaction = {query: inside for query, _, inside in pg.statements}
+    assert in_transaction["CREATE TABLE first (id INT);"]
+    assert not in_transaction["CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_a ON a (x)"]
+    assert list(pg.applied) == ["0001", "0002", "0010"]
+
+def test_applied_migrations_are_skipped(tmp_path, runner):
+    first = load_migrations(str(tmp_path))[0]
+    pg = FakeConnection(applied={first.version: first.checksum})
+    assert runner(pg) == ["0002_second", "0010_later"]
+    assert not any(query.startswith("CREATE TABLE first") for query, _, _ in pg.statements)
+
+def test_lock_is_polled_until_free(runner):
+    pg = FakeConnection(lock_answers=(False, False, True))
+    assert runner(pg) == ["0001_first", "0002_second", "0010_later"]
+    assert pg.lock_answers == []
+
+def test_lock_wait_gives_up_after_the_timeout(runner, monkeypatch):
+    monkeypatch.setattr(migrate, "MIGRATION_LOCK_TIMEOUT_SECONDS", 0)
+    pg = FakeConnection(lock_answers=(False,))
+    with pytest.raises(TimeoutError):
+        runner(pg)
+    assert pg.statements == []
+
+def test_lock_is_released_when_a_migration_fails(runner):
+    pg = FakeConnection(fail_on="CREATE TABLE later")
+    with pytest.raises(RuntimeError):
+        runner(pg)
+    assert pg.statements[-1][0] == "SELECT pg_advisory_unlock($1)"
+    # Earlier migrations stay recorded, so the next run resumes after them
+    assert list(pg.applied) == ["0001", "0002"]
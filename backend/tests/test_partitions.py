@@ -0,0 +1,144 @@
+"""Monthly partitions: archiving and restoring a month keeps rollups and catalogues in step, and one worker maintains.
+
+Needs TEST_DATABASE_URL, see test_email_service.py. Runs in its own schema, dropped first.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import partitions
+from catalogue import apply_catalogue
+from models import Base
+from rollups import apply_rollups
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+SCHEMA = "partition_tests"
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+async def _engine():
+    setup = create_async_engine(TEST_DATABASE_URL)
+    async with setup.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    await setup.dispose()
+    engine = create_async_engine(TEST_DATABASE_URL, connect_args={"server_settings": {"search_path": SCHEMA}})
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine
+
+def _record(user_id, test_type, value, test_date):
+    return SimpleNamespace(
+        id=uuid.uuid4(), user_id=user_id, test_category="Blood", test_type=test_type, test_value=value,
+        unit="mmol/L", min_range=4.0, max_range=6.0, test_date=test_date, notes=None,
+        result_flag="normal" if 4.0 <= value <= 6.0 else "high", range_deviation=0.0,
+    )
+
+async def _insert(conn, user_id, records):
+    await conn.execute(
+        text("""
+            INSERT INTO test_records (id, user_id, test_category, test_type, test_value, unit, min_range, max_range,
+                                      test_date, notes, result_flag, range_deviation, created_at, updated_at)
+            VALUES (:id, :user_id, :test_category, :test_type, :test_value, :unit, :min_range, :max_range,
+                    :test_date, :notes, :result_flag, :range_deviation, now(), now())
+        """),
+        [vars(record) for record in records]
+    )
+    await apply_rollups(conn, user_id, records)
+    await apply_catalogue(conn, user_id, records)
+
+async def _snapshot(conn) -> tuple:
+    rollups = (await conn.execute(text("""
+        SELECT user_id, test_category, test_type, bucket, bucket_start, value_count, value_sum,
+               min_value, max_value, last_value, last_test_date, out_of_range_count
+        FROM test_record_rollups ORDER BY 1, 2, 3, 4, 5
+    """))).fetchall()
+    catalogue = (await conn.execute(text("""
+        SELECT user_id, test_category, test_type, unit, record_count, first_test_date, last_test_date,
+               last_value, last_result_flag
+        FROM user_test_catalogue ORDER BY 1, 2, 3
+    """))).fetchall()
+    return [tuple(row) for row in rollups], [tuple(row) for row in catalogue]
+
+def test_archive_and_restore_rebuild_rollups_and_catalogue(tmp_path, monkeypatch):
+    monkeypatch.setattr(partitions, "PARTITION_ARCHIVE_DIR", str(tmp_path))
+    january = datetime(2024, 1, 1)
+
+    async def scenario():
+        engine = await _engine()
+        try:
+            user_id, other_id = uuid.uuid4(), uuid.uuid4()
+            async with engine.begin() as conn:
+                for uid in (user_id, other_id):
+                    await conn.execute(
+                        text("""
+                            INSERT INTO users (id, email, hashed_password, first_name, last_name)
+                            VALUES (:id, :email, 'x', 'Test', 'User')
+                        """),
+                        {"id": uid, "email": f"{uid}@example.com"}
+                    )
+                # Glucose spans January and February, including the week of 29 January;
+                # Ferritin was only measured in January
+                glucose = [_record(user_id, "Glucose", 4.5 + i * 0.25, datetime(2024, 1, 3) + timedelta(days=4 * i)) for i in range(10)]
+                ferritin = [_record(user_id, "Ferritin", 7.5, datetime(2024, 1, 15, 9))]
+                other = [_record(other_id, "Glucose", 5.0, datetime(2024, 3, 5))]
+                await _insert(conn, user_id, glucose + ferritin)
+                await _insert(conn, other_id, other)
+                await partitions.convert_to_partitioned(conn)
+                before = await _snapshot(conn)
+                versions = dict((await conn.execute(text("SELECT user_id, version FROM user_data_versions"))).fetchall())
+
+            async with engine.begin() as conn:
+                archived = await partitions.archive_partition(conn, january)
+            assert archived["rowCount"] == 9
+            assert os.path.isabs(archived["path"])
+
+            async with engine.connect() as conn:
+                rollups, catalogue = await _snapshot(conn)
+                catalogue = {row[2]: row for row in catalogue if row[0] == user_id}
+                assert set(catalogue) == {"Glucose"}
+                assert catalogue["Glucose"][4] == 2
+                assert catalogue["Glucose"][5] == datetime(2024, 2, 4)
+                assert not [row for row in rollups if row[0] == user_id and row[4] < datetime(2024, 1, 29)]
+                # The week starting 29 January now only counts its February record
+                week = [row for row in rollups if row[0] == user_id and row[3] == "week" and row[4] == datetime(2024, 1, 29)]
+                assert [row[5] for row in week] == [1]
+                # Another user's series is untouched
+                assert [row for row in rollups if row[0] == other_id] == [row for row in before[0] if row[0] == other_id]
+                new_versions = dict((await conn.execute(text("SELECT user_id, version FROM user_data_versions"))).fetchall())
+                assert new_versions[user_id] == versions.get(user_id, 0) + 1
+                assert new_versions.get(other_id) == versions.get(other_id)
+
+            async with engine.begin() as conn:
+                restored = await partitions.restore_partition(conn, january)
+            assert restored["rowCount"] == 9
+            async with engine.connect() as conn:
+                assert await _snapshot(conn) == before
+        finally:
+            await engine.dispose()
+
+    asyncio.run(scenario())
+
+def test_only_one_maintainer_holds_the_lock():
+    async def scenario():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        first, second = partitions.PartitionMaintainer(engine), partitions.PartitionMaintainer(engine)
+        try:
+            assert await first._hold_lock()
+            assert not await second._hold_lock()
+            assert await first._hold_lock()
+            # When the maintaining worker stops, another takes over
+            await first._release_lock()
+            assert await second._hold_lock()
+        finally:
+            await first._release_lock()
+            await second._release_lock()
+            await engine.dispose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,163 @@
+"""Token bucket rate limiting: refill maths, the per-worker deny cache, client addresses and the Postgres store.
+
+The store test needs TEST_DATABASE_URL, see test_email_service.py; the rest run without a database.
+"""
+import asyncio
+import ipaddress
+import os
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import ratelimit
+from ratelimit import DatabaseRateLimitStore, MemoryRateLimitStore, RateLimiter, client_ip
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+class CountingStore:
+    """Wraps a store, counting calls and optionally failing them"""
+
+    def __init__(self, store=None, error=None):
+        self.store = store
+        self.error = error
+        self.calls = 0
+
+    async def take(self, buckets):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return await self.store.take(buckets)
+
+def _request(peer, headers=None):
+    raw = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "POST", "path": "/api/auth/login", "headers": raw, "client": (peer, 50000)})
+
+def _check(limiter, request, email=None):
+    asyncio.run(limiter.check("login", request, email))
+
+def test_memory_store_refills_at_rate_up_to_capacity(clock):
+    store = MemoryRateLimitStore(maxsize=10)
+    bucket = [("k", 3.0, 0.5)]  # 3 tokens, one every 2 seconds
+
+    assert [asyncio.run(store.take(bucket))[0] for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Empty: the denied take goes to -1, so the next token is 2 / 0.5 seconds away
+    assert asyncio.run(store.take(bucket)) == [4.0]
+
+    clock.now += 4
+    assert asyncio.run(store.take(bucket)) == [0.0]
+    # Refill never exceeds capacity, however long the bucket sits idle
+    clock.now += 3600
+    assert [asyncio.run(store.take(bucket))[0] for _ in range(4)] == [0.0, 0.0, 0.0, 4.0]
+
+def test_empty_bucket_rejects_with_retry_after(clock):
+    capacity, _ = ratelimit.RATE_LIMITS["login:email"]
+    limiter = RateLimiter(MemoryRateLimitStore(maxsize=10))
+    for _ in range(int(capacity)):
+        _check(limiter, _request("203.0.113.7"), "a@example.com")
+
+    with pytest.raises(HTTPException) as denied:
+        _check(limiter, _request("203.0.113.8"), "a@example.com")
+    assert denied.value.status_code == 429
+    assert int(denied.value.headers["Retry-After"]) >= 1
+    # Other emails from the same address are unaffected
+    _check(limiter, _request("203.0.113.8"), "b@example.com")
+
+def test_denied_keys_are_rejected_without_touching_the_store(clock):
+    store = CountingStore(MemoryRateLimitStore(maxsize=10))
+    limiter = RateLimiter(store)
+    capacity, rate = ratelimit.RATE_LIMITS["login:email"]
+    for _ in range(int(capacity) + 1):
+        try:
+            _check(limiter, _request("203.0.113.7"), "a@example.com")
+        except HTTPException:
+            pass
+    calls = store.calls
+
+    with pytest.raises(HTTPException) as denied:
+        _check(limiter, _request("203.0.113.7"), "A@Example.com ")
+    assert store.calls == calls
+    assert limiter.stats["rejectedLocally"] == 1
+    assert int(denied.value.headers["Retry-After"]) == int(2 / rate + 0.999)
+
+    # Once the wait has passed the store is asked again
+    clock.now += 2 / rate
+    _check(limiter, _request("203.0.113.7"), "a@example.com")
+    assert store.calls == calls + 1
+
+def test_store_errors_fail_open():
+    limiter = RateLimiter(CountingStore(error=OSError("connection refused")))
+    for _ in range(50):
+        _check(limiter, _request("203.0.113.7"), "a@example.com")
+    assert limiter.stats["storeErrors"] == 50
+    assert limiter.stats["rejected"] == 0
+
+def test_client_ip_ignores_forwarded_headers_from_untrusted_peers(monkeypatch):
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXY_CIDRS", [ipaddress.ip_network("10.0.0.0/8")])
+    spoofed = {"X-Forwarded-For": "198.51.100.1", "X-Real-IP": "198.51.100.2"}
+    assert client_ip(_request("203.0.113.7", spoofed)) == "203.0.113.7"
+
+def test_client_ip_walks_forwarded_chain_from_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXY_CIDRS", [ipaddress.ip_network("10.0.0.0/8")])
+    # The client prepended a fake hop; the proxies appended the real client and themselves
+    headers = {"X-Forwarded-For": "198.51.100.1, 203.0.113.7, 10.0.0.2"}
+    assert client_ip(_request("10.0.0.1", headers)) == "203.0.113.7"
+    assert client_ip(_request("10.0.0.1", {"X-Real-IP": "203.0.113.9"})) == "203.0.113.9"
+    assert client_ip(_request("10.0.0.1")) == "10.0.0.1"
+    assert client_ip(_request("2001:db8::1", {"X-Forwarded-For": "198.51.100.1"})) == "2001:db8::1"
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+def test_take_tokens_sql_refills_and_floors_at_minus_one():
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import RateLimitBucket
+
+    async def scenario():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        async with engine.begin() as conn:
+            await conn.run_sync(RateLimitBucket.__table__.create, checkfirst=True)
+            await conn.execute(text("DELETE FROM rate_limit_buckets"))
+        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        store = DatabaseRateLimitStore(session_factory)
+        buckets = [("test:ip:2001:db8::1", 2.0, 0.5), ("test:email:a@example.com", 5.0, 1.0)]
+        try:
+            assert await store.take(buckets) == [0.0, 0.0]
+            assert await store.take(buckets) == [0.0, 0.0]
+            ip_wait, email_wait = await store.take(buckets)
+            assert ip_wait == pytest.approx(2 / 0.5, rel=0.01)
+            assert email_wait == 0.0
+            # Repeated denials stay at -1 rather than digging deeper
+            ip_wait, _ = await store.take(buckets)
+            assert ip_wait == pytest.approx(2 / 0.5, rel=0.01)
+
+            # Wind the clock back on the stored bucket to simulate the refill time passing
+            async with session_factory() as db:
+                await db.execute(text("UPDATE rate_limit_buckets SET updated_at = updated_at - CAST(:idle AS interval)"),
+                                 {"idle": timedelta(seconds=4)})
+                await db.commit()
+            ip_wait, _ = await store.take(buckets)
+            assert ip_wait == 0.0
+
+            async with session_factory() as db:
+                tokens = dict((await db.execute(text("SELECT bucket_key, tokens FROM rate_limit_buckets"))).fetchall())
+            assert tokens["test:ip:2001:db8::1"] == pytest.approx(0.0, abs=0.05)
+            assert tokens["test:email:a@example.com"] <= 5.0 - 1
+        finally:
+            await engine.dispose()
+
+    asyncio.run(scenario())
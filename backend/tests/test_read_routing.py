@@ -0,0 +1,69 @@
+"""Replica routing for reads and the signed last-write hint that keeps a user's reads on the primary."""
+import asyncio
+import time
+
+import pytest
+from starlette.requests import Request
+from starlette.responses import Response
+
+import auth
+import database
+
+class FakeSession:
+    def __init__(self, name, opened):
+        self.name = name
+        opened.append(name)
+
+    async def connection(self):
+        return None
+
+    async def close(self):
+        pass
+
+@pytest.fixture
+def opened(monkeypatch):
+    opened = []
+    monkeypatch.setattr(database, "replica_session", lambda: FakeSession("replica", opened))
+    monkeypatch.setattr(database, "async_session", lambda: FakeSession("primary", opened))
+    monkeypatch.setattr(database, "_replica_retry_at", 0.0)
+    monkeypatch.setattr(database, "_recent_writers", database.TTLCache(maxsize=100, ttl=database.REPLICA_STICKY_SECONDS))
+    return opened
+
+def _read(key, wrote_at=None):
+    async def scenario():
+        async with database.read_session(key, wrote_at) as session:
+            return session.name
+    return asyncio.run(scenario())
+
+def _request(cookie=None):
+    headers = [(b"cookie", cookie.encode())] if cookie else []
+    return Request({"type": "http", "method": "GET", "path": "/api/test-records", "headers": headers})
+
+def test_read_without_hint_never_opens_a_primary_session(opened):
+    assert _read("a@example.com") == "replica"
+    assert _read("a@example.com", auth.read_write_hint(_request(), "a@example.com")) == "replica"
+    assert opened == ["replica", "replica"]
+
+def test_fresh_hint_routes_to_primary_and_expired_hint_does_not(opened):
+    assert _read("a@example.com", time.time()) == "primary"
+    assert _read("a@example.com", time.time() - database.REPLICA_STICKY_SECONDS - 1) == "replica"
+    assert opened == ["primary", "replica"]
+
+def test_write_in_this_worker_routes_to_primary(opened):
+    database.mark_write("a@example.com")
+    assert _read("a@example.com") == "primary"
+    assert _read("b@example.com") == "replica"
+
+def test_remember_write_cookie_round_trips_only_for_its_user(opened):
+    response = Response()
+    auth.remember_write(response, "a@example.com")
+    cookie = response.headers["set-cookie"].split(";")[0]
+
+    wrote_at = auth.read_write_hint(_request(cookie), "a@example.com")
+    assert wrote_at is not None and abs(wrote_at - time.time()) < 5
+    assert auth.read_write_hint(_request(cookie), "b@example.com") is None
+
+    name, value = cookie.split("=", 1)
+    written_at, _, signature = value.rpartition(".")
+    forged = f"{name}={float(written_at) + 60:.3f}.{signature}"
+    assert auth.read_write_hint(_request(forged), "a@example.com") is None
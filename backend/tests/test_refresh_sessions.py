@@ -0,0 +1,141 @@
+"""Refresh token rotation, reuse detection and legacy tokens against a scratch Postgres database.
+
+Needs TEST_DATABASE_URL, see test_email_service.py.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import refresh_sessions
+from auth import create_refresh_token, verify_refresh_token
+from models import RefreshSession, User
+from refresh_sessions import issue_refresh_token, rotate_refresh_token
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+async def _session_factory():
+    engine = create_async_engine(TEST_DATABASE_URL)
+    async with engine.begin() as conn:
+        await conn.run_sync(User.__table__.create, checkfirst=True)
+        await conn.run_sync(RefreshSession.__table__.create, checkfirst=True)
+    return engine, sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+async def _create_user(session_factory) -> tuple:
+    user_id, email = uuid.uuid4(), f"refresh-{uuid.uuid4().hex[:12]}@example.com"
+    async with session_factory() as db:
+        await db.execute(
+            text("""
+                INSERT INTO users (id, email, hashed_password, first_name, last_name, role, is_active, email_verified)
+                VALUES (:id, :email, 'x', 'Test', 'User', 'patient', true, true)
+            """),
+            {"id": user_id, "email": email}
+        )
+        await db.commit()
+    return user_id, email
+
+async def _rotate(session_factory, token: str):
+    async with session_factory() as db:
+        return await rotate_refresh_token(db, verify_refresh_token(token))
+
+async def _age_rotation(session_factory, user_id, seconds: float):
+    async with session_factory() as db:
+        await db.execute(
+            text("UPDATE refresh_sessions SET rotated_at = rotated_at - CAST(:age AS interval) WHERE user_id = :user_id AND rotated_at IS NOT NULL"),
+            {"age": timedelta(seconds=seconds), "user_id": user_id}
+        )
+        await db.commit()
+
+def _run(scenario):
+    async def wrapper():
+        engine, session_factory = await _session_factory()
+        try:
+            await scenario(session_factory)
+        finally:
+            await engine.dispose()
+    asyncio.run(wrapper())
+
+def test_rotation_issues_a_new_token_in_the_same_family():
+    async def scenario(session_factory):
+        user_id, email = await _create_user(session_factory)
+        async with session_factory() as db:
+            first = await issue_refresh_token(db, user_id, email)
+            await db.commit()
+
+        user, second = await _rotate(session_factory, first)
+        assert user.id == user_id and user.email == email
+        assert second != first
+        assert verify_refresh_token(second)["fam"] == verify_refresh_token(first)["fam"]
+        user, _ = await _rotate(session_factory, second)
+        assert user.id == user_id
+
+    _run(scenario)
+
+def test_reuse_outside_grace_window_revokes_the_family():
+    async def scenario(session_factory):
+        user_id, email = await _create_user(session_factory)
+        async with session_factory() as db:
+            first = await issue_refresh_token(db, user_id, email)
+            await db.commit()
+        _, second = await _rotate(session_factory, first)
+        await _age_rotation(session_factory, user_id, refresh_sessions.REFRESH_REUSE_GRACE_SECONDS + 5)
+
+        with pytest.raises(HTTPException) as reused:
+            await _rotate(session_factory, first)
+        assert reused.value.status_code == 401
+        assert reused.value.detail == "Refresh token reuse detected"
+        # The token the legitimate client holds is revoked with the rest of the family
+        with pytest.raises(HTTPException):
+            await _rotate(session_factory, second)
+        async with session_factory() as db:
+            open_sessions = await db.scalar(
+                text("SELECT count(*) FROM refresh_sessions WHERE user_id = :user_id AND revoked_at IS NULL"),
+                {"user_id": user_id}
+            )
+        assert open_sessions == 0
+
+    _run(scenario)
+
+def test_concurrent_refreshes_inside_grace_window_all_succeed():
+    async def scenario(session_factory):
+        user_id, email = await _create_user(session_factory)
+        async with session_factory() as db:
+            first = await issue_refresh_token(db, user_id, email)
+            await db.commit()
+
+        results = await asyncio.gather(*(_rotate(session_factory, first) for _ in range(3)))
+        tokens = [token for _, token in results]
+        assert len(set(tokens)) == 3
+        family = verify_refresh_token(first)["fam"]
+        assert {verify_refresh_token(token)["fam"] for token in tokens} == {family}
+        # Every token handed out keeps working
+        for token in tokens:
+            user, _ = await _rotate(session_factory, token)
+            assert user.id == user_id
+
+    _run(scenario)
+
+def test_legacy_token_without_jti_is_accepted_once():
+    async def scenario(session_factory):
+        user_id, email = await _create_user(session_factory)
+        legacy = create_refresh_token({"sub": email}, expire=datetime.utcnow() + timedelta(hours=12))
+
+        user, adopted = await _rotate(session_factory, legacy)
+        assert user.id == user_id
+        assert verify_refresh_token(adopted)["fam"]
+        # Replayed after the grace window it counts as reuse and revokes the new family
+        await _age_rotation(session_factory, user_id, refresh_sessions.REFRESH_REUSE_GRACE_SECONDS + 5)
+        with pytest.raises(HTTPException):
+            await _rotate(session_factory, legacy)
+        with pytest.raises(HTTPException):
+            await _rotate(session_factory, adopted)
+
+    _run(scenario)
@@ -0,0 +1,101 @@
+"""Series rollups: bucket boundaries and how new records fold into day, week and month buckets."""
+import asyncio
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from rollups import UPSERT_ROLLUP_SQL, _bucket_end, apply_rollups, bucket_start, is_out_of_range
+
+USER_ID = uuid.UUID("00000000-0000-0000-0000-0000000000aa")
+
+class RecordingSession:
+    """Collects the statements apply_rollups would run"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def execute(self, statement, params=None):
+        self.calls.append((statement, params))
+
+def _record(value, test_date, test_type="Glucose", min_range=4.0, max_range=6.0):
+    return SimpleNamespace(test_category="Blood", test_type=test_type, test_value=value,
+                           min_range=min_range, max_range=max_range, test_date=test_date)
+
+def _rollups(records) -> dict:
+    db = RecordingSession()
+    asyncio.run(apply_rollups(db, USER_ID, records))
+    if not db.calls:
+        return {}
+    [(statement, rows)] = db.calls
+    assert statement is UPSERT_ROLLUP_SQL
+    return {(row["test_type"], row["bucket"], row["bucket_start"]): row for row in rows}
+
+@pytest.mark.parametrize("value,expected", [
+    (datetime(2024, 2, 29, 23, 59, 59, 999999), {"day": datetime(2024, 2, 29), "week": datetime(2024, 2, 26), "month": datetime(2024, 2, 1)}),
+    # A Monday starts its own week
+    (datetime(2024, 1, 1, 8), {"day": datetime(2024, 1, 1), "week": datetime(2024, 1, 1), "month": datetime(2024, 1, 1)}),
+    # A Sunday belongs to the week that started in the previous month and year
+    (datetime(2023, 12, 31, 12), {"day": datetime(2023, 12, 31), "week": datetime(2023, 12, 25), "month": datetime(2023, 12, 1)}),
+    (datetime(2024, 3, 3), {"day": datetime(2024, 3, 3), "week": datetime(2024, 2, 26), "month": datetime(2024, 3, 1)}),
+])
+def test_bucket_start_matches_date_trunc(value, expected):
+    assert {bucket: bucket_start(bucket, value) for bucket in expected} == expected
+
+def test_unknown_bucket_is_rejected():
+    with pytest.raises(ValueError):
+        bucket_start("year", datetime(2024, 1, 1))
+
+@pytest.mark.parametrize("bucket,start,end", [
+    ("day", datetime(2024, 2, 28), datetime(2024, 2, 29)),
+    ("week", datetime(2024, 12, 30), datetime(2025, 1, 6)),
+    ("month", datetime(2024, 1, 1), datetime(2024, 2, 1)),
+    ("month", datetime(2024, 2, 1), datetime(2024, 3, 1)),
+    ("month", datetime(2024, 12, 1), datetime(2025, 1, 1)),
+])
+def test_bucket_end_is_the_next_bucket_start(bucket, start, end):
+    assert _bucket_end(bucket, start) == end
+    assert bucket_start(bucket, end) == end
+
+def test_out_of_range_uses_strict_bounds_and_one_sided_ranges():
+    assert not is_out_of_range(4.0, 4.0, 6.0)
+    assert not is_out_of_range(6.0, 4.0, 6.0)
+    assert is_out_of_range(3.9, 4.0, 6.0)
+    assert is_out_of_range(6.1, None, 6.0)
+    assert not is_out_of_range(100.0, 4.0, None)
+    assert not is_out_of_range(100.0, None, None)
+
+def test_records_fold_into_each_bucket():
+    records = [
+        _record(5.0, datetime(2024, 1, 30, 9)),
+        _record(7.0, datetime(2024, 1, 30, 8)),
+        _record(3.0, datetime(2024, 2, 1, 9)),
+    ]
+    rollups = _rollups(records)
+    assert sorted(key for key in rollups if key[1] == "week") == [("Glucose", "week", datetime(2024, 1, 29))]
+
+    day = rollups[("Glucose", "day", datetime(2024, 1, 30))]
+    assert (day["value_count"], day["value_sum"], day["min_value"], day["max_value"]) == (2, 12.0, 5.0, 7.0)
+    # The latest draw wins, whatever the order records arrive in
+    assert (day["last_value"], day["last_test_date"]) == (5.0, datetime(2024, 1, 30, 9))
+    assert day["out_of_range_count"] == 1
+
+    week = rollups[("Glucose", "week", datetime(2024, 1, 29))]
+    assert (week["value_count"], week["value_sum"], week["min_value"], week["max_value"]) == (3, 15.0, 3.0, 7.0)
+    assert (week["last_value"], week["out_of_range_count"]) == (3.0, 2)
+
+    assert rollups[("Glucose", "month", datetime(2024, 1, 1))]["value_count"] == 2
+    assert rollups[("Glucose", "month", datetime(2024, 2, 1))]["value_count"] == 1
+
+def test_rows_are_sorted_by_series_and_bucket():
+    records = [_record(5.0, datetime(2024, 3, 5), "Sodium"), _record(5.0, datetime(2024, 1, 5), "Glucose")]
+    db = RecordingSession()
+    asyncio.run(apply_rollups(db, USER_ID, records))
+    [(_, rows)] = db.calls
+    keys = [(row["test_category"], row["test_type"], row["bucket"], row["bucket_start"]) for row in rows]
+    assert keys == sorted(keys)
+    assert all(row["user_id"] == USER_ID for row in rows)
+
+def test_no_records_run_no_statement():
+    assert _rollups([]) == {}
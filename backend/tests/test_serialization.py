@@ -0,0 +1,48 @@
+"""Direct row-to-JSON serialization matches the Pydantic response path it replaced."""
+import json
+import random
+import uuid
+from datetime import datetime, timezone
+
+from benchmarks.serialization_bench import Row, make_rows, pydantic_path
+import schemas
+from serialization import dumps, records_to_json
+
+def _row(**columns) -> Row:
+    test_date = datetime(2024, 3, 1, 8, 30)
+    defaults = dict(
+        id=uuid.uuid4(), user_id=uuid.uuid4(), test_category="CBC", test_type="HB", test_value=14.2,
+        unit="g/dL", min_range=12.0, max_range=16.0, test_date=test_date, notes=None,
+        result_flag="normal", range_deviation=0.0, created_at=test_date, updated_at=test_date,
+    )
+    defaults.update(columns)
+    return Row(**defaults)
+
+def test_generated_rows_serialize_identically():
+    random.seed(12)
+    rows = make_rows(500)
+    assert json.loads(records_to_json(rows)) == json.loads(pydantic_path(rows))
+
+def test_edge_case_rows_serialize_identically():
+    rows = [
+        _row(min_range=None, max_range=None, result_flag=None, range_deviation=None),
+        _row(notes="Nüchtern – 空腹 \"quoted\"\n", test_value=0.1 + 0.2),
+        _row(test_date=datetime(2024, 3, 1, 8, 30, 0, 123456), created_at=datetime(2024, 3, 1, 9, 0, 0, 1)),
+        _row(test_value=1e-7, range_deviation=-12.5, result_flag="critical"),
+    ]
+    assert json.loads(records_to_json(rows)) == json.loads(pydantic_path(rows))
+
+def test_test_dates_are_utc_with_a_z_suffix():
+    [record] = json.loads(records_to_json([_row(test_date=datetime(2024, 3, 1, 8, 30, 0, 5))]))
+    assert record["testDate"] == "2024-03-01T08:30:00.000005Z"
+    assert record["createdAt"] == "2024-03-01T08:30:00"
+
+def test_dumps_falls_back_to_the_fastapi_encoder_for_models():
+    row = _row()
+    model = schemas.TestRecordResponse(
+        id=row.id, userId=row.user_id, testCategory=row.test_category, testType=row.test_type,
+        testValue=row.test_value, unit=row.unit, minRange=row.min_range, maxRange=row.max_range,
+        testDate=datetime(2024, 3, 1, 8, 30, tzinfo=timezone.utc), notes=row.notes,
+        createdAt=row.created_at, updatedAt=row.updated_at,
+    )
+    assert json.loads(dumps({"record": model}))["record"]["id"] == str(row.id)
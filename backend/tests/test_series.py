@@ -0,0 +1,157 @@
+"""Batch series: request validation, the query parameters sent and the per-series response shape.
+
+The query test needs TEST_DATABASE_URL, see test_email_service.py.
+"""
+import asyncio
+import os
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import text
+
+from schemas import SeriesBatchRequest
+from series import SERIES_BATCH_SQL, batch_series
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+USER_ID = uuid.UUID("00000000-0000-0000-0000-0000000000aa")
+
+SeriesRow = namedtuple("SeriesRow", [
+    "position", "record_count", "test_dates", "test_values", "min_ranges", "max_ranges", "result_flags",
+])
+
+class RecordingSession:
+    """Answers the batch query with prepared rows and keeps its parameters"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    async def execute(self, statement, params=None):
+        self.calls.append((statement, params))
+        return self.rows
+
+def _points(count: int, start=datetime(2024, 1, 1), high_at=()):
+    dates = [start + timedelta(days=i) for i in range(count)]
+    values = [5.0 + (i % 7) * 0.1 for i in range(count)]
+    flags = ["high" if i in high_at else "normal" for i in range(count)]
+    return dates, values, [4.0] * count, [6.0] * count, flags
+
+def _request(*series, **options) -> SeriesBatchRequest:
+    return SeriesBatchRequest(series=list(series), **options)
+
+def test_request_reads_from_and_to_as_naive_utc():
+    batch = _request({"category": "Blood", "testType": "Glucose", "from": "2024-01-01T02:00:00+02:00", "to": "2024-02-01T00:00:00"})
+    [query] = batch.series
+    assert query.date_from == datetime(2024, 1, 1)
+    assert query.date_to == datetime(2024, 2, 1)
+
+@pytest.mark.parametrize("payload", [
+    {"series": []},
+    {"series": [{"category": "Blood", "testType": "Glucose"}] * 51},
+    {"series": [{"category": "", "testType": "Glucose"}]},
+    {"series": [{"category": "Blood", "testType": "Glucose"}], "maxPoints": 1},
+    {"series": [{"category": "Blood", "testType": "Glucose"}], "downsample": "mean"},
+])
+def test_invalid_requests_are_rejected(payload):
+    with pytest.raises(ValidationError):
+        SeriesBatchRequest(**payload)
+
+def test_query_gets_one_aligned_array_entry_per_series():
+    batch = _request(
+        {"category": "Blood", "testType": "Glucose", "from": "2024-01-01T00:00:00"},
+        {"category": "Blood", "testType": "Sodium", "to": "2024-03-01T00:00:00"},
+        {"category": "Blood", "testType": "Glucose"},
+    )
+    db = RecordingSession([SeriesRow(position, 0, None, None, None, None, None) for position in (1, 2, 3)])
+    asyncio.run(batch_series(db, USER_ID, batch.series))
+    [(statement, params)] = db.calls
+    assert statement is SERIES_BATCH_SQL
+    assert params == {
+        "user_id": USER_ID,
+        "categories": ["Blood", "Blood", "Blood"],
+        "test_types": ["Glucose", "Sodium", "Glucose"],
+        "dates_from": [datetime(2024, 1, 1), None, None],
+        "dates_to": [None, datetime(2024, 3, 1), None],
+    }
+
+def test_response_follows_request_order_and_fills_empty_series():
+    batch = _request({"category": "Blood", "testType": "Glucose"}, {"category": "Iron", "testType": "Ferritin"})
+    dates, values, lows, highs, flags = _points(3)
+    # Rows may come back in any order; positions tie them to the request
+    db = RecordingSession([
+        SeriesRow(2, 0, None, None, None, None, None),
+        SeriesRow(1, 3, dates, values, lows, highs, flags),
+    ])
+    glucose, ferritin = asyncio.run(batch_series(db, USER_ID, batch.series))
+
+    assert (glucose["category"], glucose["testType"], glucose["count"]) == ("Blood", "Glucose", 3)
+    assert glucose["latest"] == {"testDate": "2024-01-03T00:00:00Z", "value": values[-1], "resultFlag": "normal"}
+    assert (glucose["min"], glucose["max"]) == (min(values), max(values))
+    assert glucose["points"]["testDates"] == ["2024-01-01T00:00:00Z", "2024-01-02T00:00:00Z", "2024-01-03T00:00:00Z"]
+    assert glucose["points"]["values"] == values
+
+    assert ferritin == {
+        "category": "Iron", "testType": "Ferritin", "count": 0, "latest": None, "min": None, "max": None,
+        "points": {"testDates": [], "values": [], "minRange": [], "maxRange": [], "resultFlags": []},
+    }
+
+@pytest.mark.parametrize("method", [None, "minmax"])
+def test_long_series_are_downsampled_with_aligned_point_arrays(method):
+    batch = _request({"category": "Blood", "testType": "Glucose"})
+    dates, values, lows, highs, flags = _points(1000, high_at={417})
+    db = RecordingSession([SeriesRow(1, 1000, dates, values, lows, highs, flags)])
+    [entry] = asyncio.run(batch_series(db, USER_ID, batch.series, max_points=50, method=method))
+
+    points = entry["points"]
+    assert entry["count"] == 1000
+    assert len(points["values"]) <= 50
+    assert len({len(column) for column in points.values()}) == 1
+    assert points["testDates"][0] == "2024-01-01T00:00:00Z"
+    # Abnormal results survive downsampling
+    assert "high" in points["resultFlags"]
+    assert entry["latest"]["testDate"] == "2026-09-26T00:00:00Z"
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+def test_batch_query_windows_and_orders_each_series():
+    from sqlalchemy.ext.asyncio import create_async_engine
+    import models
+
+    async def scenario():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        try:
+            async with engine.begin() as conn:
+                for model in (models.User, models.TestRecord):
+                    await conn.run_sync(model.__table__.create, checkfirst=True)
+                user_id = uuid.uuid4()
+                await conn.execute(
+                    text("INSERT INTO users (id, email, hashed_password, first_name, last_name) VALUES (:id, :email, 'x', 'Test', 'User')"),
+                    {"id": user_id, "email": f"series-{user_id.hex[:12]}@example.com"}
+                )
+                await conn.execute(
+                    text("""
+                        INSERT INTO test_records (id, user_id, test_category, test_type, test_value, unit, test_date, created_at, updated_at)
+                        VALUES (:id, :user_id, 'Blood', 'Glucose', :value, 'mmol/L', :test_date, now(), now())
+                    """),
+                    [
+                        {"id": uuid.uuid4(), "user_id": user_id, "value": float(day), "test_date": datetime(2024, 1, day)}
+                        for day in (5, 1, 3, 2, 4)
+                    ]
+                )
+                batch = _request(
+                    {"category": "Blood", "testType": "Glucose", "from": "2024-01-02T00:00:00", "to": "2024-01-04T00:00:00Z"},
+                    {"category": "Blood", "testType": "Sodium"},
+                    {"category": "Blood", "testType": "Glucose"},
+                )
+                return await batch_series(conn, user_id, batch.series)
+        finally:
+            await engine.dispose()
+
+    windowed, missing, whole = asyncio.run(scenario())
+    # Window bounds are inclusive, and points come back oldest first
+    assert windowed["points"]["values"] == [2.0, 3.0, 4.0]
+    assert windowed["latest"]["testDate"] == "2024-01-04T00:00:00Z"
+    assert missing["count"] == 0 and missing["latest"] is None
+    assert whole["points"]["values"] == [1.0, 2.0, 3.0, 4.0, 5.0]
@@ -0,0 +1,6 @@
+from uvicorn.workers import UvicornWorker
+
+class ProductionWorker(UvicornWorker):
+    """Gunicorn worker running the app on uvloop with the httptools parser"""
+
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
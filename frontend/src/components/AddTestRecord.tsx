@@ -1,4 +1,4 @@
-import { useCallback, useContext, useMemo, useState } from 'react';
+import { useCallback, useContext, useEffect, useMemo, useRef, useState } from 'react';
 import { X } from 'lucide-react';
 import toast from 'react-hot-toast';
 import api from '../config/axios';
@@ -99,10 +99,26 @@ interface TestRecord {
 //   return units[testName] || '';
 // };
 
+// crypto.randomUUID only exists in secure contexts; getRandomValues works over plain HTTP too
+const newIdempotencyKey = () => {
+  if (typeof crypto.randomUUID === 'function') {
+    return crypto.randomUUID();
+  }
+  const bytes = crypto.getRandomValues(new Uint8Array(16));
+  return Array.from(bytes, (byte) => byte.toString(16).padStart(2, '0')).join('');
+};
+
 const AddTestRecord = () => {
   const { story } = useContext(StoryBlokContext);
   const [selectedPanel, setSelectedPanel] = useState('');
   const [testRecords, setTestRecords] = useState<TestRecord[]>([]);
+  // One key per submission of the current form contents, reused when saving is retried
+  const idempotencyKey = useRef<string | null>(null);
+
+  useEffect(() => {
+    // Edited records are a new submission; the server maps a key to the records first sent with it
+    idempotencyKey.current = null;
+  }, [selectedPanel, testRecords]);
 
   const testPanels = useMemo(() => {
     return story!.reduce((acc, panel) => {
@@ -233,9 +249,14 @@ const AddTestRecord = () => {
         notes: null
       }));
 
-      // Call the bulk API endpoint
+      // Call the bulk API endpoint; the key makes retries of this submission safe
+      if (!idempotencyKey.current) {
+        idempotencyKey.current = newIdempotencyKey();
+      }
       await api.post('/api/test-records/bulk', {
         records: recordsToSave
+      }, {
+        headers: { 'Idempotency-Key': idempotencyKey.current }
       });
 
       toast.success('Test records saved successfully!');
@@ -1,5 +1,4 @@
 
-import { useEffect, useState } from 'react';
 import {
   ComposedChart,
   Line,
@@ -10,21 +9,22 @@ import {
   Legend,
   ResponsiveContainer,
 } from 'recharts';
-import api from '../config/axios';
 
-interface TestRecord {
-  id: string;
-  userId: string;
-  testCategory: string;
+// One series from POST /api/test-records/series, as parallel arrays oldest first
+export interface TestSeries {
+  category: string;
   testType: string;
-  testValue: number;
-  unit: string;
-  minRange?: number;
-  maxRange?: number;
-  testDate: string;
-  notes?: string;
-  createdAt: string;
-  updatedAt: string;
+  count: number;
+  latest: { testDate: string; value: number; resultFlag?: string | null } | null;
+  min: number | null;
+  max: number | null;
+  points: {
+    testDates: string[];
+    values: number[];
+    minRange: (number | null)[];
+    maxRange: (number | null)[];
+    resultFlags: (string | null)[];
+  };
 }
 
 type SelectedTest = {
@@ -36,84 +36,66 @@ type SelectedTest = {
   }
 }
 
-export default function TestResultVisualCard({ testData }: { testData: SelectedTest }) {
-  const [records, setRecords] = useState<TestRecord[]>([]);
-  const [loading, setLoading] = useState(true);
-  const [error, setError] = useState<string | null>(null);
-  const [dateFilter, setDateFilter] = useState('6 months ago');
-
-  // Calculate date range based on filter
-  const getDateRange = (filter: string) => {
-    const now = new Date();
-    const startDate = new Date();
-    
-    switch (filter) {
-      case 'Last 30 days':
-        startDate.setDate(now.getDate() - 30);
-        break;
-      case 'Last 3 months':
-        startDate.setMonth(now.getMonth() - 3);
-        break;
-      case 'Last 6 months':
-        startDate.setMonth(now.getMonth() - 6);
-        break;
-      case 'Last 1 year':
-        startDate.setFullYear(now.getFullYear() - 1);
-        break;
-      case 'Last 2 years':
-        startDate.setFullYear(now.getFullYear() - 2);
-        break;
-      default:
-        startDate.setMonth(now.getMonth() - 6); // Default to 6 months
-    }
-    
-    return { startDate, endDate: now };
-  };
-
-  useEffect(() => {
-    const fetchTestRecords = async () => {
-      try {
-        setLoading(true);
-        setError(null);
-        
-        // Fetch records for the specific test type within the category
-        const response = await api.get(`/api/test-records/category/${testData.category}`);
-        const allRecords = response.data;
-        
-        // Get date range for filtering
-        const { startDate, endDate } = getDateRange(dateFilter);
-        
-        // Filter by test type and date range
-        const filteredRecords = allRecords
-          .filter((record: TestRecord) => {
-            const recordDate = new Date(record.testDate);
-            return record.testType === testData.test.name && 
-                   recordDate >= startDate && 
-                   recordDate <= endDate;
-          })
-          .sort((a: TestRecord, b: TestRecord) => new Date(a.testDate).getTime() - new Date(b.testDate).getTime());
-        
-        setRecords(filteredRecords);
-      } catch (err) {
-        console.error('Error fetching test records:', err);
-        setError('Failed to load test records');
-      } finally {
-        setLoading(false);
-      }
-    };
+export const DATE_FILTERS = ['Last 30 days', 'Last 3 months', 'Last 6 months', 'Last 1 year', 'Last 2 years'];
+export const DEFAULT_DATE_FILTER = 'Last 6 months';
+
+// Calculate the start of the date range for a filter; day granularity keeps the request (and its ETag) stable
+export const getDateRangeStart = (filter: string) => {
+  const startDate = new Date();
+
+  switch (filter) {
+    case 'Last 30 days':
+      startDate.setDate(startDate.getDate() - 30);
+      break;
+    case 'Last 3 months':
+      startDate.setMonth(startDate.getMonth() - 3);
+      break;
+    case 'Last 6 months':
+      startDate.setMonth(startDate.getMonth() - 6);
+      break;
+    case 'Last 1 year':
+      startDate.setFullYear(startDate.getFullYear() - 1);
+      break;
+    case 'Last 2 years':
+      startDate.setFullYear(startDate.getFullYear() - 2);
+      break;
+    default:
+      startDate.setMonth(startDate.getMonth() - 6); // Default to 6 months
+  }
 
-    if (testData.category && testData.test.name) {
-      fetchTestRecords();
-    }
-  }, [testData.category, testData.test.name, dateFilter]);
+  startDate.setHours(0, 0, 0, 0);
+  return startDate;
+};
+
+interface TestResultVisualCardProps {
+  testData: SelectedTest;
+  series?: TestSeries;
+  loading: boolean;
+  error: string | null;
+  dateFilter: string;
+  onDateFilterChange: (filter: string) => void;
+}
 
+export default function TestResultVisualCard({
+  testData,
+  series,
+  loading,
+  error,
+  dateFilter,
+  onDateFilterChange,
+}: TestResultVisualCardProps) {
   // Transform records for the chart
-  const chartData = records.map(record => ({
-    name: new Date(record.testDate).toLocaleDateString('en-US', { month: 'short', day: 'numeric' }),
-    value: record.testValue,
-    range: record.minRange && record.maxRange ? [record.minRange, record.maxRange] : [0, 0],
-    date: record.testDate,
-  }));
+  const points = series?.points;
+  const chartData = (points?.testDates ?? []).map((testDate, index) => {
+    const minRange = points!.minRange[index];
+    const maxRange = points!.maxRange[index];
+    return {
+      name: new Date(testDate).toLocaleDateString('en-US', { month: 'short', day: 'numeric' }),
+      value: points!.values[index],
+      range: minRange && maxRange ? [minRange, maxRange] : [0, 0],
+      date: testDate,
+    };
+  });
 
   return (
     <section className="bg-[#111827] mb-12">
@@ -121,6 +103,11 @@ export default function TestResultVisualCard({ testData }: { testData: SelectedT
         <div className="">
             <h2 className="text-lg font-semibold text-gray-900">{testData.test.name}</h2>
             <p className="text-xs text-gray-500">{testData.category}</p>
+            {series?.latest && (
+              <p className="text-xs text-gray-500">
+                Latest {series.latest.value} {testData.test.unit} · {series.count} result{series.count === 1 ? '' : 's'} in this period
+              </p>
+            )}
         </div>
         {/* Filter by date (1 month ago, 3 months ago, 6 months ago, 1 year ago, 2 years ago, 5 years ago) selection */}
         <div className="flex items-center gap-2">
@@ -128,13 +115,11 @@ export default function TestResultVisualCard({ testData }: { testData: SelectedT
             title="Filter by date" 
             className="border border-gray-300 rounded-md p-1"
             value={dateFilter}
-            onChange={(e) => setDateFilter(e.target.value)}
+            onChange={(e) => onDateFilterChange(e.target.value)}
           >
-            <option value="Last 30 days">Last 30 days</option>
-            <option value="Last 3 months">Last 3 months</option>
-            <option value="Last 6 months">Last 6 months</option>
-            <option value="Last 1 year">Last 1 year</option>  
-            <option value="Last 2 years">Last 2 years</option>
+            {DATE_FILTERS.map((filter) => (
+              <option key={filter} value={filter}>{filter}</option>
+            ))}
           </select>
         </div>
       </div>
@@ -148,7 +133,7 @@ export default function TestResultVisualCard({ testData }: { testData: SelectedT
             <div className="w-full h-64 flex items-center justify-center">
               <div className="text-red-500">{error}</div>
             </div>
-          ) : records.length === 0 ? (
+          ) : chartData.length === 0 ? (
             <div className="w-full h-64 flex items-center justify-center">
               <div className="text-gray-500">No test records found for {testData.test.name}</div>
             </div>
@@ -6,6 +6,16 @@ interface Test {
     id: string;
 }
 
+export interface CatalogueTest {
+    testType: string;
+    unit: string;
+    recordCount: number;
+    firstTestDate: string;
+    lastTestDate: string;
+    lastValue: number;
+    lastResultFlag?: string | null;
+}
+
 interface TestGroup {
     category: string;
     tests: Test[];
@@ -16,13 +26,15 @@ interface TestSelectionModalProps {
     onTestSelect: (category: string, test: Test) => void;
     onTestRemove: (category: string, test: Test) => void;
     selectedTests: Array<{ category: string; test: Test }>;
+    catalogue?: Record<string, CatalogueTest>;
 }
 
 export default function TestSelectionModal({ 
     testGroups, 
     onTestSelect, 
     onTestRemove,
-    selectedTests 
+    selectedTests,
+    catalogue = {}
 }: TestSelectionModalProps) {
     const [selectedCategory, setSelectedCategory] = useState<string | null>(null);
 
@@ -30,6 +42,16 @@ export default function TestSelectionModal({
         return selectedTests.some(st => st.category === category && st.test.id === testId);
     };
 
+    const recordedSummary = (category: string, testName: string) => {
+        const recorded = catalogue[`${category}|${testName}`];
+        if (!recorded) {
+            return 'No results yet';
+        }
+        const results = `${recorded.recordCount} result${recorded.recordCount === 1 ? '' : 's'}`;
+        const lastDate = new Date(recorded.lastTestDate).toLocaleDateString();
+        return `${results} · last ${recorded.lastValue} ${recorded.unit} on ${lastDate}`;
+    };
+
     const handleTestClick = (category: string, test: Test) => {
         if (isTestSelected(category, test.id)) {
             onTestRemove(category, test);
@@ -84,6 +106,9 @@ export default function TestSelectionModal({
                                     <div className="text-sm text-gray-500">
                                         Unit: {test.unit}
                                     </div>
+                                    <div className="text-xs text-gray-400 mt-1">
+                                        {recordedSummary(selectedCategory, test.name)}
+                                    </div>
                                 </button>
                             ))}
                     </div>
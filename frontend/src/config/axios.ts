@@ -7,6 +7,8 @@ const baseURL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 const api = axios.create({
   baseURL,
   timeout: 10000,
+  // Sends the API's last_write cookie, which keeps reads after a write off a lagging replica
+  withCredentials: true,
   headers: {
     'Content-Type': 'application/json',
   },
@@ -26,6 +28,30 @@ api.interceptors.request.use(
   }
 );
 
+// Refresh tokens rotate on every use, so concurrent 401s share one refresh request
+let refreshPromise: Promise<string> | null = null;
+
+const refreshAccessToken = (refreshToken: string): Promise<string> => {
+  if (!refreshPromise) {
+    refreshPromise = api
+      .post('/api/auth/refresh', { refresh_token: refreshToken })
+      .then((response) => {
+        const { access_token, refresh_token } = response.data;
+
+        // Update tokens in localStorage
+        localStorage.setItem('access_token', access_token);
+        if (refresh_token) {
+          localStorage.setItem('refresh_token', refresh_token);
+        }
+        return access_token as string;
+      })
+      .finally(() => {
+        refreshPromise = null;
+      });
+  }
+  return refreshPromise;
+};
+
 // Response interceptor for error handling and token refresh
 api.interceptors.response.use(
   (response) => response,
@@ -33,7 +59,11 @@ api.interceptors.response.use(
     const originalRequest = error.config;
 
     // If the error is 401 and we haven't already tried to refresh
-    if (error.response?.status === 401 && !originalRequest._retry) {
+    if (
+      error.response?.status === 401 &&
+      !originalRequest._retry &&
+      originalRequest.url !== '/api/auth/refresh'
+    ) {
       originalRequest._retry = true;
 
       const refreshToken = localStorage.getItem('refresh_token');
@@ -41,17 +71,7 @@ api.interceptors.response.use(
       if (refreshToken) {
         try {
           // Try to refresh the token
-          const response = await api.post('/api/auth/refresh', {
-            refresh_token: refreshToken
-          });
-
-          const { access_token, refresh_token } = response.data;
-          
-          // Update tokens in localStorage
-          localStorage.setItem('access_token', access_token);
-          if (refresh_token) {
-            localStorage.setItem('refresh_token', refresh_token);
-          }
+          const access_token = await refreshAccessToken(refreshToken);
 
           // Update the original request with new token
           originalRequest.headers.Authorization = `Bearer ${access_token}`;
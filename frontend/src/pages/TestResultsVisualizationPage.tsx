@@ -1,9 +1,12 @@
-import { useContext, useState } from "react";
-import TestResultVisualCard from "../components/TestResultVisualCard";
+import { useContext, useEffect, useState } from "react";
+import TestResultVisualCard, { DEFAULT_DATE_FILTER, TestSeries, getDateRangeStart } from "../components/TestResultVisualCard";
 import Modal from "../components/Modal";
-import TestSelectionModal from "../components/TestSelectionModal";
+import TestSelectionModal, { CatalogueTest } from "../components/TestSelectionModal";
 import { StoryBlokContext } from "../contexts/StoryBlokContext";
+import api from "../config/axios";
 
+// Points per chart; longer histories are downsampled on the server, keeping out-of-range results
+const SERIES_MAX_POINTS = 300;
 
 export const TestResultsVisualizationPage = () => {
     const { story } = useContext(StoryBlokContext);
@@ -17,6 +20,65 @@ export const TestResultsVisualizationPage = () => {
     }
     const [selectedTests, setSelectedTests] = useState<SelectedTest[]>([]);
     const [isModalOpen, setIsModalOpen] = useState(false);
+    // Recorded tests keyed by "category|testType", from the per-user catalogue
+    const [catalogue, setCatalogue] = useState<Record<string, CatalogueTest>>({});
+    // Date filter per card, and the series for every card, loaded in one batch request
+    const [dateFilters, setDateFilters] = useState<Record<string, string>>({});
+    const [series, setSeries] = useState<Record<string, TestSeries>>({});
+    const [seriesLoading, setSeriesLoading] = useState(false);
+    const [seriesError, setSeriesError] = useState<string | null>(null);
+
+    const cardKey = (selected: SelectedTest) => `${selected.category}-${selected.test.id}`;
+    const filterFor = (selected: SelectedTest) => dateFilters[cardKey(selected)] ?? DEFAULT_DATE_FILTER;
+
+    useEffect(() => {
+        if (selectedTests.length === 0) {
+            setSeries({});
+            return;
+        }
+        let cancelled = false;
+        const fetchSeries = async () => {
+            try {
+                setSeriesLoading(true);
+                setSeriesError(null);
+                const response = await api.post('/api/test-records/series', {
+                    series: selectedTests.map((selected) => ({
+                        category: selected.category,
+                        testType: selected.test.name,
+                        from: getDateRangeStart(filterFor(selected)).toISOString(),
+                    })),
+                    maxPoints: SERIES_MAX_POINTS,
+                });
+                if (cancelled) {
+                    return;
+                }
+                // Series come back in request order
+                const loaded: Record<string, TestSeries> = {};
+                response.data.forEach((item: TestSeries, index: number) => {
+                    loaded[cardKey(selectedTests[index])] = item;
+                });
+                setSeries(loaded);
+            } catch (err) {
+                console.error('Error fetching test series:', err);
+                if (!cancelled) {
+                    setSeriesError('Failed to load test records');
+                }
+            } finally {
+                if (!cancelled) {
+                    setSeriesLoading(false);
+                }
+            }
+        };
+        fetchSeries();
+        return () => {
+            cancelled = true;
+        };
+        // eslint-disable-next-line react-hooks/exhaustive-deps
+    }, [selectedTests, dateFilters]);
+
+    const handleDateFilterChange = (selected: SelectedTest, filter: string) => {
+        setDateFilters({ ...dateFilters, [cardKey(selected)]: filter });
+    };
 
     const testSelected = selectedTests.length > 0;
 
@@ -30,8 +92,24 @@ export const TestResultsVisualizationPage = () => {
         ));
     };
 
+    const loadCatalogue = async () => {
+        try {
+            const response = await api.get('/api/test-records/catalogue');
+            const entries: Record<string, CatalogueTest> = {};
+            for (const category of response.data) {
+                for (const test of category.tests) {
+                    entries[`${category.category}|${test.testType}`] = test;
+                }
+            }
+            setCatalogue(entries);
+        } catch (err) {
+            console.error('Error fetching test catalogue:', err);
+        }
+    };
+
     const handleOpenModal = () => {
         setIsModalOpen(true);
+        loadCatalogue();
     };
 
     const handleCloseModal = () => {
@@ -42,7 +120,17 @@ export const TestResultsVisualizationPage = () => {
     return (
         <>
             {
-                selectedTests.map((group) => (<TestResultVisualCard key={`${group.category}-${group.test.id}`} testData={group} /> ))
+                selectedTests.map((group) => (
+                    <TestResultVisualCard
+                        key={cardKey(group)}
+                        testData={group}
+                        series={series[cardKey(group)]}
+                        loading={seriesLoading && !series[cardKey(group)]}
+                        error={seriesError}
+                        dateFilter={filterFor(group)}
+                        onDateFilterChange={(filter) => handleDateFilterChange(group, filter)}
+                    />
+                ))
             }
             <div className="bg-[#141b2b] rounded-lg">
                 <div className="px-6 py-4 border-b border-gray-200 bg-white">
@@ -68,6 +156,7 @@ export const TestResultsVisualizationPage = () => {
                         onTestSelect={handleTestSelect}
                         onTestRemove={handleTestRemove}
                         selectedTests={selectedTests}
+                        catalogue={catalogue}
                     />
                 </Modal>
             </div>
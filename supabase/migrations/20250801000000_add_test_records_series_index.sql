@@ -0,0 +1,3 @@
+-- Composite index for per-series chart queries (category + test type + date window)
+CREATE INDEX IF NOT EXISTS ix_test_records_user_category_type_date
+    ON test_records(user_id, test_category, test_type, test_date);
@@ -0,0 +1,34 @@
+-- Result flag and range deviation computed at write time (see backend/abnormal.py)
+ALTER TABLE test_records ADD COLUMN IF NOT EXISTS result_flag TEXT;
+ALTER TABLE test_records ADD COLUMN IF NOT EXISTS range_deviation DOUBLE PRECISION;
+
+-- Backfill existing rows; 0.5 range widths matches the default ABNORMAL_CRITICAL_DEVIATION
+WITH scored AS (
+    SELECT id,
+           CASE
+               WHEN min_range IS NOT NULL AND test_value < min_range
+                   THEN (test_value - min_range) / COALESCE(max_range - min_range, NULLIF(abs(min_range), 0), 1)
+               WHEN max_range IS NOT NULL AND test_value > max_range
+                   THEN (test_value - max_range) / COALESCE(max_range - min_range, NULLIF(abs(max_range), 0), 1)
+               ELSE 0
+           END AS deviation
+    FROM test_records
+    WHERE result_flag IS NULL
+      AND (min_range IS NOT NULL OR max_range IS NOT NULL)
+)
+UPDATE test_records t
+SET range_deviation = s.deviation,
+    result_flag = CASE
+        WHEN abs(s.deviation) >= 0.5 THEN 'critical'
+        WHEN s.deviation < 0 THEN 'low'
+        WHEN s.deviation > 0 THEN 'high'
+        ELSE 'normal'
+    END
+FROM scored s
+WHERE t.id = s.id;
+
+-- Partial indexes over abnormal results only
+CREATE INDEX IF NOT EXISTS ix_test_records_abnormal_user_date
+    ON test_records(user_id, test_date) WHERE result_flag <> 'normal';
+CREATE INDEX IF NOT EXISTS ix_test_records_abnormal_date
+    ON test_records(test_date) WHERE result_flag <> 'normal';
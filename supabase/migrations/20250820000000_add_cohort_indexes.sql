@@ -0,0 +1,8 @@
+-- Cohort queries read one test type across all patients by date window
+CREATE INDEX IF NOT EXISTS ix_test_records_category_type_date
+    ON test_records(test_category, test_type, test_date) INCLUDE (test_value);
+
+-- Cohort abnormal rates and value ranges sum rollup buckets across all patients
+CREATE INDEX IF NOT EXISTS ix_test_record_rollups_category_type_bucket
+    ON test_record_rollups(test_category, test_type, bucket, bucket_start)
+    INCLUDE (value_count, out_of_range_count, min_value, max_value);